@@ -42,6 +42,11 @@ app.secret_key = app.config['SECRET_KEY']
 # Tạo thư mục uploads nếu chưa tồn tại
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Khởi tạo/nâng cấp cơ sở dữ liệu giám sát IP
+ip_monitoring.DB_PATH = app.config['DB_PATH']
+ip_monitoring.init_database()
+ip_monitoring.start_retention_worker()
+
 @app.route('/')
 @auth.login_required
 def index():
@@ -581,66 +586,66 @@ def api_create_backup():
             os.makedirs(backup_dir)
         
         # Kết nối đến MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
-        
-        # Chuẩn bị tham số cho API command
-        if backup_type == 'backup':
-            # Thêm phần mở rộng .backup nếu chưa có
-            if not name.endswith('.backup'):
-                name += '.backup'
-                
-            file_path = os.path.join(backup_dir, name)
-            
-            # Tạo backup file
-            device.system.backup.save(name=name)
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
             
-            # Tạo filename để download backup
-            download_filename = name
-            
-        else:  # export
-            # Thêm phần mở rộng .rsc nếu chưa có
-            if not name.endswith('.rsc'):
-                name += '.rsc'
+            # Chuẩn bị tham số cho API command
+            if backup_type == 'backup':
+                # Thêm phần mở rộng .backup nếu chưa có
+                if not name.endswith('.backup'):
+                    name += '.backup'
+                    
+                file_path = os.path.join(backup_dir, name)
                 
-            file_path = os.path.join(backup_dir, name)
-            
-            # Tạo export file
-            cmd = '/export'
-            if not include_sensitive:
-                cmd += ' hide-sensitive'
-            
-            export_result = device.command(cmd)
+                # Tạo backup file
+                device.system.backup.save(name=name)
+                
+                # Tạo filename để download backup
+                download_filename = name
+                
+            else:  # export
+                # Thêm phần mở rộng .rsc nếu chưa có
+                if not name.endswith('.rsc'):
+                    name += '.rsc'
+                    
+                file_path = os.path.join(backup_dir, name)
+                
+                # Tạo export file
+                cmd = '/export'
+                if not include_sensitive:
+                    cmd += ' hide-sensitive'
+                
+                export_result = device.command(cmd)
+                
+                # Lưu kết quả export vào file
+                with open(file_path, 'w') as f:
+                    for line in export_result:
+                        f.write(line + '\n')
+                
+                # Tạo filename để download export
+                download_filename = name
             
-            # Lưu kết quả export vào file
-            with open(file_path, 'w') as f:
-                for line in export_result:
-                    f.write(line + '\n')
+            # Tạo file_info để trả về
+            file_stat = os.stat(file_path)
+            file_info = {
+                'name': name,
+                'path': file_path,
+                'size': file_stat.st_size,
+                'created': datetime.datetime.fromtimestamp(file_stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
+                'modified': datetime.datetime.fromtimestamp(file_stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+                'type': backup_type,
+                'device_id': device_id
+            }
             
-            # Tạo filename để download export
-            download_filename = name
-        
-        # Tạo file_info để trả về
-        file_stat = os.stat(file_path)
-        file_info = {
-            'name': name,
-            'path': file_path,
-            'size': file_stat.st_size,
-            'created': datetime.datetime.fromtimestamp(file_stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
-            'modified': datetime.datetime.fromtimestamp(file_stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-            'type': backup_type,
-            'device_id': device_id
-        }
+            logger.info(f"Đã tạo {backup_type} file: {name}")
+            return jsonify({
+                'success': True,
+                'message': f'Đã tạo {backup_type} thành công',
+                'data': file_info,
+                'scheduled': False
+            })
         
-        logger.info(f"Đã tạo {backup_type} file: {name}")
-        return jsonify({
-            'success': True,
-            'message': f'Đã tạo {backup_type} thành công',
-            'data': file_info,
-            'scheduled': False
-        })
-    
     except Exception as e:
         logger.error(f"Lỗi khi tạo backup: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -691,40 +696,40 @@ def api_restore_backup():
             return jsonify({'success': False, 'error': 'File không tồn tại'})
         
         # Kết nối đến MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
-        
-        # Xác định loại file và khôi phục theo cách phù hợp
-        if filename.endswith('.backup'):
-            # Upload và restore backup file
-            device.file.upload(file=file_path, name=filename)
-            device.system.backup.load(name=filename)
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
             
-            message = "Đã khôi phục thiết bị từ file backup. Thiết bị sẽ khởi động lại."
-            
-        elif filename.endswith('.rsc'):
-            # Đọc nội dung file export và thực thi từng dòng
-            with open(file_path, 'r') as f:
-                export_content = f.read()
-            
-            # Thực thi script
-            device.command('/import', input=export_content)
-            
-            message = "Đã áp dụng cấu hình từ file export."
+            # Xác định loại file và khôi phục theo cách phù hợp
+            if filename.endswith('.backup'):
+                # Upload và restore backup file
+                device.file.upload(file=file_path, name=filename)
+                device.system.backup.load(name=filename)
+                
+                message = "Đã khôi phục thiết bị từ file backup. Thiết bị sẽ khởi động lại."
+                
+            elif filename.endswith('.rsc'):
+                # Đọc nội dung file export và thực thi từng dòng
+                with open(file_path, 'r') as f:
+                    export_content = f.read()
+                
+                # Thực thi script
+                device.command('/import', input=export_content)
+                
+                message = "Đã áp dụng cấu hình từ file export."
+                
+            else:
+                return jsonify({
+                    'success': False, 
+                    'error': 'Định dạng file không được hỗ trợ. Chỉ hỗ trợ .backup hoặc .rsc'
+                })
             
-        else:
+            logger.info(f"Đã khôi phục từ file {filename}")
             return jsonify({
-                'success': False, 
-                'error': 'Định dạng file không được hỗ trợ. Chỉ hỗ trợ .backup hoặc .rsc'
+                'success': True,
+                'message': message
             })
         
-        logger.info(f"Đã khôi phục từ file {filename}")
-        return jsonify({
-            'success': True,
-            'message': message
-        })
-    
     except Exception as e:
         logger.error(f"Lỗi khi khôi phục backup: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -822,58 +827,36 @@ def api_ip_list():
     """API lấy danh sách IP"""
     try:
         # Lấy danh sách IP từ MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+                
+            # Ghép dữ liệu từ một lần đọc mỗi bảng thay vì truy vấn theo từng IP
+            ips = mikrotik_utils.build_ip_snapshot(device)
             
-        ip_addresses = device.ip.address.get()
-        
-        # Xử lý và định dạng dữ liệu
-        ips = []
-        stats = {
-            'total': 0,
-            'active': 0,
-            'inactive': 0,
-            'monitored': 0
-        }
-        
-        for ip in ip_addresses:
-            ip_data = {
-                'address': ip.get('address'),
-                'interface': ip.get('interface'),
-                'mac_address': mikrotik_utils.get_mac_address(ip.get('interface')),
-                'status': 'active' if mikrotik_utils.is_ip_active(ip.get('address')) else 'inactive',
-                'traffic_in': mikrotik_utils.get_interface_traffic(ip.get('interface'), 'in'),
-                'traffic_out': mikrotik_utils.get_interface_traffic(ip.get('interface'), 'out'),
-                'last_seen': mikrotik_utils.get_last_seen(ip.get('address')),
-                'monitoring': ip_monitoring.is_ip_monitored(ip.get('address'))
+            # Cập nhật thống kê
+            stats = {
+                'total': len(ips),
+                'active': sum(1 for ip_data in ips if ip_data['status'] == 'active'),
+                'inactive': sum(1 for ip_data in ips if ip_data['status'] != 'active'),
+                'monitored': sum(1 for ip_data in ips if ip_data['monitoring'])
             }
             
-            ips.append(ip_data)
-            
-            # Cập nhật thống kê
-            stats['total'] += 1
-            if ip_data['status'] == 'active':
-                stats['active'] += 1
-            else:
-                stats['inactive'] += 1
-            if ip_data['monitoring']:
-                stats['monitored'] += 1
-        
-        # Lấy dữ liệu cho biểu đồ
-        charts = {
-            'traffic': mikrotik_utils.get_traffic_chart_data(),
-            'distribution': mikrotik_utils.get_ip_distribution_data()
-        }
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'ips': ips,
-                'stats': stats,
-                'charts': charts
+            # Lấy dữ liệu cho biểu đồ
+            max_points = request.args.get('max_points', 300, type=int)
+            charts = {
+                'traffic': mikrotik_utils.get_traffic_chart_data(max_points=max_points),
+                'distribution': mikrotik_utils.get_ip_distribution_data()
             }
-        })
+            
+            return jsonify({
+                'success': True,
+                'data': {
+                    'ips': ips,
+                    'stats': stats,
+                    'charts': charts
+                }
+            })
     except Exception as e:
         logger.error(f"Lỗi khi lấy danh sách IP: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -884,36 +867,36 @@ def api_ip_details(ip_address):
     """API lấy chi tiết IP"""
     try:
         # Lấy thông tin chi tiết về IP từ MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+                
+            ip_data = device.ip.address.get(address=ip_address)
             
-        ip_data = device.ip.address.get(address=ip_address)
-        
-        if not ip_data:
-            return jsonify({'success': False, 'error': 'IP không tồn tại'})
-        
-        # Lấy thông tin bổ sung
-        interface = ip_data[0].get('interface')
-        mac_address = mikrotik_utils.get_mac_address(interface)
-        
-        # Lấy lịch sử của IP
-        history = ip_monitoring.get_ip_history(ip_address)
-        
-        # Tạo đối tượng response
-        response = {
-            'address': ip_address,
-            'interface': interface,
-            'mac_address': mac_address,
-            'status': 'active' if mikrotik_utils.is_ip_active(ip_address) else 'inactive',
-            'traffic_in': mikrotik_utils.get_interface_traffic(interface, 'in'),
-            'traffic_out': mikrotik_utils.get_interface_traffic(interface, 'out'),
-            'last_seen': mikrotik_utils.get_last_seen(ip_address),
-            'monitoring': ip_monitoring.is_ip_monitored(ip_address),
-            'history': history
-        }
-        
-        return jsonify({'success': True, 'data': response})
+            if not ip_data:
+                return jsonify({'success': False, 'error': 'IP không tồn tại'})
+            
+            # Lấy thông tin bổ sung
+            interface = ip_data[0].get('interface')
+            mac_address = mikrotik_utils.get_mac_address(interface, api=device)
+            
+            # Lấy lịch sử của IP
+            history = ip_monitoring.get_ip_history(ip_address)
+            
+            # Tạo đối tượng response
+            response = {
+                'address': ip_address,
+                'interface': interface,
+                'mac_address': mac_address,
+                'status': 'active' if mikrotik_utils.is_ip_active(ip_address) else 'inactive',
+                'traffic_in': mikrotik_utils.get_interface_traffic(interface, 'in', api=device),
+                'traffic_out': mikrotik_utils.get_interface_traffic(interface, 'out', api=device),
+                'last_seen': mikrotik_utils.get_last_seen(ip_address, api=device),
+                'monitoring': ip_monitoring.is_ip_monitored(ip_address),
+                'history': history
+            }
+            
+            return jsonify({'success': True, 'data': response})
     except Exception as e:
         logger.error(f"Lỗi khi lấy thông tin IP {ip_address}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -932,21 +915,21 @@ def api_add_ip():
                 return jsonify({'success': False, 'error': f'Thiếu trường {field}'})
         
         # Thêm IP vào MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+                
+            device.ip.address.add(
+                address=data['address'],
+                interface=data['interface']
+            )
             
-        device.ip.address.add(
-            address=data['address'],
-            interface=data['interface']
-        )
-        
-        # Bật monitoring nếu được yêu cầu
-        if data.get('monitoring'):
-            ip_monitoring.enable_ip_monitoring(data['address'])
-        
-        logger.info(f"Đã thêm IP {data['address']}")
-        return jsonify({'success': True})
+            # Bật monitoring nếu được yêu cầu
+            if data.get('monitoring'):
+                ip_monitoring.enable_ip_monitoring(data['address'])
+            
+            logger.info(f"Đã thêm IP {data['address']}")
+            return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Lỗi khi thêm IP: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -957,17 +940,17 @@ def api_delete_ip(ip_address):
     """API xóa IP"""
     try:
         # Xóa IP khỏi MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+                
+            device.ip.address.remove(address=ip_address)
             
-        device.ip.address.remove(address=ip_address)
-        
-        # Tắt monitoring nếu đang bật
-        ip_monitoring.disable_ip_monitoring(ip_address)
-        
-        logger.info(f"Đã xóa IP {ip_address}")
-        return jsonify({'success': True})
+            # Tắt monitoring nếu đang bật
+            ip_monitoring.disable_ip_monitoring(ip_address)
+            
+            logger.info(f"Đã xóa IP {ip_address}")
+            return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Lỗi khi xóa IP {ip_address}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -980,34 +963,37 @@ def api_search_ip():
         query = request.args.get('q', '')
         
         # Tìm kiếm IP từ MikroTik
-        device = mikrotik_utils.get_mikrotik_connection()
-        if not device:
-            return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+        with mikrotik_utils.mikrotik_connection() as device:
+            if not device:
+                return jsonify({'success': False, 'error': 'Không thể kết nối đến MikroTik'})
+                
+            ip_addresses = device.ip.address.get()
             
-        ip_addresses = device.ip.address.get()
-        
-        # Lọc kết quả theo query
-        results = []
-        for ip in ip_addresses:
-            if query.lower() in ip.get('address', '').lower() or \
-               query.lower() in ip.get('interface', '').lower():
-                ip_data = {
-                    'address': ip.get('address'),
-                    'interface': ip.get('interface'),
-                    'mac_address': mikrotik_utils.get_mac_address(ip.get('interface')),
-                    'status': 'active' if mikrotik_utils.is_ip_active(ip.get('address')) else 'inactive',
-                    'traffic_in': mikrotik_utils.get_interface_traffic(ip.get('interface'), 'in'),
-                    'traffic_out': mikrotik_utils.get_interface_traffic(ip.get('interface'), 'out'),
-                    'last_seen': mikrotik_utils.get_last_seen(ip.get('address')),
-                    'monitoring': ip_monitoring.is_ip_monitored(ip.get('address'))
-                }
-                results.append(ip_data)
-        
-        return jsonify({'success': True, 'data': results})
+            # Lọc kết quả theo query rồi ghép dữ liệu cho các IP khớp
+            matched = [
+                ip for ip in ip_addresses
+                if query.lower() in ip.get('address', '').lower() or
+                query.lower() in ip.get('interface', '').lower()
+            ]
+            results = mikrotik_utils.build_ip_snapshot(device, addresses=matched) if matched else []
+            
+            return jsonify({'success': True, 'data': results})
     except Exception as e:
         logger.error(f"Lỗi khi tìm kiếm IP: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/mikrotik/pool')
+@auth.login_required
+def api_mikrotik_pool_stats():
+    """API lấy thống kê pool kết nối MikroTik"""
+    return jsonify({'success': True, 'data': mikrotik_utils.get_connection_pool_stats()})
+
+@app.route('/api/ip/writer')
+@auth.login_required
+def api_ip_writer_stats():
+    """API lấy thống kê hàng đợi ghi cơ sở dữ liệu giám sát IP"""
+    return jsonify({'success': True, 'data': ip_monitoring.get_writer_stats()})
+
 # Route cho xác thực
 @app.route('/login', methods=['GET', 'POST'])
 def login():
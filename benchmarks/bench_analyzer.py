@@ -0,0 +1,174 @@
+"""
+Benchmark phân tích lịch sử traffic (mikrotik-msc/mikrotik_analytics.py)
+
+Tạo database traffic_data tổng hợp (mặc định 50 triệu dòng, chia đều cho
+INTERFACES interface, mỗi mẫu cách nhau 10 giây), rồi đo trên một interface:
+
+- đọc bảng: fetchall + rows_to_array (cách cũ) so với fetch_array
+- thống kê theo ngày (trung bình, cao nhất, p95, lưu lượng): vòng lặp Python
+  theo từng dòng so với period_summary
+- tốc độ tính cước p95 và trung bình trượt
+
+Database được giữ lại và dùng lại ở lần chạy sau nếu đủ số dòng.
+
+Chạy: python benchmarks/bench_analyzer.py [số_dòng] [đường_dẫn_db]
+"""
+
+import os
+import sys
+import math
+import time
+import sqlite3
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mikrotik-msc'))
+
+from mikrotik_columnar import SQLiteTrafficSource, rows_to_array
+from mikrotik_analytics import DAY, billing_percentile, moving_average, period_summary
+
+INTERFACES = 8
+INTERVAL = 10
+BATCH_ROWS = 1_000_000
+
+
+def build_database(path, rows):
+    """Tạo (hoặc dùng lại) database có ít nhất `rows` dòng traffic_data"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS traffic_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            interface_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            tx_bytes INTEGER,
+            rx_bytes INTEGER,
+            tx_packets INTEGER,
+            rx_packets INTEGER,
+            tx_rate_kbps REAL,
+            rx_rate_kbps REAL
+        )
+    ''')
+    existing = conn.execute('SELECT COUNT(*) FROM traffic_data').fetchone()[0]
+    if existing >= rows:
+        return conn, existing
+
+    conn.execute('DELETE FROM traffic_data')
+    conn.commit()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    rng = np.random.default_rng(7)
+    start = np.datetime64('2026-01-01T00:00:00', 's').astype(np.int64)
+    per_interface = rows // INTERFACES
+    counters = np.zeros((INTERFACES, 2), dtype=np.int64)
+
+    began = time.perf_counter()
+    for offset in range(0, per_interface, BATCH_ROWS // INTERFACES):
+        size = min(BATCH_ROWS // INTERFACES, per_interface - offset)
+        seconds = start + (offset + np.arange(size)) * INTERVAL
+        text = np.char.replace(seconds.astype('datetime64[s]').astype(str), 'T', ' ')
+        for interface_id in range(INTERFACES):
+            # Tải theo chu kỳ ngày cộng nhiễu, đơn vị byte mỗi chu kỳ
+            load = (1 + np.sin(seconds / DAY * 2 * np.pi)) * 5e6
+            increments = rng.poisson(load[:, None] + 1e5, (size, 2))
+            totals = counters[interface_id] + np.cumsum(increments, axis=0)
+            counters[interface_id] = totals[-1]
+            rates = increments * 8 / 1024 / INTERVAL
+            conn.executemany(
+                'INSERT INTO traffic_data (interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, '
+                'tx_rate_kbps, rx_rate_kbps) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                zip([interface_id + 1] * size, text.tolist(), totals[:, 0].tolist(), totals[:, 1].tolist(),
+                    (totals[:, 0] // 1000).tolist(), (totals[:, 1] // 1000).tolist(),
+                    rates[:, 0].tolist(), rates[:, 1].tolist()))
+        conn.commit()
+        print(f"\r  đã ghi {(offset + size) * INTERFACES:,} dòng", end='', flush=True)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_traffic_data_interface_time ON traffic_data (interface_id, timestamp)')
+    conn.commit()
+    print(f"\n  tạo database: {time.perf_counter() - began:.1f} s")
+    return conn, per_interface * INTERFACES
+
+
+def load_rows(conn, interface_id):
+    """Cách đọc cũ: fetchall ra list tuple rồi chuyển sang mảng"""
+    rows = conn.execute('''
+        SELECT timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+        FROM traffic_data WHERE interface_id = ? ORDER BY timestamp
+    ''', (interface_id,)).fetchall()
+    return rows_to_array(rows)
+
+
+def python_daily(samples):
+    """Thống kê theo ngày bằng vòng lặp Python theo từng dòng"""
+    buckets = defaultdict(list)
+    volume = defaultdict(int)
+    previous = None
+    for ts, tx_bytes, tx_rate in zip(samples['timestamp'].tolist(), samples['tx_bytes'].tolist(),
+                                     samples['tx_rate'].tolist()):
+        day = ts // DAY
+        buckets[day].append(tx_rate)
+        if previous is not None and tx_bytes >= previous:
+            volume[day] += tx_bytes - previous
+        previous = tx_bytes
+    result = {}
+    for day, rates in buckets.items():
+        rates.sort()
+        result[day] = (sum(rates) / len(rates), rates[-1], rates[max(math.ceil(len(rates) * 0.95) - 1, 0)],
+                       volume[day])
+    return result
+
+
+def python_moving_average(values, window):
+    result = []
+    total = 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        result.append(total / min(i + 1, window))
+    return result
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join('/tmp', f'bench_analyzer_{rows}.db')
+    print(f"Database: {path}")
+    conn, total = build_database(path, rows)
+    print(f"Dòng traffic_data: {total:,} ({INTERFACES} interface), file {os.path.getsize(path) / 2 ** 30:.2f} GB")
+
+    source = SQLiteTrafficSource(conn)
+    old_time, old = timed(load_rows, conn, 1)
+    new_time, samples = timed(source.read, 1)
+    same = len(old) == len(samples) and bool((old == samples).all())
+    print(f"Đọc interface 1 ({len(samples):,} mẫu): fetchall+rows_to_array {old_time:7.2f} s, "
+          f"fetch_array {new_time:7.2f} s, khớp: {same}")
+    del old
+
+    python_time, expected = timed(python_daily, samples)
+    numpy_time, summary = timed(period_summary, samples, DAY)
+    days = (summary['start'] // DAY).tolist()
+    same = all(np.allclose(expected[day], (summary['avg_tx_rate'][i], summary['max_tx_rate'][i],
+                                           summary['p95_tx_rate'][i], summary['tx_bytes'][i]))
+               for i, day in enumerate(days))
+    print(f"Thống kê {len(days)} ngày: Python {python_time:7.2f} s, period_summary {numpy_time:7.3f} s, "
+          f"khớp: {same}")
+
+    billing_time, billing = timed(billing_percentile, samples['timestamp'], samples['tx_rate'], samples['rx_rate'])
+    print(f"Tính cước p95 ({billing['intervals']:,} chu kỳ 5 phút): {billing_time:7.3f} s, "
+          f"p95 = {billing['billable']:.1f} KB/s")
+
+    values = samples['tx_rate']
+    python_time, expected = timed(python_moving_average, values.tolist(), 360)
+    numpy_time, averaged = timed(moving_average, values, 360)
+    print(f"Trung bình trượt 360 mẫu: Python {python_time:7.2f} s, moving_average {numpy_time:7.3f} s, "
+          f"khớp: {np.allclose(expected, averaged)}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
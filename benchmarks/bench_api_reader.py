@@ -0,0 +1,130 @@
+"""
+Benchmark bộ đọc phản hồi RouterOS API
+
+Phát lại một phản hồi /ip/firewall/connection/print dung lượng vài MB qua
+bộ đọc cũ (recv(1) cho mỗi byte độ dài, nối bytes) và ReceiveBuffer mới,
+in ra số câu/giây của mỗi cách.
+
+Chạy: python benchmarks/bench_api_reader.py [số_dòng]
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.mikrotik_api import MikroTikAPI, encode_word
+
+
+def build_connection_dump(rows):
+    """Tạo phản hồi giả lập của /ip/firewall/connection/print"""
+    chunks = []
+    for i in range(rows):
+        words = [
+            '!re',
+            f'=.id=*{i:X}',
+            '=protocol=tcp',
+            f'=src-address=10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}:{1024 + i % 60000}',
+            f'=dst-address=172.16.{(i >> 8) & 255}.{i & 255}:443',
+            '=tcp-state=established',
+            f'=timeout=23h59m{i % 60}s',
+            f'=orig-bytes={i * 1500}',
+            f'=repl-bytes={i * 9000}',
+            '=assured=true',
+            '=confirmed=true',
+            '',
+        ]
+        chunks.append(b''.join(encode_word(w) for w in words))
+    chunks.append(encode_word('!done') + encode_word(''))
+    return b''.join(chunks)
+
+
+def replay_socket(data):
+    """Tạo socket cục bộ phát lại dữ liệu đã ghi từ một luồng gửi riêng"""
+    reader, writer = socket.socketpair()
+
+    def _send():
+        writer.sendall(data)
+        writer.close()
+
+    threading.Thread(target=_send, daemon=True).start()
+    return reader
+
+
+def legacy_read_word(sock):
+    """Bộ đọc từ trước khi có ReceiveBuffer (giữ lại để so sánh)"""
+    first_byte = sock.recv(1)
+    if not first_byte:
+        return ''
+
+    first_byte = first_byte[0]
+    if first_byte < 0x80:
+        length = first_byte
+    elif first_byte < 0xC0:
+        second_byte = sock.recv(1)[0]
+        length = ((first_byte & 0x3F) << 8) + second_byte
+    elif first_byte < 0xE0:
+        length_bytes = sock.recv(2)
+        length = ((first_byte & 0x1F) << 16) + (length_bytes[0] << 8) + length_bytes[1]
+    elif first_byte < 0xF0:
+        length_bytes = sock.recv(3)
+        length = ((first_byte & 0x0F) << 24) + (length_bytes[0] << 16) + (length_bytes[1] << 8) + length_bytes[2]
+    else:
+        length_bytes = sock.recv(4)
+        length = (length_bytes[0] << 24) + (length_bytes[1] << 16) + (length_bytes[2] << 8) + length_bytes[3]
+
+    if length == 0:
+        return ''
+
+    word = b''
+    while len(word) < length:
+        chunk = sock.recv(length - len(word))
+        if not chunk:
+            break
+        word += chunk
+
+    return word.decode('utf-8')
+
+
+def run_legacy(data):
+    sock = replay_socket(data)
+    sentences = 0
+    try:
+        while True:
+            word = legacy_read_word(sock)
+            if word == '!re':
+                sentences += 1
+            elif word == '!done':
+                legacy_read_word(sock)
+                return sentences
+    finally:
+        sock.close()
+
+
+def run_buffered(data):
+    api = MikroTikAPI('127.0.0.1', 'bench', '', port=8728)
+    api.sock = replay_socket(data)
+    try:
+        return len(api._get_response()['re'])
+    finally:
+        api.sock.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = build_connection_dump(rows)
+    print(f"Phản hồi: {rows} dòng, {len(data) / 1024 / 1024:.1f} MB")
+
+    for name, runner in (('legacy recv(1)', run_legacy), ('ReceiveBuffer', run_buffered)):
+        start = time.perf_counter()
+        sentences = runner(data)
+        elapsed = time.perf_counter() - start
+        assert sentences == rows, f"{name}: {sentences} != {rows}"
+        print(f"{name:>16}: {elapsed:.3f}s, {sentences / elapsed:,.0f} câu/giây")
+
+
+if __name__ == '__main__':
+    main()
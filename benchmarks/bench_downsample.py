@@ -0,0 +1,57 @@
+"""
+Benchmark giảm điểm chuỗi thời gian (LTTB và min/max)
+
+Sinh một chuỗi traffic ngẫu nhiên có đột biến rồi đo thời gian lttb_indices,
+minmax_indices và minmax_envelope với các mức max_points khác nhau.
+
+Chạy: python benchmarks/bench_downsample.py [số_điểm]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.downsample import lttb_indices, minmax_envelope, minmax_indices
+
+
+def build_series(points):
+    """Traffic dạng random walk với vài đột biến ngắn"""
+    rng = np.random.default_rng(42)
+    x = np.arange(points, dtype=np.float64) * 2.0
+    y = np.abs(np.cumsum(rng.normal(0, 50, points))) + 1000
+    spikes = rng.choice(points, size=10, replace=False)
+    y[spikes] *= 20
+    return x, y, spikes
+
+
+def timed(func, *args, repeat=5):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    x, y, spikes = build_series(points)
+    print(f"Chuỗi: {points:,} điểm")
+
+    for max_points in (500, 1000, 2000, 5000):
+        lttb_time, idx = timed(lttb_indices, x, y, max_points)
+        minmax_time, mm = timed(minmax_indices, y, max_points)
+        env_time, _ = timed(minmax_envelope, x, y, max_points // 2)
+        kept = np.isin(spikes, idx).sum()
+        print(f"max_points={max_points:>5}: LTTB {lttb_time * 1000:6.1f} ms "
+              f"(giữ {kept}/{len(spikes)} đột biến), min/max {minmax_time * 1000:5.1f} ms, "
+              f"envelope {env_time * 1000:5.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
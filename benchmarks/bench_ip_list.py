@@ -0,0 +1,122 @@
+"""
+Benchmark dữ liệu cho /api/ip/list
+
+So sánh cách cũ (mỗi IP truy vấn interface hai lần, ARP một lần) với
+build_ip_snapshot (mỗi bảng một lần) trên một router giả lập có độ trễ
+mạng cố định cho mỗi truy vấn. Trạng thái ping được thay bằng hàm giả
+để chỉ đo phần truy vấn thiết bị.
+
+Chạy: python benchmarks/bench_ip_list.py [độ_trễ_ms]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.mikrotik_utils import build_ip_snapshot
+
+
+class MockPath:
+    """Một đường dẫn /ip/address, /interface... với select/where kiểu librouteros"""
+
+    def __init__(self, router, rows):
+        self.router = router
+        self.rows = rows
+        self.filters = []
+
+    def select(self, *keys):
+        return self
+
+    def where(self, *conditions):
+        self.filters.extend(conditions)
+        return self
+
+    def get(self):
+        self.router.queries += 1
+        time.sleep(self.router.rtt)
+        rows = self.rows
+        for key, value in self.filters:
+            rows = [row for row in rows if row.get(key) == value]
+        return rows
+
+
+class MockRouter:
+    """Router giả lập với N địa chỉ IP, mỗi IP một interface VLAN"""
+
+    def __init__(self, count, rtt):
+        self.rtt = rtt
+        self.queries = 0
+        self.tables = {
+            ('ip', 'address'): [
+                {'address': f'10.{i // 250}.{i % 250}.1/24', 'interface': f'vlan{i}'}
+                for i in range(count)
+            ],
+            ('interface',): [
+                {'name': f'vlan{i}', 'mac-address': f'4C:5E:0C:00:{i // 256:02X}:{i % 256:02X}',
+                 'rx-byte': i * 1000, 'tx-byte': i * 2000}
+                for i in range(count)
+            ],
+            ('ip', 'arp'): [
+                {'address': f'10.{i // 250}.{i % 250}.1', 'last-seen': f'{i % 60}s'}
+                for i in range(count)
+            ]
+        }
+
+    def path(self, *parts):
+        return MockPath(self, self.tables[parts])
+
+
+def legacy_ip_list(router, status_func, monitored):
+    """Tái hiện vòng lặp cũ của api_ip_list (truy vấn theo từng IP)"""
+    ips = []
+    for ip in router.path('ip', 'address').get():
+        interface = ip.get('interface')
+        address = ip.get('address')
+        host = address.split('/', 1)[0]
+        mac = router.path('interface').where(('name', interface)).get()
+        traffic_in = router.path('interface').where(('name', interface)).get()
+        traffic_out = router.path('interface').where(('name', interface)).get()
+        arp = router.path('ip', 'arp').where(('address', host)).get()
+        ips.append({
+            'address': address,
+            'interface': interface,
+            'mac_address': mac[0].get('mac-address') if mac else None,
+            'status': 'active' if status_func([host]).get(host) else 'inactive',
+            'traffic_in': traffic_in[0].get('rx-byte', 0) if traffic_in else 0,
+            'traffic_out': traffic_out[0].get('tx-byte', 0) if traffic_out else 0,
+            'last_seen': arp[0].get('last-seen') if arp else None,
+            'monitoring': address in monitored
+        })
+    return ips
+
+
+def fake_status(ip_addresses):
+    return {ip: True for ip in ip_addresses}
+
+
+def main():
+    rtt = (float(sys.argv[1]) if len(sys.argv) > 1 else 2.0) / 1000
+    monitored = set()
+    print(f"Độ trễ mỗi truy vấn: {rtt * 1000:.1f} ms")
+    print(f"{'IP':>6} {'cũ (truy vấn)':>16} {'cũ (s)':>9} {'snapshot (truy vấn)':>21} {'snapshot (s)':>13}")
+
+    for count in (50, 100, 200, 400):
+        router = MockRouter(count, rtt)
+        start = time.perf_counter()
+        legacy = legacy_ip_list(router, fake_status, monitored)
+        legacy_time = time.perf_counter() - start
+        legacy_queries = router.queries
+
+        router = MockRouter(count, rtt)
+        start = time.perf_counter()
+        snapshot = build_ip_snapshot(router, status_func=fake_status, monitored=monitored)
+        snapshot_time = time.perf_counter() - start
+
+        assert snapshot == legacy, "Kết quả snapshot khác cách cũ"
+        print(f"{count:>6} {legacy_queries:>16} {legacy_time:>9.3f} {router.queries:>21} {snapshot_time:>13.3f}")
+
+
+if __name__ == '__main__':
+    main()
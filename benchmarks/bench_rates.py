@@ -0,0 +1,83 @@
+"""
+Benchmark tính tốc độ từ counter (mikrotik-msc/mikrotik_rates.py)
+
+So sánh compute_rates (NumPy) với vòng lặp counter_delta thuần Python trên
+cùng mảng counter có lẫn tràn 32/64 bit và reset, rồi đo RateEngine.update_many
+cho một chu kỳ đọc nhiều interface.
+
+Chạy: python benchmarks/bench_rates.py [số_counter]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mikrotik-msc'))
+
+from mikrotik_rates import COUNTER_32_MAX, COUNTER_64_MAX, RateEngine, compute_rates, counter_delta
+
+
+def build_counters(size):
+    """Counter 64 bit ngẫu nhiên, 1% tràn 32 bit, 1% tràn 64 bit và 1% reset"""
+    rng = np.random.default_rng(42)
+    previous = rng.integers(0, 2 ** 62, size, dtype=np.uint64)
+    increment = rng.integers(0, 10 ** 8, size, dtype=np.uint64)
+    current = previous + increment
+
+    wrap32 = rng.choice(size, size // 100, replace=False)
+    previous[wrap32] = COUNTER_32_MAX - 1000
+    current[wrap32] = 5000
+    wrap64 = rng.choice(size, size // 100, replace=False)
+    previous[wrap64] = np.uint64(COUNTER_64_MAX - 1000)
+    current[wrap64] = 5000
+    reset = rng.choice(size, size // 100, replace=False)
+    previous[reset] = 10 ** 12
+    current[reset] = 100
+    return previous, current
+
+
+def timed(func, *args, repeat=5):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def python_rates(previous, current, elapsed):
+    rates = []
+    for old, new in zip(previous, current):
+        delta = counter_delta(old, new)
+        rates.append(delta / elapsed if delta is not None else float('nan'))
+    return rates
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    previous, current = build_counters(size)
+    print(f"Counter: {size:,}")
+
+    numpy_time, rates = timed(compute_rates, previous, current, 2.0)
+    py_previous, py_current = previous.tolist(), current.tolist()
+    python_time, expected = timed(python_rates, py_previous, py_current, 2.0, repeat=1)
+    same = np.allclose(rates, np.array(expected), equal_nan=True)
+    print(f"compute_rates: {numpy_time * 1000:8.1f} ms ({size / numpy_time / 1e6:6.1f} M counter/s), "
+          f"Python: {python_time * 1000:8.1f} ms, khớp: {same}, reset: {int(np.isnan(rates).sum()):,}")
+
+    for interfaces in (10, 100, 1000, 10000):
+        engine = RateEngine()
+        samples = {f'ether{i}': (int(previous[i]), int(previous[i] // 2)) for i in range(interfaces)}
+        engine.update_many(samples, now=0.0)
+        samples = {f'ether{i}': (int(current[i]), int(current[i] // 2)) for i in range(interfaces)}
+        start = time.perf_counter()
+        engine.update_many(samples, now=2.0)
+        cycle = time.perf_counter() - start
+        print(f"update_many {interfaces:>6} interface: {cycle * 1000:7.2f} ms/chu kỳ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Phân tích lịch sử traffic bằng NumPy (vector hóa)
+
+Các hàm nhận cột của mảng TRAFFIC_DTYPE (từ SQLiteTrafficSource hoặc
+ColumnarTrafficStore) và thay vòng lặp Python theo từng dòng bằng phép toán
+trên cả mảng:
+
+- Gom theo bucket thời gian (5 phút, giờ, ngày) bằng reduceat trên mảng đã sắp xếp
+- Phân vị theo bucket (p95) bằng một lần lexsort cho mọi bucket
+- Tính cước p95: trung bình theo chu kỳ 5 phút, bỏ 5% chu kỳ cao nhất
+- Trung bình trượt bằng tổng tích lũy
+- Lưu lượng theo bucket từ counter, bỏ qua reset theo quy tắc của mikrotik_rates
+"""
+
+import math
+from typing import Any, Dict
+
+import numpy as np
+
+from mikrotik_rates import counter_deltas
+
+HOUR = 3600
+DAY = 86400
+
+BILLING_INTERVAL = 300
+BILLING_PERCENTILE = 95
+
+# Số mẫu trung bình mỗi bucket từ đó phân vị được tính bằng np.partition từng bucket
+PARTITION_MIN_SAMPLES = 64
+
+
+def bucket_keys(timestamps: Any, width: int) -> np.ndarray:
+    """Thời điểm bắt đầu bucket `width` giây của từng mẫu"""
+    return np.asarray(timestamps, dtype=np.int64) // width * width
+
+
+def _segment_starts(keys: np.ndarray) -> np.ndarray:
+    """Vị trí bắt đầu của từng đoạn khóa bằng nhau trong mảng khóa đã sắp xếp"""
+    if not len(keys):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+def _nearest_rank(counts: np.ndarray, q: float) -> np.ndarray:
+    """Chỉ số (tính từ 0) của phân vị q theo phương pháp nearest-rank"""
+    return np.maximum(np.ceil(counts * (q / 100.0)).astype(np.int64) - 1, 0)
+
+
+def bucket_reduce(timestamps: Any, values: Any, width: int) -> Dict[str, np.ndarray]:
+    """Số mẫu, tổng, trung bình, min và max của `values` theo bucket `width` giây
+
+    Bucket không có mẫu không xuất hiện trong kết quả.
+
+    Returns:
+        dict: 'start' (đầu bucket, giây), 'count', 'sum', 'mean', 'min', 'max'
+    """
+    keys = bucket_keys(timestamps, width)
+    values = np.asarray(values, dtype=np.float64)
+    if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        values = values[order]
+
+    starts = _segment_starts(keys)
+    if not len(starts):
+        empty = np.empty(0, dtype=np.float64)
+        return {'start': keys[:0], 'count': np.empty(0, dtype=np.int64),
+                'sum': empty, 'mean': empty, 'min': empty, 'max': empty}
+
+    counts = np.diff(np.append(starts, len(keys)))
+    sums = np.add.reduceat(values, starts)
+    return {
+        'start': keys[starts],
+        'count': counts,
+        'sum': sums,
+        'mean': sums / counts,
+        'min': np.minimum.reduceat(values, starts),
+        'max': np.maximum.reduceat(values, starts)
+    }
+
+
+def bucket_percentile(timestamps: Any, values: Any, width: int,
+                      q: float = BILLING_PERCENTILE) -> Dict[str, np.ndarray]:
+    """Phân vị q (nearest-rank) của `values` trong mỗi bucket `width` giây
+
+    Returns:
+        dict: 'start' (đầu bucket, giây) và 'value'
+    """
+    keys = bucket_keys(timestamps, width)
+    values = np.asarray(values, dtype=np.float64)
+    if len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        values = values[order]
+
+    starts = _segment_starts(keys)
+    counts = np.diff(np.append(starts, len(keys)))
+    ranks = _nearest_rank(counts, q)
+    if len(starts) * PARTITION_MIN_SAMPLES <= len(keys):
+        # Bucket lớn (giờ, ngày): np.partition từng bucket là O(n), không cần sắp xếp cả mảng
+        result = np.empty(len(starts), dtype=np.float64)
+        for i, (start, count, rank) in enumerate(zip(starts.tolist(), counts.tolist(), ranks.tolist())):
+            result[i] = np.partition(values[start:start + count], rank)[rank]
+    else:
+        order = np.lexsort((values, keys))
+        result = values[order][starts + ranks]
+    return {'start': keys[starts], 'value': result}
+
+
+def percentile(values: Any, q: float = BILLING_PERCENTILE) -> float:
+    """Phân vị q (nearest-rank) của mảng, NaN bị bỏ qua; NaN nếu không có giá trị"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return math.nan
+    k = max(math.ceil(len(values) * q / 100.0) - 1, 0)
+    return float(np.partition(values, k)[k])
+
+
+def billing_percentile(timestamps: Any, tx_rates: Any, rx_rates: Any,
+                       interval: int = BILLING_INTERVAL,
+                       q: float = BILLING_PERCENTILE) -> Dict[str, float]:
+    """Tốc độ tính cước p95: trung bình từng chu kỳ `interval` giây rồi lấy phân vị q
+
+    Returns:
+        dict: 'intervals' (số chu kỳ có mẫu), 'tx', 'rx' và 'billable'
+        (giá trị lớn hơn của hai chiều)
+    """
+    tx = bucket_reduce(timestamps, tx_rates, interval)['mean']
+    rx = bucket_reduce(timestamps, rx_rates, interval)['mean']
+    tx_p = percentile(tx, q)
+    rx_p = percentile(rx, q)
+    return {
+        'intervals': len(tx),
+        'tx': tx_p,
+        'rx': rx_p,
+        'billable': max(tx_p, rx_p) if len(tx) else math.nan
+    }
+
+
+def moving_average(values: Any, window: int) -> np.ndarray:
+    """Trung bình trượt `window` mẫu (tính lùi), các mẫu đầu dùng cửa sổ ngắn hơn"""
+    values = np.asarray(values, dtype=np.float64)
+    if window <= 1 or not len(values):
+        return values.copy()
+
+    totals = np.cumsum(values)
+    totals[window:] = totals[window:] - totals[:-window]
+    return totals / np.minimum(np.arange(1, len(values) + 1), window)
+
+
+def bucket_volume(timestamps: Any, counters: Any, width: int) -> Dict[str, np.ndarray]:
+    """Tổng mức tăng của counter (byte/gói) trong mỗi bucket `width` giây
+
+    Mức tăng giữa hai mẫu liên tiếp thuộc bucket của mẫu sau; tràn 32/64 bit
+    được tính đúng, đoạn có reset được tính 0.
+
+    Returns:
+        dict: 'start' (đầu bucket, giây) và 'total'
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    counters = np.asarray(counters, dtype=np.uint64)
+    if len(counters) < 2:
+        return {'start': timestamps[:0], 'total': np.empty(0, dtype=np.float64)}
+
+    delta, _ = counter_deltas(counters[:-1], counters[1:])
+    result = bucket_reduce(timestamps[1:], delta.astype(np.float64), width)
+    return {'start': result['start'], 'total': result['sum']}
+
+
+def period_summary(samples: np.ndarray, width: int = DAY,
+                   q: float = BILLING_PERCENTILE) -> Dict[str, np.ndarray]:
+    """Thống kê theo bucket `width` giây của mảng TRAFFIC_DTYPE
+
+    Returns:
+        dict các mảng cùng độ dài: 'start', 'samples', 'tx_bytes', 'rx_bytes',
+        'avg_tx_rate', 'avg_rx_rate', 'max_tx_rate', 'max_rx_rate',
+        'p95_tx_rate', 'p95_rx_rate' (tốc độ cùng đơn vị với mảng, KB/s)
+    """
+    timestamps = samples['timestamp']
+    summary = {}
+    for direction in ('tx', 'rx'):
+        rates = bucket_reduce(timestamps, samples[f'{direction}_rate'], width)
+        summary['start'] = rates['start']
+        summary['samples'] = rates['count']
+        summary[f'avg_{direction}_rate'] = rates['mean']
+        summary[f'max_{direction}_rate'] = rates['max']
+        summary[f'p95_{direction}_rate'] = bucket_percentile(
+            timestamps, samples[f'{direction}_rate'], width, q)['value']
+
+        # Bucket chỉ có mẫu đầu tiên của chuỗi không có mức tăng counter nào
+        volume = bucket_volume(timestamps, samples[f'{direction}_bytes'], width)
+        totals = np.zeros(len(rates['start']), dtype=np.float64)
+        totals[np.searchsorted(rates['start'], volume['start'])] = volume['total']
+        summary[f'{direction}_bytes'] = totals
+    return summary
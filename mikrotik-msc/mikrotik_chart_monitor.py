@@ -30,6 +30,8 @@ except ImportError:
     logger.error("Không thể import routeros_api. Chạy: pip install routeros-api")
     sys.exit(1)
 
+from mikrotik_rates import RateEngine, to_kbps
+
 
 class MikroTikChartMonitor:
     """Lớp giám sát traffic trên interface của thiết bị MikroTik với biểu đồ."""
@@ -47,6 +49,8 @@ class MikroTikChartMonitor:
         self.times = []
         self.tx_values = []
         self.rx_values = []
+        self.rates = RateEngine()  # Tốc độ theo thời gian monotonic đo thực tế
+        self.start_time = None
         
         # Settings
         self.max_points = 30  # Số điểm tối đa trên biểu đồ
@@ -153,29 +157,18 @@ class MikroTikChartMonitor:
         if not data:
             return self.tx_line, self.rx_line
         
-        current_tx, current_rx = data
+        # Tốc độ theo thời gian đo thực tế; None ở lần đầu hoặc khi counter bị reset
+        now = time.monotonic()
+        rates = self.rates.update(self.selected_interface, data, now)
         
         # Thêm vào mảng dữ liệu
-        if len(self.times) > 0:
-            # Tính toán tốc độ dựa trên sự khác biệt
-            time_diff = self.interval
-            tx_bytes = current_tx - self.last_tx
-            rx_bytes = current_rx - self.last_rx
-            
-            # Bytes/giây
-            tx_bytes_per_second = tx_bytes / time_diff
-            rx_bytes_per_second = rx_bytes / time_diff
-            
-            # Bits/giây (1 byte = 8 bits)
-            tx_bits_per_second = tx_bytes_per_second * 8
-            rx_bits_per_second = rx_bytes_per_second * 8
-            
+        if len(self.times) > 0 and rates:
             # Chuyển đổi sang KB/s
-            tx_kbps = tx_bits_per_second / 1024
-            rx_kbps = rx_bits_per_second / 1024
+            tx_kbps = to_kbps(rates[0])
+            rx_kbps = to_kbps(rates[1])
             
-            # Thêm vào mảng dữ liệu
-            current_time = len(self.times) * self.interval
+            # Thêm vào mảng dữ liệu (trục x là số giây đo thực tế từ lần đọc đầu)
+            current_time = round(now - self.start_time, 1)
             self.times.append(current_time)
             self.tx_values.append(tx_kbps)
             self.rx_values.append(rx_kbps)
@@ -203,17 +196,12 @@ class MikroTikChartMonitor:
             # In thông tin ra console
             print(f"Thời gian: {current_time}s | TX: {tx_kbps:.2f} KB/s | RX: {rx_kbps:.2f} KB/s")
         
-        # Lưu giá trị hiện tại cho lần sau
-        self.last_tx = current_tx
-        self.last_rx = current_rx
-        
         if len(self.times) == 0:
-            # Lần đầu tiên, chỉ lưu giá trị hiện tại
+            # Lần đầu tiên, chỉ lưu mốc thời gian
+            self.start_time = now
             self.times.append(0)
             self.tx_values.append(0)
             self.rx_values.append(0)
-            self.last_tx = current_tx
-            self.last_rx = current_rx
         
         return self.tx_line, self.rx_line
     
@@ -270,7 +258,7 @@ class MikroTikChartMonitor:
         if len(self.tx_values) > 0 and len(self.rx_values) > 0:
             print("\n=== KẾT QUẢ GIÁM SÁT ===")
             print(f"Interface: {self.selected_interface}")
-            print(f"Thời gian giám sát: {len(self.tx_values) * self.interval} giây")
+            print(f"Thời gian giám sát: {self.times[-1] if self.times else 0} giây")
             
             # Tính trung bình và giá trị lớn nhất
             avg_tx = sum(self.tx_values) / len(self.tx_values)
@@ -0,0 +1,453 @@
+"""
+Lưu trữ lịch sử traffic dạng cột, nén theo khối (chunk)
+
+Thay vì mỗi mẫu một dòng traffic_data (~80+ byte kèm index), chuỗi của mỗi
+interface được chia thành các khối tối đa CHUNK_SIZE mẫu, mỗi khối là một
+BLOB trong bảng traffic_chunks:
+
+- timestamp: delta-of-delta (mẫu đều chu kỳ gần như toàn số 0)
+- counter tx/rx bytes/packets: delta (quay vòng theo 2^64)
+- các số nguyên được zigzag + varint, tốc độ lưu float32, cả khối nén zlib
+
+Đọc một khoảng thời gian trả về mảng NumPy có cấu trúc TRAFFIC_DTYPE, cùng
+định dạng với SQLiteTrafficSource (đọc bảng traffic_data), nên công cụ phân
+tích và báo cáo dùng được cả hai backend qua open_traffic_source().
+"""
+
+import zlib
+import struct
+import logging
+import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("mikrotik_columnar")
+
+CHUNK_SIZE = 4096
+
+CHUNK_MAGIC = b'MTC1'
+_CHUNK_HEADER = struct.Struct('<4sI')
+
+# Mảng trả về của mọi backend; timestamp là số giây kể từ epoch của giờ ghi log
+TRAFFIC_DTYPE = np.dtype([
+    ('timestamp', 'i8'),
+    ('tx_bytes', 'u8'),
+    ('rx_bytes', 'u8'),
+    ('tx_packets', 'u8'),
+    ('rx_packets', 'u8'),
+    ('tx_rate', 'f8'),
+    ('rx_rate', 'f8')
+])
+
+COUNTER_FIELDS = ('tx_bytes', 'rx_bytes', 'tx_packets', 'rx_packets')
+RATE_FIELDS = ('tx_rate', 'rx_rate')
+
+CHUNKS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_chunks (
+        id INTEGER PRIMARY KEY,
+        interface_id INTEGER NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_traffic_chunks_interface_time ON traffic_chunks (interface_id, end_ts, start_ts)'
+]
+
+
+def to_epoch(value: Any) -> Optional[int]:
+    """Đổi datetime, chuỗi 'YYYY-MM-DD HH:MM:SS' hoặc số giây sang số giây (giờ ghi log)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        value = value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        value = value.strftime('%Y-%m-%d')
+    return int(np.datetime64(str(value).replace(' ', 'T'), 's').astype(np.int64))
+
+
+def to_epoch_array(values: Sequence[Any]) -> np.ndarray:
+    """Bản vector hóa của to_epoch cho cột timestamp dạng chuỗi"""
+    if len(values) and isinstance(values[0], str):
+        return np.array([v.replace(' ', 'T') for v in values], dtype='datetime64[s]').astype(np.int64)
+    return np.array([to_epoch(v) for v in values], dtype=np.int64)
+
+
+def zigzag_encode(values: np.ndarray) -> np.ndarray:
+    """int64 -> uint64, số âm nhỏ thành số dương nhỏ"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values: np.ndarray) -> np.ndarray:
+    """uint64 -> int64, ngược của zigzag_encode"""
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """Mã hóa varint (LEB128) vector hóa cho mảng uint64"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(10):
+        mask = lengths > k
+        if not mask.any():
+            break
+        part = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = (part | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def varint_decode(data: bytes, count: int) -> Tuple[np.ndarray, int]:
+    """Giải mã `count` giá trị varint, trả về (mảng uint64, số byte đã đọc)"""
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), 0
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("Dữ liệu varint bị cắt cụt")
+    used = int(ends[-1]) + 1
+    raw = raw[:used]
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    group = np.repeat(np.arange(count), ends - starts + 1)
+    shift = ((np.arange(used) - starts[group]) * 7).astype(np.uint64)
+    parts = (raw & 0x7F).astype(np.uint64) << shift
+    return np.bitwise_or.reduceat(parts, starts), used
+
+
+def encode_chunk(samples: np.ndarray) -> bytes:
+    """Mã hóa một khối mẫu TRAFFIC_DTYPE thành BLOB nén"""
+    count = len(samples)
+    timestamps = samples['timestamp'].astype(np.int64)
+    deltas = np.diff(timestamps, prepend=np.int64(0))
+    columns = [zigzag_encode(np.diff(deltas, prepend=np.int64(0)))]
+    for field in COUNTER_FIELDS:
+        # Phép trừ uint64 quay vòng theo 2^64 nên giải mã bằng cumsum là chính xác
+        delta = np.diff(samples[field].astype(np.uint64), prepend=np.uint64(0))
+        columns.append(zigzag_encode(delta.view(np.int64)))
+    payload = varint_encode(np.concatenate(columns))
+    payload += b''.join(samples[field].astype('<f4').tobytes() for field in RATE_FIELDS)
+    return _CHUNK_HEADER.pack(CHUNK_MAGIC, count) + zlib.compress(payload, 6)
+
+
+def decode_chunk(blob: bytes) -> np.ndarray:
+    """Giải mã BLOB của encode_chunk thành mảng TRAFFIC_DTYPE"""
+    magic, count = _CHUNK_HEADER.unpack_from(blob)
+    if magic != CHUNK_MAGIC:
+        raise ValueError("Khối traffic không đúng định dạng")
+    payload = zlib.decompress(blob[_CHUNK_HEADER.size:])
+    values, used = varint_decode(payload, count * (1 + len(COUNTER_FIELDS)))
+    columns = values.reshape(1 + len(COUNTER_FIELDS), count)
+
+    samples = np.empty(count, dtype=TRAFFIC_DTYPE)
+    samples['timestamp'] = np.cumsum(np.cumsum(zigzag_decode(columns[0])))
+    for i, field in enumerate(COUNTER_FIELDS, start=1):
+        samples[field] = np.cumsum(zigzag_decode(columns[i]).view(np.uint64), dtype=np.uint64)
+    rates = np.frombuffer(payload, dtype='<f4', offset=used, count=count * len(RATE_FIELDS))
+    for i, field in enumerate(RATE_FIELDS):
+        samples[field] = rates[i * count:(i + 1) * count]
+    return samples
+
+
+def rows_to_array(rows: Sequence[Sequence[Any]]) -> np.ndarray:
+    """Dòng dạng traffic_data (timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate, rx_rate)"""
+    samples = np.empty(len(rows), dtype=TRAFFIC_DTYPE)
+    if not len(rows):
+        return samples
+    columns = list(zip(*rows))
+    samples['timestamp'] = to_epoch_array(columns[0])
+    for i, field in enumerate(TRAFFIC_DTYPE.names[1:], start=1):
+        samples[field] = [value or 0 for value in columns[i]]
+    return samples
+
+
+def fetch_array(conn, query: str, params: Sequence[Any] = (), dtype: np.dtype = TRAFFIC_DTYPE) -> np.ndarray:
+    """Đọc kết quả truy vấn thẳng vào mảng có cấu trúc `dtype`
+
+    Mỗi dòng là một tuple theo thứ tự trường của dtype; dùng cursor riêng
+    không có row_factory nên không tạo sqlite3.Row hay danh sách trung gian.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    try:
+        return np.fromiter(cursor.execute(query, params), dtype=dtype)
+    finally:
+        cursor.close()
+
+
+def _sort_by_time(samples: np.ndarray) -> np.ndarray:
+    if len(samples) > 1 and np.any(np.diff(samples['timestamp']) < 0):
+        return samples[np.argsort(samples['timestamp'], kind='stable')]
+    return samples
+
+
+class SQLiteTrafficSource:
+    """Đọc lịch sử traffic từ bảng traffic_data (mỗi mẫu một dòng)"""
+
+    name = 'sqlite'
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def read(self, interface_id: int, start: Any = None, end: Any = None,
+             last: Optional[int] = None) -> np.ndarray:
+        """Các mẫu của interface trong [start, end], mảng TRAFFIC_DTYPE theo thời gian
+
+        `last` giới hạn kết quả ở `last` mẫu mới nhất (SQLite dừng sau LIMIT).
+        """
+        # SQLite tự đổi timestamp sang số giây, tránh parse chuỗi trong Python
+        query = '''
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER),
+                   IFNULL(tx_bytes, 0), IFNULL(rx_bytes, 0), IFNULL(tx_packets, 0), IFNULL(rx_packets, 0),
+                   IFNULL(tx_rate_kbps, 0), IFNULL(rx_rate_kbps, 0)
+            FROM traffic_data WHERE interface_id = ? AND timestamp IS NOT NULL
+        '''
+        params = [interface_id]
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            params.append(_as_text(start))
+        if end is not None:
+            query += ' AND timestamp <= ?'
+            params.append(_as_text(end))
+        if last is None:
+            query += ' ORDER BY timestamp'
+            return fetch_array(self.conn, query, params)
+        query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        params.append(max(0, last))
+        return fetch_array(self.conn, query, params)[::-1]
+
+    def interface_ids(self) -> List[int]:
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT interface_id FROM traffic_data')]
+
+    def count(self, interface_id: Optional[int] = None) -> int:
+        if interface_id is None:
+            return self.conn.execute('SELECT COUNT(*) FROM traffic_data').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM traffic_data WHERE interface_id = ?',
+                                 (interface_id,)).fetchone()[0]
+
+    def time_range(self, interface_id: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+        """(mẫu đầu tiên, mẫu cuối cùng) dạng số giây, (None, None) nếu chưa có dữ liệu"""
+        if interface_id is None:
+            row = self.conn.execute('SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data').fetchone()
+        else:
+            row = self.conn.execute('SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data WHERE interface_id = ?',
+                                    (interface_id,)).fetchone()
+        return to_epoch(row[0]), to_epoch(row[1])
+
+
+class ColumnarTrafficStore:
+    """Lịch sử traffic dạng cột nén trong bảng traffic_chunks
+
+    Khối cuối của mỗi interface (chưa đủ chunk_size mẫu) được giữ trong bộ
+    nhớ và ghi lại (UPDATE theo id khối) mỗi lần thêm mẫu, nên dữ liệu đã
+    commit không bị mất khi dừng chương trình.
+
+    Args:
+        conn: Kết nối SQLite (writer dùng chung kết nối của luồng ghi)
+        chunk_size (int): Số mẫu tối đa mỗi khối
+    """
+
+    name = 'columnar'
+
+    def __init__(self, conn, chunk_size: int = CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self._tails = {}
+        self.ensure_schema()
+
+    def ensure_schema(self) -> None:
+        for statement in CHUNKS_SCHEMA:
+            self.conn.execute(statement)
+
+    def _load_tail(self, interface_id: int) -> Tuple[Optional[int], np.ndarray]:
+        """(id khối cuối chưa đầy hoặc None, các mẫu của khối đó)"""
+        tail = self._tails.get(interface_id)
+        if tail is None:
+            row = self.conn.execute('''
+                SELECT id, samples, data FROM traffic_chunks
+                WHERE interface_id = ? ORDER BY id DESC LIMIT 1
+            ''', (interface_id,)).fetchone()
+            if row and row[1] < self.chunk_size:
+                tail = (row[0], decode_chunk(row[2]))
+            else:
+                tail = (None, np.empty(0, dtype=TRAFFIC_DTYPE))
+        return tail
+
+    def _write_chunk(self, interface_id: int, samples: np.ndarray, chunk_id: Optional[int] = None) -> int:
+        """Ghi một khối (UPDATE nếu có chunk_id), trả về id khối"""
+        timestamps = samples['timestamp']
+        values = (int(timestamps.min()), int(timestamps.max()), len(samples), encode_chunk(samples))
+        if chunk_id is not None:
+            self.conn.execute('''
+                UPDATE traffic_chunks SET start_ts = ?, end_ts = ?, samples = ?, data = ? WHERE id = ?
+            ''', values + (chunk_id,))
+            return chunk_id
+        return self.conn.execute('''
+            INSERT INTO traffic_chunks (interface_id, start_ts, end_ts, samples, data)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (interface_id,) + values).lastrowid
+
+    def discard_cache(self) -> None:
+        """Quên các khối cuối trong bộ nhớ (gọi sau khi transaction bị rollback)"""
+        self._tails.clear()
+
+    def append(self, interface_id: int, samples: np.ndarray) -> None:
+        """Thêm mẫu (TRAFFIC_DTYPE) vào cuối chuỗi của interface (chưa commit)"""
+        if not len(samples):
+            return
+        chunk_id, tail = self._load_tail(interface_id)
+        merged = np.concatenate((tail, samples))
+
+        # Khối đầy được ghi cố định, phần dư thành khối cuối mới
+        offset = 0
+        while len(merged) - offset > self.chunk_size:
+            self._write_chunk(interface_id, merged[offset:offset + self.chunk_size], chunk_id)
+            chunk_id = None
+            offset += self.chunk_size
+        tail = merged[offset:].copy()
+        chunk_id = self._write_chunk(interface_id, tail, chunk_id)
+        self._tails[interface_id] = (chunk_id, tail)
+
+    def write_rows(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Thêm các dòng dạng traffic_data (interface_id, timestamp, ..., rx_rate_kbps)"""
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row[0], []).append(row[1:])
+        for interface_id, samples in grouped.items():
+            self.append(interface_id, rows_to_array(samples))
+
+    def read(self, interface_id: int, start: Any = None, end: Any = None,
+             last: Optional[int] = None) -> np.ndarray:
+        """Các mẫu của interface trong [start, end], mảng TRAFFIC_DTYPE theo thời gian
+
+        Với `last`, các khối được đọc từ mới đến cũ và dừng khi khối kế tiếp
+        không còn mẫu nào mới hơn `last` mẫu đã có, nên không giải mã toàn bộ lịch sử.
+        """
+        start = to_epoch(start)
+        end = to_epoch(end)
+        query = 'SELECT end_ts, data FROM traffic_chunks WHERE interface_id = ?'
+        params = [interface_id]
+        if start is not None:
+            query += ' AND end_ts >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND start_ts <= ?'
+            params.append(end)
+        query += ' ORDER BY start_ts, id' if last is None else ' ORDER BY end_ts DESC, id DESC'
+
+        blocks = []
+        collected = 0
+        floor = None
+        if last is None or last > 0:
+            for end_ts, blob in self.conn.execute(query, params):
+                if floor is not None and end_ts < floor:
+                    break
+                block = decode_chunk(blob)
+                mask = np.ones(len(block), dtype=bool)
+                if start is not None:
+                    mask &= block['timestamp'] >= start
+                if end is not None:
+                    mask &= block['timestamp'] <= end
+                block = block if mask.all() else block[mask]
+                if not len(block):
+                    continue
+                blocks.append(block)
+                collected += len(block)
+                if last is not None and collected >= last:
+                    # Mẫu thứ `last` tính từ mới nhất: khối cũ hơn mốc này không cần đọc
+                    timestamps = np.concatenate([b['timestamp'] for b in blocks])
+                    floor = np.partition(timestamps, len(timestamps) - last)[len(timestamps) - last]
+        if not blocks:
+            return np.empty(0, dtype=TRAFFIC_DTYPE)
+        if last is not None:
+            blocks.reverse()
+        samples = _sort_by_time(np.concatenate(blocks))
+        return samples if last is None else samples[-last:]
+
+    def interface_ids(self) -> List[int]:
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT interface_id FROM traffic_chunks')]
+
+    def count(self, interface_id: Optional[int] = None) -> int:
+        if interface_id is None:
+            row = self.conn.execute('SELECT SUM(samples) FROM traffic_chunks').fetchone()
+        else:
+            row = self.conn.execute('SELECT SUM(samples) FROM traffic_chunks WHERE interface_id = ?',
+                                    (interface_id,)).fetchone()
+        return row[0] or 0
+
+    def time_range(self, interface_id: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+        """(mẫu đầu tiên, mẫu cuối cùng) dạng số giây, (None, None) nếu chưa có dữ liệu"""
+        if interface_id is None:
+            row = self.conn.execute('SELECT MIN(start_ts), MAX(end_ts) FROM traffic_chunks').fetchone()
+        else:
+            row = self.conn.execute('SELECT MIN(start_ts), MAX(end_ts) FROM traffic_chunks WHERE interface_id = ?',
+                                    (interface_id,)).fetchone()
+        return row[0], row[1]
+
+    def import_from_sqlite(self, batch_rows: int = 200000) -> int:
+        """Chép toàn bộ traffic_data sang traffic_chunks (không xóa bảng gốc)
+
+        Chỉ nên chạy một lần trên database chưa có traffic_chunks của interface đó.
+        """
+        imported = 0
+        source = SQLiteTrafficSource(self.conn)
+        for interface_id in source.interface_ids():
+            last_id = 0
+            while True:
+                rows = self.conn.execute('''
+                    SELECT id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+                    FROM traffic_data WHERE interface_id = ? AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', (interface_id, last_id, batch_rows)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                self.append(interface_id, rows_to_array([row[1:] for row in rows]))
+                self.conn.commit()
+                imported += len(rows)
+        return imported
+
+
+def _as_text(value: Any) -> str:
+    """Giá trị thời gian ở dạng chuỗi của cột timestamp trong traffic_data"""
+    if isinstance(value, (int, np.integer)):
+        return str(np.datetime64(int(value), 's')).replace('T', ' ')
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def has_columnar_data(conn) -> bool:
+    """Database đã có bảng traffic_chunks với dữ liệu chưa"""
+    row = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'traffic_chunks'").fetchone()
+    return bool(row) and conn.execute('SELECT 1 FROM traffic_chunks LIMIT 1').fetchone() is not None
+
+
+def open_traffic_source(conn, backend: str = 'auto'):
+    """Chọn backend đọc lịch sử traffic
+
+    Args:
+        backend (str): 'sqlite', 'columnar' hoặc 'auto' (columnar nếu đã có
+            dữ liệu trong traffic_chunks)
+    """
+    if backend == 'auto':
+        backend = 'columnar' if has_columnar_data(conn) else 'sqlite'
+    if backend == 'columnar':
+        return ColumnarTrafficStore(conn)
+    if backend == 'sqlite':
+        return SQLiteTrafficSource(conn)
+    raise ValueError(f"Backend lưu trữ không hợp lệ: {backend}")
@@ -12,10 +12,23 @@ import sqlite3
 import argparse
 import datetime
 import json
+import csv
+import gzip
 from tabulate import tabulate
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
 import matplotlib.dates as mdates
+import numpy as np
+
+from mikrotik_downsample import lttb_indices, minmax_envelope
+from mikrotik_columnar import open_traffic_source
+from mikrotik_analytics import (HOUR, DAY, BILLING_INTERVAL, billing_percentile, moving_average,
+                                percentile, period_summary)
+
+
+# Trường của mỗi dòng thống kê khi xuất dữ liệu
+EXPORT_STAT_FIELDS = ['date', 'total_tx_bytes', 'total_rx_bytes', 'max_tx_rate', 'max_rx_rate', 'avg_tx_rate', 'avg_rx_rate']
+EXPORT_FLAT_FIELDS = ['device_id', 'device', 'interface_id', 'interface', 'interface_type'] + EXPORT_STAT_FIELDS
 
 
 class Colors:
@@ -33,8 +46,12 @@ class Colors:
 class MikroTikDBAnalyzer:
     """Lớp phân tích cơ sở dữ liệu traffic MikroTik."""
 
-    def __init__(self, db_path='mikrotik_traffic.db'):
-        """Khởi tạo với đường dẫn cơ sở dữ liệu."""
+    def __init__(self, db_path='mikrotik_traffic.db', backend='auto'):
+        """Khởi tạo với đường dẫn cơ sở dữ liệu.
+        
+        backend: nguồn lịch sử traffic, 'sqlite' (bảng traffic_data), 'columnar'
+        (traffic_chunks) hoặc 'auto' (columnar nếu database đã có dữ liệu dạng cột).
+        """
         self.db_path = db_path
         
         # Kiểm tra file cơ sở dữ liệu tồn tại
@@ -46,6 +63,7 @@ class MikroTikDBAnalyzer:
             self.conn = sqlite3.connect(db_path)
             self.conn.row_factory = sqlite3.Row
             self.cursor = self.conn.cursor()
+            self.traffic = open_traffic_source(self.conn, backend)
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi kết nối đến cơ sở dữ liệu: {e}{Colors.ENDC}")
             sys.exit(1)
@@ -90,24 +108,9 @@ class MikroTikDBAnalyzer:
             return []
 
     def get_traffic_data(self, interface_id, start_time=None, end_time=None, limit=100):
-        """Lấy dữ liệu traffic cho một interface cụ thể."""
+        """Lấy dữ liệu traffic (mảng NumPy, mới nhất trước) cho một interface cụ thể."""
         try:
-            query = "SELECT * FROM traffic_data WHERE interface_id = ?"
-            params = [interface_id]
-            
-            if start_time:
-                query += " AND timestamp >= ?"
-                params.append(start_time)
-                
-            if end_time:
-                query += " AND timestamp <= ?"
-                params.append(end_time)
-                
-            query += " ORDER BY timestamp DESC LIMIT ?"
-            params.append(limit)
-            
-            self.cursor.execute(query, params)
-            return self.cursor.fetchall()
+            return self.traffic.read(interface_id, start_time, end_time, last=limit)[::-1]
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi truy vấn bảng traffic_data: {e}{Colors.ENDC}")
             return []
@@ -177,28 +180,60 @@ class MikroTikDBAnalyzer:
             start_timestamp = f"{date} 00:00:00"
             end_timestamp = f"{date} 23:59:59"
             
-            query = """
-            SELECT 
-                strftime('%H', timestamp) as hour,
-                AVG(tx_rate) as avg_tx_rate,
-                AVG(rx_rate) as avg_rx_rate,
-                MAX(tx_rate) as max_tx_rate,
-                MAX(rx_rate) as max_rx_rate
-            FROM traffic_data
-            WHERE 
-                interface_id = ? AND
-                timestamp >= ? AND
-                timestamp <= ?
-            GROUP BY strftime('%H', timestamp)
-            ORDER BY hour
-            """
-            
-            self.cursor.execute(query, (interface_id, start_timestamp, end_timestamp))
-            return self.cursor.fetchall()
+            samples = self.traffic.read(interface_id, start_timestamp, end_timestamp)
+            if not len(samples):
+                return []
+            
+            # Gom theo giờ trong ngày (vector hóa trên cả mảng)
+            summary = period_summary(samples, HOUR)
+            result = []
+            for i, start in enumerate(summary['start'].tolist()):
+                result.append({
+                    'hour': f"{start // HOUR % 24:02d}",
+                    'avg_tx_rate': float(summary['avg_tx_rate'][i]),
+                    'avg_rx_rate': float(summary['avg_rx_rate'][i]),
+                    'max_tx_rate': float(summary['max_tx_rate'][i]),
+                    'max_rx_rate': float(summary['max_rx_rate'][i]),
+                    'p95_tx_rate': float(summary['p95_tx_rate'][i]),
+                    'p95_rx_rate': float(summary['p95_rx_rate'][i])
+                })
+            return result
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu theo giờ: {e}{Colors.ENDC}")
             return []
 
+    def get_daily_analytics(self, interface_id, days=7):
+        """Thống kê từng ngày tính từ dữ liệu traffic gốc của một interface.
+        
+        Trả về dict các mảng NumPy của period_summary (lưu lượng từ counter,
+        tốc độ trung bình, cao nhất và p95), hoặc None nếu không có dữ liệu.
+        """
+        try:
+            start_date = (datetime.datetime.now() - datetime.timedelta(days=days - 1)).strftime('%Y-%m-%d')
+            samples = self.traffic.read(interface_id, f"{start_date} 00:00:00")
+            if not len(samples):
+                return None
+            
+            summary = period_summary(samples, DAY)
+            summary['date'] = summary['start'].astype('datetime64[s]').astype('datetime64[D]').astype(str)
+            return summary
+        except sqlite3.Error as e:
+            print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu theo ngày: {e}{Colors.ENDC}")
+            return None
+
+    def get_billing_percentile(self, interface_id, days=30, interval=BILLING_INTERVAL):
+        """Tốc độ tính cước p95 (KB/s) của một interface trong số ngày gần nhất."""
+        try:
+            start_time = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            samples = self.traffic.read(interface_id, start_time)
+            if not len(samples):
+                return None
+            
+            return billing_percentile(samples['timestamp'], samples['tx_rate'], samples['rx_rate'], interval)
+        except sqlite3.Error as e:
+            print(f"{Colors.RED}Lỗi khi tính p95: {e}{Colors.ENDC}")
+            return None
+
     def print_database_info(self):
         """In thông tin tổng quan về cơ sở dữ liệu."""
         try:
@@ -211,15 +246,13 @@ class MikroTikDBAnalyzer:
             interface_count = self.cursor.fetchone()['count']
             
             # Đếm số bản ghi traffic
-            self.cursor.execute("SELECT COUNT(*) as count FROM traffic_data")
-            traffic_count = self.cursor.fetchone()['count']
+            traffic_count = self.traffic.count()
             
             # Lấy thời gian ghi log đầu tiên và cuối cùng
-            self.cursor.execute("SELECT MIN(timestamp) as first_log FROM traffic_data")
-            first_log = self.cursor.fetchone()['first_log']
-            
-            self.cursor.execute("SELECT MAX(timestamp) as last_log FROM traffic_data")
-            last_log = self.cursor.fetchone()['last_log']
+            first_log, last_log = (
+                str(np.datetime64(value, 's')).replace('T', ' ') if value is not None else None
+                for value in self.traffic.time_range()
+            )
             
             # Tính kích thước file DB
             db_size = os.path.getsize(self.db_path) / (1024 * 1024)  # Chuyển sang MB
@@ -228,7 +261,7 @@ class MikroTikDBAnalyzer:
             print(f"File: {self.db_path} ({db_size:.2f} MB)")
             print(f"Số thiết bị: {device_count}")
             print(f"Số interfaces: {interface_count}")
-            print(f"Số bản ghi traffic: {traffic_count}")
+            print(f"Số bản ghi traffic: {traffic_count} ({self.traffic.name})")
             
             if first_log and last_log:
                 print(f"Thời gian bắt đầu: {first_log}")
@@ -322,8 +355,7 @@ class MikroTikDBAnalyzer:
             table_data = []
             for interface in interfaces:
                 # Đếm số bản ghi traffic cho interface này
-                self.cursor.execute("SELECT COUNT(*) as count FROM traffic_data WHERE interface_id = ?", (interface['id'],))
-                record_count = self.cursor.fetchone()['count']
+                record_count = self.traffic.count(interface['id'])
                 
                 # Kiểm tra xem cột 'active' có tồn tại không
                 active_status = "N/A"
@@ -425,24 +457,51 @@ class MikroTikDBAnalyzer:
         headers = ["Interface", "Ngày", "TX Tổng", "RX Tổng", "TX Cao nhất", "RX Cao nhất", "TX Trung bình", "RX Trung bình"]
         print(tabulate(table_data, headers=headers, tablefmt="pretty"))
 
-    def plot_traffic_history(self, interface_id, hours=24, output_file=None):
-        """Vẽ biểu đồ lịch sử traffic cho một interface."""
+    def print_billing_percentile(self, interface_id=None, days=30, interval=BILLING_INTERVAL):
+        """In tốc độ tính cước p95 cho một hoặc tất cả các interfaces."""
+        if interface_id:
+            self.cursor.execute("SELECT id, name FROM interfaces WHERE id = ?", (interface_id,))
+        else:
+            self.cursor.execute("SELECT id, name FROM interfaces ORDER BY id")
+        interfaces = self.cursor.fetchall()
+        
+        table_data = []
+        for interface in interfaces:
+            billing = self.get_billing_percentile(interface['id'], days, interval)
+            if not billing:
+                continue
+            
+            table_data.append([
+                interface['name'],
+                billing['intervals'],
+                f"{billing['tx']:.2f} KB/s",
+                f"{billing['rx']:.2f} KB/s",
+                f"{billing['billable']:.2f} KB/s"
+            ])
+        
+        if not table_data:
+            print(f"{Colors.WARNING}Không có dữ liệu traffic nào trong {days} ngày qua.{Colors.ENDC}")
+            return
+            
+        print(f"\n{Colors.HEADER}{Colors.BOLD}=== TỐC ĐỘ TÍNH CƯỚC P95 ({days} NGÀY QUA, CHU KỲ {interval} GIÂY) ==={Colors.ENDC}")
+        headers = ["Interface", "Số chu kỳ", "TX p95", "RX p95", "Tính cước"]
+        print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+
+    def plot_traffic_history(self, interface_id, hours=24, output_file=None, max_points=2000, smooth=0):
+        """Vẽ biểu đồ lịch sử traffic cho một interface.
+        
+        Khi có nhiều hơn max_points mẫu, đường được giảm điểm bằng LTTB và
+        vùng min/max của dữ liệu gốc được tô mờ phía sau. smooth > 1 thêm
+        đường trung bình trượt smooth mẫu; mức p95 của mỗi chiều được kẻ ngang.
+        """
         # Tính thời gian bắt đầu dựa trên số giờ
         start_time = (datetime.datetime.now() - datetime.timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
         
         try:
-            # Truy vấn dữ liệu
-            query = """
-            SELECT timestamp, tx_rate, rx_rate
-            FROM traffic_data
-            WHERE interface_id = ? AND timestamp >= ?
-            ORDER BY timestamp
-            """
-            
-            self.cursor.execute(query, (interface_id, start_time))
-            data = self.cursor.fetchall()
+            # Truy vấn dữ liệu (mảng NumPy từ backend traffic_data hoặc dạng cột)
+            data = self.traffic.read(interface_id, start_time)
             
-            if not data:
+            if not len(data):
                 print(f"{Colors.WARNING}Không có dữ liệu traffic nào cho interface ID {interface_id} trong {hours} giờ qua.{Colors.ENDC}")
                 return
                 
@@ -451,23 +510,32 @@ class MikroTikDBAnalyzer:
             interface_name = self.cursor.fetchone()['name']
             
             # Chuẩn bị dữ liệu cho biểu đồ
-            timestamps = []
-            tx_rates = []
-            rx_rates = []
-            
-            for row in data:
-                try:
-                    timestamp = datetime.datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-                    timestamps.append(timestamp)
-                    tx_rates.append(row['tx_rate'])
-                    rx_rates.append(row['rx_rate'])
-                except ValueError:
-                    continue
+            timestamps = data['timestamp'].astype('datetime64[s]')
+            tx_rates = data['tx_rate']
+            rx_rates = data['rx_rate']
             
             # Tạo biểu đồ
             plt.figure(figsize=(10, 6))
-            plt.plot(timestamps, tx_rates, label='TX (KB/s)', color='blue')
-            plt.plot(timestamps, rx_rates, label='RX (KB/s)', color='green')
+            x = mdates.date2num(timestamps)
+            for values, label, color in ((tx_rates, 'TX (KB/s)', 'blue'), (rx_rates, 'RX (KB/s)', 'green')):
+                y = np.asarray(values, dtype=np.float64)
+                if max_points and len(y) > max_points:
+                    envelope = minmax_envelope(x, y, max_points // 2)
+                    plt.fill_between(mdates.num2date(envelope['x']), envelope['min'], envelope['max'],
+                                     color=color, alpha=0.15, linewidth=0)
+                    idx = lttb_indices(x, y, max_points)
+                    plt.plot(mdates.num2date(x[idx]), y[idx], label=label, color=color)
+                else:
+                    plt.plot(timestamps, values, label=label, color=color)
+                
+                if smooth and smooth > 1:
+                    averaged = moving_average(y, smooth)
+                    idx = lttb_indices(x, averaged, max_points) if max_points else np.arange(len(y))
+                    plt.plot(mdates.num2date(x[idx]), averaged[idx], label=f'{label} TB {smooth} mẫu',
+                             color=color, linestyle='--', linewidth=1)
+                
+                plt.axhline(percentile(y, 95), color=color, linestyle=':', linewidth=1,
+                            label=f'{label} p95')
             
             plt.title(f'Lịch sử traffic cho {interface_name} ({hours} giờ qua)')
             plt.xlabel('Thời gian')
@@ -494,19 +562,13 @@ class MikroTikDBAnalyzer:
             print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu cho biểu đồ: {e}{Colors.ENDC}")
             
     def plot_daily_stats(self, interface_id, days=7, output_file=None):
-        """Vẽ biểu đồ thống kê hàng ngày cho một interface."""
+        """Vẽ biểu đồ thống kê hàng ngày cho một interface.
+        
+        Số liệu được tính vector hóa từ dữ liệu traffic gốc: lưu lượng từ
+        counter, tốc độ trung bình và p95 của từng ngày.
+        """
         try:
-            # Truy vấn dữ liệu
-            query = """
-            SELECT date, total_tx_bytes, total_rx_bytes, avg_tx_rate, avg_rx_rate
-            FROM daily_stats
-            WHERE interface_id = ?
-            ORDER BY date
-            LIMIT ?
-            """
-            
-            self.cursor.execute(query, (interface_id, days))
-            data = self.cursor.fetchall()
+            data = self.get_daily_analytics(interface_id, days)
             
             if not data:
                 print(f"{Colors.WARNING}Không có dữ liệu thống kê hàng ngày nào cho interface ID {interface_id}.{Colors.ENDC}")
@@ -516,20 +578,12 @@ class MikroTikDBAnalyzer:
             self.cursor.execute("SELECT name FROM interfaces WHERE id = ?", (interface_id,))
             interface_name = self.cursor.fetchone()['name']
             
-            # Chuẩn bị dữ liệu cho biểu đồ
-            dates = []
-            tx_totals_mb = []
-            rx_totals_mb = []
-            avg_tx_rates = []
-            avg_rx_rates = []
-            
-            for row in data:
-                dates.append(row['date'])
-                # Chuyển byte sang MB
-                tx_totals_mb.append(row['total_tx_bytes'] / (1024 * 1024))
-                rx_totals_mb.append(row['total_rx_bytes'] / (1024 * 1024))
-                avg_tx_rates.append(row['avg_tx_rate'])
-                avg_rx_rates.append(row['avg_rx_rate'])
+            # Chuẩn bị dữ liệu cho biểu đồ (byte sang MB)
+            dates = data['date'].tolist()
+            tx_totals_mb = data['tx_bytes'] / (1024 * 1024)
+            rx_totals_mb = data['rx_bytes'] / (1024 * 1024)
+            avg_tx_rates = data['avg_tx_rate']
+            avg_rx_rates = data['avg_rx_rate']
             
             # Tạo hai biểu đồ: một cho tổng lượng dữ liệu, một cho tốc độ trung bình
             fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10))
@@ -552,6 +606,8 @@ class MikroTikDBAnalyzer:
             # Biểu đồ tốc độ trung bình
             ax2.plot(dates, avg_tx_rates, marker='o', label='TX Trung bình (KB/s)', color='blue')
             ax2.plot(dates, avg_rx_rates, marker='o', label='RX Trung bình (KB/s)', color='green')
+            ax2.plot(dates, data['p95_tx_rate'], linestyle='--', label='TX p95 (KB/s)', color='blue')
+            ax2.plot(dates, data['p95_rx_rate'], linestyle='--', label='RX p95 (KB/s)', color='green')
             
             ax2.set_title(f'Tốc độ trung bình hàng ngày cho {interface_name}')
             ax2.set_xlabel('Ngày')
@@ -596,6 +652,8 @@ class MikroTikDBAnalyzer:
         avg_rx_rates = []
         max_tx_rates = []
         max_rx_rates = []
+        p95_tx_rates = []
+        p95_rx_rates = []
         
         for row in data:
             hours.append(int(row['hour']))
@@ -603,6 +661,8 @@ class MikroTikDBAnalyzer:
             avg_rx_rates.append(row['avg_rx_rate'])
             max_tx_rates.append(row['max_tx_rate'])
             max_rx_rates.append(row['max_rx_rate'])
+            p95_tx_rates.append(row['p95_tx_rate'])
+            p95_rx_rates.append(row['p95_rx_rate'])
         
         # Tạo hai biểu đồ: một cho tốc độ trung bình, một cho tốc độ cao nhất
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10))
@@ -621,6 +681,8 @@ class MikroTikDBAnalyzer:
         # Biểu đồ tốc độ cao nhất
         ax2.plot(hours, max_tx_rates, marker='o', label='TX Cao nhất (KB/s)', color='blue')
         ax2.plot(hours, max_rx_rates, marker='o', label='RX Cao nhất (KB/s)', color='green')
+        ax2.plot(hours, p95_tx_rates, linestyle='--', label='TX p95 (KB/s)', color='blue')
+        ax2.plot(hours, p95_rx_rates, linestyle='--', label='RX p95 (KB/s)', color='green')
         
         ax2.set_title(f'Tốc độ cao nhất theo giờ cho {interface_name} ({date})')
         ax2.set_xlabel('Giờ')
@@ -637,87 +699,157 @@ class MikroTikDBAnalyzer:
         else:
             plt.show()
     
-    def export_data_to_json(self, output_file, days=7):
-        """Xuất dữ liệu sang định dạng JSON."""
+    def _table_columns(self, table):
+        """Tên các cột của một bảng."""
+        return {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+
+    def _export_query(self):
+        """Một truy vấn JOIN cho toàn bộ dữ liệu xuất, sắp theo thiết bị, interface và ngày.
+        
+        daily_stats của mikrotik_traffic_logger lưu MB và KB/s (total_tx_mb,
+        max_tx_kbps, ...); cột được đổi về tên và đơn vị của file xuất.
+        """
+        stats_columns = self._table_columns('daily_stats')
+        if 'total_tx_bytes' in stats_columns:
+            stats = "ds.total_tx_bytes, ds.total_rx_bytes, ds.max_tx_rate, ds.max_rx_rate, ds.avg_tx_rate, ds.avg_rx_rate"
+        else:
+            stats = """CAST(ROUND(ds.total_tx_mb * 1048576) AS INTEGER), CAST(ROUND(ds.total_rx_mb * 1048576) AS INTEGER),
+                   ds.max_tx_kbps, ds.max_rx_kbps, ds.avg_tx_kbps, ds.avg_rx_kbps"""
+        active = "i.active" if 'active' in self._table_columns('interfaces') else "0"
+        
+        return f"""
+            SELECT d.id, d.hostname, d.model, d.ip_address, d.ros_version,
+                   i.id, i.name, i.type, {active},
+                   ds.date, {stats}
+            FROM devices d
+            LEFT JOIN interfaces i ON i.device_id = d.id
+            LEFT JOIN daily_stats ds ON ds.interface_id = i.id AND ds.date >= ?
+            ORDER BY d.id, i.id, ds.date
+        """
+
+    def _write_json_export(self, f, rows, days):
+        """Ghi tài liệu JSON lồng nhau (devices > interfaces > daily_stats) theo từng dòng truy vấn."""
+        dump = lambda value: json.dumps(value, ensure_ascii=False)
+        f.write('{\n')
+        f.write(f'  "generated_at": {dump(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))},\n')
+        f.write(f'  "period_days": {dump(days)},\n')
+        f.write('  "devices": [')
+        
+        close_interface = '\n          ]\n        }'
+        close_device = '\n      ]\n    }'
+        current_device = current_interface = None
+        device_sep = interface_sep = stat_sep = ''
+        written = 0
+        for row in rows:
+            device_id, hostname, model, address, version, interface_id, name, interface_type, active, date = row[:10]
+            
+            if device_id != current_device:
+                if current_interface is not None:
+                    f.write(close_interface)
+                if current_device is not None:
+                    f.write(close_device)
+                f.write(f'{device_sep}\n    {{\n')
+                for key, value in (("id", device_id), ("name", hostname), ("model", model),
+                                   ("address", address), ("version", version)):
+                    f.write(f'      "{key}": {dump(value)},\n')
+                f.write('      "interfaces": [')
+                current_device, current_interface = device_id, None
+                device_sep, interface_sep = ',', ''
+            
+            if interface_id is not None and interface_id != current_interface:
+                if current_interface is not None:
+                    f.write(close_interface)
+                f.write(f'{interface_sep}\n        {{\n')
+                for key, value in (("id", interface_id), ("name", name), ("type", interface_type),
+                                   ("active", bool(active))):
+                    f.write(f'          "{key}": {dump(value)},\n')
+                f.write('          "daily_stats": [')
+                current_interface = interface_id
+                interface_sep, stat_sep = ',', ''
+            
+            if date is not None:
+                f.write(f'{stat_sep}\n            {dump(dict(zip(EXPORT_STAT_FIELDS, row[9:])))}')
+                stat_sep = ','
+                written += 1
+        
+        if current_interface is not None:
+            f.write(close_interface)
+        if current_device is not None:
+            f.write(close_device)
+        f.write('\n  ]\n}\n')
+        return written
+
+    def _write_flat_export(self, f, rows, fmt):
+        """Ghi mỗi dòng thống kê hàng ngày thành một bản ghi phẳng (NDJSON hoặc CSV)."""
+        writer = None
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_FLAT_FIELDS)
+        
+        written = 0
+        for row in rows:
+            if row[9] is None:
+                continue
+            # Bỏ model, address, version, active của thiết bị/interface
+            values = (row[0], row[1], row[5], row[6], row[7]) + tuple(row[9:])
+            if writer:
+                writer.writerow(values)
+            else:
+                f.write(json.dumps(dict(zip(EXPORT_FLAT_FIELDS, values)), ensure_ascii=False) + '\n')
+            written += 1
+        return written
+
+    def export_data(self, output_file, days=7, fmt='json', compress=False):
+        """Xuất thống kê hàng ngày sang JSON, NDJSON hoặc CSV (tùy chọn nén gzip).
+        
+        Dữ liệu được đọc bằng một truy vấn và ghi dần theo từng dòng nên bộ
+        nhớ không tăng theo lượng lịch sử. output_file '-' ghi ra stdout;
+        file có đuôi .gz luôn được nén.
+        """
+        compress = compress or output_file.endswith('.gz')
+        to_stdout = output_file == '-'
         try:
-            # Lấy thông tin thiết bị
-            devices = self.get_device_info()
-            
-            if not devices:
-                print(f"{Colors.WARNING}Không có thiết bị nào trong cơ sở dữ liệu.{Colors.ENDC}")
+            # Kiểm tra có thiết bị nào không
+            if self.conn.execute("SELECT 1 FROM devices LIMIT 1").fetchone() is None:
+                print(f"{Colors.WARNING}Không có thiết bị nào trong cơ sở dữ liệu.{Colors.ENDC}", file=sys.stderr)
                 return
             
             # Tính thời gian bắt đầu dựa trên số ngày
             start_time = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
             
-            # Chuẩn bị cấu trúc dữ liệu
-            export_data = {
-                "devices": [],
-                "generated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "period_days": days
-            }
-            
-            for device in devices:
-                device_data = {
-                    "id": device['id'],
-                    "name": device['hostname'],
-                    "model": device['model'],
-                    "address": device['ip_address'],
-                    "version": device['ros_version'],
-                    "interfaces": []
-                }
-                
-                # Lấy interfaces của thiết bị
-                interfaces = self.get_interfaces(device['id'])
-                
-                for interface in interfaces:
-                    # Kiểm tra xem trường active có tồn tại không
-                    is_active = False
-                    if 'active' in interface:
-                        is_active = bool(interface['active'])
-                    
-                    interface_data = {
-                        "id": interface['id'],
-                        "name": interface['name'],
-                        "type": interface['type'],
-                        "active": is_active,
-                        "daily_stats": []
-                    }
-                    
-                    # Lấy thống kê hàng ngày
-                    query = """
-                    SELECT * FROM daily_stats 
-                    WHERE interface_id = ? AND date >= ?
-                    ORDER BY date
-                    """
-                    
-                    self.cursor.execute(query, (interface['id'], start_time))
-                    daily_stats = self.cursor.fetchall()
-                    
-                    for stat in daily_stats:
-                        stat_data = {
-                            "date": stat['date'],
-                            "total_tx_bytes": stat['total_tx_bytes'],
-                            "total_rx_bytes": stat['total_rx_bytes'],
-                            "max_tx_rate": stat['max_tx_rate'],
-                            "max_rx_rate": stat['max_rx_rate'],
-                            "avg_tx_rate": stat['avg_tx_rate'],
-                            "avg_rx_rate": stat['avg_rx_rate']
-                        }
-                        interface_data["daily_stats"].append(stat_data)
-                    
-                    device_data["interfaces"].append(interface_data)
-                
-                export_data["devices"].append(device_data)
-            
-            # Ghi dữ liệu ra file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
+            # Cursor riêng trả về tuple, đọc lần lượt thay vì fetchall
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(self._export_query(), (start_time,))
+            
+            newline = '' if fmt == 'csv' else None
+            if compress:
+                target = sys.stdout.buffer if to_stdout else output_file
+                f = gzip.open(target, 'wt', encoding='utf-8', newline=newline)
+            elif to_stdout:
+                f = sys.stdout
+            else:
+                f = open(output_file, 'w', encoding='utf-8', newline=newline)
+            
+            try:
+                if fmt == 'json':
+                    written = self._write_json_export(f, rows, days)
+                else:
+                    written = self._write_flat_export(f, rows, fmt)
+            finally:
+                cursor.close()
+                if f is not sys.stdout:
+                    f.close()
                 
-            print(f"{Colors.GREEN}Đã xuất dữ liệu sang {output_file}{Colors.ENDC}")
+            destination = 'stdout' if to_stdout else output_file
+            print(f"{Colors.GREEN}Đã xuất {written} dòng thống kê sang {destination}{Colors.ENDC}", file=sys.stderr)
             
         except (sqlite3.Error, IOError) as e:
-            print(f"{Colors.RED}Lỗi khi xuất dữ liệu: {e}{Colors.ENDC}")
+            print(f"{Colors.RED}Lỗi khi xuất dữ liệu: {e}{Colors.ENDC}", file=sys.stderr)
+
+    def export_data_to_json(self, output_file, days=7):
+        """Xuất dữ liệu sang định dạng JSON."""
+        self.export_data(output_file, days, 'json')
     
     def close(self):
         """Đóng kết nối cơ sở dữ liệu."""
@@ -730,6 +862,7 @@ def main():
     parser = argparse.ArgumentParser(description='Công cụ phân tích cơ sở dữ liệu MikroTik')
     
     parser.add_argument('--db', default='mikrotik_traffic.db', help='Đường dẫn đến file cơ sở dữ liệu (mặc định: mikrotik_traffic.db)')
+    parser.add_argument('--backend', choices=['auto', 'sqlite', 'columnar'], default='auto', help='Nguồn dữ liệu traffic (mặc định: auto)')
     
     # Các lệnh chính
     subparsers = parser.add_subparsers(dest='command', help='Lệnh')
@@ -761,11 +894,20 @@ def main():
     plot_parser.add_argument('--days', type=int, default=7, help='Số ngày để hiển thị thống kê hàng ngày (chỉ cho loại daily, mặc định: 7)')
     plot_parser.add_argument('--date', help='Ngày để hiển thị thống kê theo giờ, định dạng YYYY-MM-DD (chỉ cho loại hourly)')
     plot_parser.add_argument('--output', help='Tên file để lưu biểu đồ (ví dụ: plot.png)')
+    plot_parser.add_argument('--max-points', type=int, default=2000, help='Số điểm tối đa trên mỗi đường (chỉ cho loại history, mặc định: 2000)')
+    plot_parser.add_argument('--smooth', type=int, default=0, help='Thêm đường trung bình trượt N mẫu (chỉ cho loại history)')
+    
+    # Lệnh tính tốc độ tính cước p95
+    p95_parser = subparsers.add_parser('p95', help='Tốc độ tính cước p95 (trung bình 5 phút, bỏ 5%% cao nhất)')
+    p95_parser.add_argument('--interface', type=int, help='ID của interface (mặc định: tất cả)')
+    p95_parser.add_argument('--days', type=int, default=30, help='Số ngày cần tính (mặc định: 30)')
+    p95_parser.add_argument('--interval', type=int, default=BILLING_INTERVAL, help=f'Chu kỳ lấy trung bình, giây (mặc định: {BILLING_INTERVAL})')
     
     # Lệnh xuất dữ liệu
     export_parser = subparsers.add_parser('export', help='Xuất dữ liệu')
-    export_parser.add_argument('--format', choices=['json'], default='json', help='Định dạng xuất (mặc định: json)')
-    export_parser.add_argument('--output', required=True, help='Tên file để lưu dữ liệu xuất')
+    export_parser.add_argument('--format', choices=['json', 'ndjson', 'csv'], default='json', help='Định dạng xuất (mặc định: json)')
+    export_parser.add_argument('--output', required=True, help="Tên file để lưu dữ liệu xuất ('-' để ghi ra stdout)")
+    export_parser.add_argument('--gzip', action='store_true', help='Nén gzip (tự bật khi tên file có đuôi .gz)')
     export_parser.add_argument('--days', type=int, default=7, help='Số ngày dữ liệu cần xuất (mặc định: 7)')
     
     args = parser.parse_args()
@@ -775,7 +917,7 @@ def main():
         parser.print_help()
         return
     
-    analyzer = MikroTikDBAnalyzer(args.db)
+    analyzer = MikroTikDBAnalyzer(args.db, args.backend)
     
     try:
         if args.command == 'info':
@@ -795,15 +937,17 @@ def main():
             
         elif args.command == 'plot':
             if args.type == 'history':
-                analyzer.plot_traffic_history(args.interface, args.hours, args.output)
+                analyzer.plot_traffic_history(args.interface, args.hours, args.output, args.max_points, args.smooth)
             elif args.type == 'daily':
                 analyzer.plot_daily_stats(args.interface, args.days, args.output)
             elif args.type == 'hourly':
                 analyzer.plot_hourly_stats(args.interface, args.date, args.output)
                 
+        elif args.command == 'p95':
+            analyzer.print_billing_percentile(args.interface, args.days, args.interval)
+            
         elif args.command == 'export':
-            if args.format == 'json':
-                analyzer.export_data_to_json(args.output, args.days)
+            analyzer.export_data(args.output, args.days, args.format, args.gzip)
     
     finally:
         analyzer.close()
@@ -0,0 +1,225 @@
+"""
+Thu thập telemetry cho cả đội thiết bị (hàng trăm router)
+
+FleetPoller gọi hàm poll(key) cho từng thiết bị trên một thread pool giới hạn:
+
+- mỗi thiết bị có chu kỳ riêng, hạn chót theo DeadlineSchedule (không trôi,
+  chu kỳ bị lỡ được bỏ qua, không có hai lần poll chồng nhau cho một thiết bị)
+- thời điểm poll đầu tiên được rải ngẫu nhiên trong một chu kỳ để tránh
+  hàng trăm kết nối cùng lúc
+- thiết bị không phản hồi được thử lại với backoff lũy thừa (có jitter)
+- kết quả mới nhất của mọi thiết bị nằm trong một bảng trạng thái trong bộ
+  nhớ; giao diện web và cảnh báo đọc bảng này thay vì gọi router trực tiếp
+"""
+
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from mikrotik_scheduler import DeadlineSchedule, LatencyHistogram
+
+logger = logging.getLogger('mikrotik_fleet')
+
+DEFAULT_INTERVAL = float(os.getenv('FLEET_POLL_INTERVAL', 10))
+DEFAULT_WORKERS = int(os.getenv('FLEET_WORKERS', 32))
+DEFAULT_MAX_BACKOFF = float(os.getenv('FLEET_MAX_BACKOFF', 300))
+
+# Độ lệch ngẫu nhiên (tỉ lệ) của thời gian chờ backoff
+BACKOFF_JITTER = 0.2
+
+
+class _Device:
+    """Trạng thái lập lịch của một thiết bị"""
+
+    def __init__(self, interval: float, start: float):
+        self.interval = interval
+        self.schedule = DeadlineSchedule(interval, start=start)
+        self.failures = 0
+        self.entry = None  # Mục hợp lệ trong heap (mục cũ bị bỏ qua khi lấy ra)
+        self.in_flight = False
+
+
+class FleetPoller:
+    """Poll định kỳ nhiều thiết bị và giữ bảng trạng thái mới nhất theo khóa
+
+    Args:
+        poll (callable): poll(key) -> dict telemetry; lỗi được raise
+        workers (int): Số lần poll chạy đồng thời tối đa
+        interval (float): Chu kỳ mặc định (giây)
+        max_backoff (float): Thời gian chờ tối đa giữa hai lần thử lại (giây)
+    """
+
+    def __init__(self, poll: Callable[[Hashable], Dict[str, Any]], workers: int = DEFAULT_WORKERS,
+                 interval: float = DEFAULT_INTERVAL, max_backoff: float = DEFAULT_MAX_BACKOFF):
+        self._poll = poll
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.latency = LatencyHistogram()
+        self.polls = 0
+        self.failures = 0
+        self.skipped = 0
+
+        self._devices = {}
+        self._states = {}
+        self._heap = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._executor = None
+
+    def add(self, key: Hashable, interval: Optional[float] = None) -> None:
+        """Thêm (hoặc đổi chu kỳ) một thiết bị; lần poll đầu rơi ngẫu nhiên trong một chu kỳ"""
+        interval = interval or self.interval
+        with self._condition:
+            device = _Device(interval, time.monotonic() + random.uniform(0, interval))
+            previous = self._devices.get(key)
+            if previous is not None:
+                device.in_flight = previous.in_flight
+            self._devices[key] = device
+            self._push(key, device)
+
+    def remove(self, key: Hashable) -> None:
+        with self._condition:
+            self._devices.pop(key, None)
+            self._states.pop(key, None)
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fleet')
+        self._thread = threading.Thread(target=self._run, name='fleet-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Bắt đầu thu thập telemetry cho {len(self._devices)} thiết bị ({self.workers} worker)")
+
+    def stop(self, wait: bool = True) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+        logger.info("Đã dừng thu thập telemetry")
+
+    def devices(self) -> List[Hashable]:
+        with self._condition:
+            return list(self._devices)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._condition:
+            return self._states.get(key)
+
+    def snapshot(self) -> Dict[Hashable, Dict[str, Any]]:
+        """Bảng trạng thái mới nhất (mỗi mục được thay nguyên khối, không sửa tại chỗ)"""
+        with self._condition:
+            return dict(self._states)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            devices = list(self._devices.values())
+        return {
+            'devices': len(devices),
+            'workers': self.workers,
+            'in_flight': sum(device.in_flight for device in devices),
+            'unreachable': sum(device.failures > 0 for device in devices),
+            'polls': self.polls,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'latency': self.latency.snapshot()
+        }
+
+    def _push(self, key: Hashable, device: _Device) -> None:
+        """Đưa hạn chót kế tiếp của thiết bị vào heap (gọi khi giữ _condition)"""
+        self._sequence += 1
+        device.entry = self._sequence
+        heapq.heappush(self._heap, (device.schedule.next_deadline, self._sequence, key))
+        self._condition.notify()
+
+    def _run(self) -> None:
+        """Thread lập lịch: lấy thiết bị đến hạn và giao cho thread pool"""
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, entry, key = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                device = self._devices.get(key)
+                if device is None or device.entry != entry:
+                    continue
+                if device.in_flight:
+                    # Lần poll trước (trước khi đổi chu kỳ) chưa xong: bỏ lượt này
+                    self.skipped += device.schedule.advance() + 1
+                    self._push(key, device)
+                    continue
+                device.in_flight = True
+                self._executor.submit(self._poll_device, key, device)
+
+    def _poll_device(self, key: Hashable, device: _Device) -> None:
+        started = time.monotonic()
+        try:
+            telemetry = self._poll(key)
+            error = None
+        except Exception as e:
+            telemetry = None
+            error = str(e) or e.__class__.__name__
+        latency = time.monotonic() - started
+
+        with self._condition:
+            device.in_flight = False
+            current = self._devices.get(key)
+            if current is not device:
+                # Thiết bị đã bị xóa hoặc thêm lại trong lúc poll: bỏ kết quả
+                if current is not None:
+                    current.in_flight = False
+                return
+            self.polls += 1
+            now = time.time()
+            previous = self._states.get(key) or {}
+            if error is None:
+                if device.failures:
+                    logger.info(f"{key}: phản hồi trở lại sau {device.failures} lần lỗi")
+                device.failures = 0
+                self.latency.observe(latency)
+                self.skipped += device.schedule.advance()
+                state = dict(telemetry)
+                state.update({
+                    'status': 'online',
+                    'error': None,
+                    'last_success': now
+                })
+            else:
+                device.failures += 1
+                self.failures += 1
+                if device.failures == 1:
+                    logger.warning(f"{key}: không poll được ({error}), thử lại với backoff")
+                backoff = min(device.interval * 2 ** device.failures, self.max_backoff)
+                device.schedule.reschedule(backoff * random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER))
+                # Giữ dữ liệu lần thành công gần nhất, chỉ cập nhật trạng thái lỗi
+                state = dict(previous)
+                state.update({
+                    'status': 'unreachable',
+                    'error': error,
+                    'last_success': previous.get('last_success')
+                })
+            state.update({
+                'last_poll': now,
+                'latency_ms': round(latency * 1000, 1),
+                'failures': device.failures,
+                'interval': device.interval
+            })
+            self._states[key] = state
+            self._push(key, device)
@@ -0,0 +1,98 @@
+"""
+Lịch sử tốc độ trong bộ nhớ cho monitor thời gian thực
+
+Mỗi interface có một bộ đệm vòng dung lượng cố định gồm ba cột NumPy
+(timestamp, tx_kbps, rx_kbps):
+
+- append O(1), ghi đè điểm cũ nhất, không cấp phát đối tượng mới nên giữ
+  hàng giờ lịch sử 1 giây không gây áp lực cho GC
+- một luồng ghi (thread giám sát), nhiều luồng đọc không cần lock: bộ đếm
+  seq kiểu seqlock lẻ khi đang ghi, luồng đọc chép dữ liệu rồi thử lại nếu
+  seq đã đổi
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_DEPTH = 60
+
+# Số lần đọc lại tối đa trước khi chờ luồng ghi (chỉ xảy ra khi đọc trùng lúc ghi)
+_SPIN_RETRIES = 100
+
+
+def history_depth_from_env(default: int = DEFAULT_DEPTH) -> int:
+    """Số điểm lịch sử mỗi interface, từ biến môi trường MONITOR_HISTORY_DEPTH"""
+    return max(1, int(os.getenv('MONITOR_HISTORY_DEPTH', default)))
+
+
+class TrafficHistory:
+    """Bộ đệm vòng tốc độ của một interface
+
+    Args:
+        capacity (int): Số điểm tối đa được giữ
+    """
+
+    def __init__(self, capacity: int = DEFAULT_DEPTH):
+        self.capacity = max(1, int(capacity))
+        self._columns = np.zeros((3, self.capacity), dtype=np.float64)
+        self._count = 0
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    @property
+    def total(self) -> int:
+        """Tổng số điểm đã ghi từ đầu (kể cả điểm đã bị ghi đè)"""
+        return self._count
+
+    def append(self, timestamp: float, tx_kbps: float, rx_kbps: float) -> None:
+        """Thêm một điểm (chỉ gọi từ một luồng ghi)"""
+        index = self._count % self.capacity
+        self._seq += 1
+        self._columns[0, index] = timestamp
+        self._columns[1, index] = tx_kbps
+        self._columns[2, index] = rx_kbps
+        self._count += 1
+        self._seq += 1
+
+    def clear(self) -> None:
+        self._seq += 1
+        self._count = 0
+        self._seq += 1
+
+    def arrays(self, last: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Bản sao (timestamp, tx_kbps, rx_kbps) từ cũ đến mới, tối đa `last` điểm cuối"""
+        retries = 0
+        while True:
+            seq = self._seq
+            if not seq & 1:
+                count = self._count
+                size = min(count, self.capacity)
+                if last is not None:
+                    size = min(size, max(0, last))
+                start = count - size
+                columns = np.take(self._columns, np.arange(start, count), axis=1, mode='wrap')
+                if self._seq == seq:
+                    return columns[0], columns[1], columns[2]
+            retries += 1
+            if retries >= _SPIN_RETRIES:
+                time.sleep(0)
+
+    def points(self, last: Optional[int] = None) -> List[Dict[str, float]]:
+        """Các điểm dạng dict như lịch sử cũ (timestamp, tx/rx_kbps, tx/rx_mbps)"""
+        timestamps, tx, rx = self.arrays(last)
+        return [{
+            'timestamp': timestamp,
+            'tx_kbps': tx_kbps,
+            'rx_kbps': rx_kbps,
+            'tx_mbps': tx_kbps / 1024,
+            'rx_mbps': rx_kbps / 1024
+        } for timestamp, tx_kbps, rx_kbps in zip(timestamps.tolist(), tx.tolist(), rx.tolist())]
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        points = self.points(1)
+        return points[0] if points else None
@@ -7,12 +7,9 @@ MikroTik Integrated Web Manager
 
 import os
 import sys
-import json
 import time
 import logging
-import asyncio
 import threading
-from typing import List, Dict, Any
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -32,9 +29,14 @@ try:
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.templating import Jinja2Templates
     import uvicorn
+    from mikrotik_downsample import downsample_points
+    from mikrotik_rates import RateEngine, to_kbps
+    from mikrotik_ws_broadcast import BroadcastPump
+    from mikrotik_history import TrafficHistory, history_depth_from_env
+    from mikrotik_scheduler import DeadlineSchedule, LatencyHistogram
 except ImportError as e:
     logger.error(f"Thiếu gói phụ thuộc: {e}")
-    logger.info("Chạy: pip install routeros-api fastapi uvicorn websockets jinja2")
+    logger.info("Chạy: pip install routeros-api fastapi uvicorn websockets jinja2 numpy")
     sys.exit(1)
 
 # Import các module quản lý
@@ -56,8 +58,11 @@ load_dotenv()
 class MikroTikMonitor:
     """Lớp giám sát thiết bị MikroTik."""
     
-    def __init__(self, host, username, password):
-        """Khởi tạo với thông tin kết nối."""
+    def __init__(self, host, username, password, history_depth=None):
+        """Khởi tạo với thông tin kết nối.
+        
+        history_depth: số điểm lịch sử giữ cho mỗi interface (mặc định MONITOR_HISTORY_DEPTH hoặc 60).
+        """
         self.host = host
         self.username = username
         self.password = password
@@ -65,8 +70,16 @@ class MikroTikMonitor:
         self.api = None
         self.running = False
         self.data_history = {}  # Lịch sử dữ liệu theo interface
+        self.history_depth = history_depth or history_depth_from_env()
+        self.snapshot_points = int(os.getenv('MONITOR_SNAPSHOT_POINTS', 60))  # Số điểm gửi qua WebSocket
         self.device_info = {}   # Thông tin thiết bị
         self.lock = threading.Lock()  # Lock để đồng bộ truy cập vào data
+        self.rates = RateEngine()  # Tốc độ theo thời gian monotonic đo thực tế
+        self.interface_refresh = float(os.getenv('MONITOR_INTERFACE_REFRESH', 30))  # Chu kỳ làm mới danh sách interface
+        self.schedule = None  # Lịch đọc counter, tạo khi bắt đầu giám sát
+        self.poll_latency = LatencyHistogram()  # Độ trễ lệnh đọc counter mỗi chu kỳ
+        self.poll_errors = 0
+        self._stop_event = threading.Event()
     
     def connect(self):
         """Kết nối đến thiết bị MikroTik và trả về API object."""
@@ -166,23 +179,23 @@ class MikroTikMonitor:
         
         return active_interfaces
     
-    def get_interface_traffic(self, interface_name):
-        """Lấy dữ liệu traffic cho một interface cụ thể."""
+    def get_all_interface_traffic(self):
+        """Đọc counter của mọi interface bằng một lệnh /interface/print.
+        
+        Trả về dict tên interface -> (tx_bytes, rx_bytes), hoặc None nếu lỗi.
+        """
         if not self.api:
             return None
         
         try:
             interfaces = self.api.get_resource('/interface')
-            iface_data = interfaces.get(name=interface_name)
-            
-            if iface_data and len(iface_data) > 0:
-                current_tx = int(iface_data[0].get('tx-byte', '0'))
-                current_rx = int(iface_data[0].get('rx-byte', '0'))
-                return current_tx, current_rx
-            else:
-                return None
+            rows = interfaces.call('print', {'.proplist': 'name,tx-byte,rx-byte'})
+            return {
+                row['name']: (int(row.get('tx-byte', '0')), int(row.get('rx-byte', '0')))
+                for row in rows if row.get('name')
+            }
         except Exception as e:
-            logger.error(f"Lỗi khi lấy dữ liệu traffic cho {interface_name}: {e}")
+            logger.error(f"Lỗi khi đọc counter các interface: {e}")
             return None
     
     def start_monitoring(self, interval=2):
@@ -192,6 +205,7 @@ class MikroTikMonitor:
             return
         
         self.running = True
+        self._stop_event.clear()
         self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(interval,))
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
@@ -200,148 +214,117 @@ class MikroTikMonitor:
     def stop_monitoring(self):
         """Dừng giám sát."""
         self.running = False
+        self._stop_event.set()
         if hasattr(self, 'monitor_thread'):
             self.monitor_thread.join(timeout=3)
         logger.info("Đã dừng giám sát")
     
     def _monitor_loop(self, interval):
-        """Vòng lặp chính để giám sát các interfaces."""
+        """Vòng lặp giám sát theo hạn chót cố định (không trôi theo thời gian đọc).
+        
+        Mỗi chu kỳ đọc counter của mọi interface bằng một lệnh. Danh sách interface
+        đang hoạt động được làm mới theo chu kỳ chậm hơn (interface_refresh) hoặc ngay
+        khi tập interface trên thiết bị thay đổi. Chu kỳ bị lỡ được bỏ qua, không chạy dồn.
+        """
         # Khởi tạo dữ liệu ban đầu
-        self._init_interface_data()
+        active_names = self._init_interface_data()
+        known_names = None
         
-        last_device_update = 0
+        self.schedule = DeadlineSchedule(interval)
+        device_schedule = DeadlineSchedule(10)  # Cập nhật thông tin thiết bị mỗi 10 giây
+        interface_schedule = DeadlineSchedule(self.interface_refresh, start=time.monotonic() + self.interface_refresh)
         
         while self.running:
-            current_time = time.time()
+            # Một lệnh đọc counter cho tất cả interface, đo độ trễ
+            started = time.monotonic()
+            counters = self.get_all_interface_traffic()
+            finished = time.monotonic()
+            
+            changed = False
+            if counters is None:
+                self.poll_errors += 1
+            else:
+                self.poll_latency.observe(finished - started)
+                changed = known_names is not None and known_names != counters.keys()
+                known_names = counters.keys()
+                self._record_counters({name: counters[name] for name in active_names if name in counters}, finished)
             
-            # Cập nhật thông tin thiết bị mỗi 10 giây
-            if current_time - last_device_update >= 10:
+            if device_schedule.due():
                 self.get_device_info()
-                last_device_update = current_time
-            
-            # Cập nhật dữ liệu traffic cho từng interface
-            active_interfaces = self.get_active_interfaces()
-            for iface in active_interfaces:
-                self._update_interface_data(iface['name'], interval)
-            
-            # Ngủ đến lần cập nhật tiếp theo
-            time.sleep(interval)
+                device_schedule.advance()
+            
+            # Interface được thêm/xóa: làm mới danh sách ngay, không chờ đến chu kỳ
+            if changed or interface_schedule.due():
+                active_names = {iface['name'] for iface in self.get_active_interfaces()}
+                interface_schedule.reschedule(self.interface_refresh)
+            
+            missed = self.schedule.advance()
+            if missed:
+                logger.debug(f"{self.host}: đọc counter chậm, bỏ qua {missed} chu kỳ")
+            
+            # Ngủ đến hạn chót tiếp theo (thoát ngay khi dừng giám sát)
+            if not self.schedule.wait(self._stop_event):
+                break
+    
+    def get_poll_stats(self):
+        """Thống kê polling: chu kỳ, số chu kỳ đã chạy/bị bỏ qua, lỗi và histogram độ trễ."""
+        stats = self.schedule.stats() if self.schedule else {}
+        stats['errors'] = self.poll_errors
+        stats['latency'] = self.poll_latency.snapshot()
+        return stats
+    
+    def _record_counters(self, counters, now):
+        """Tính tốc độ cho một lần đọc counter của nhiều interface và ghi vào lịch sử."""
+        rates = self.rates.update_many(counters, now)
+        timestamp = time.time()
+        for name, rate in rates.items():
+            entry = self.data_history.get(name)
+            if entry is None:
+                with self.lock:
+                    entry = self.data_history.setdefault(name, self._new_interface_entry(counters[name]))
+            if rate:
+                entry['history'].append(timestamp, to_kbps(rate[0]), to_kbps(rate[1]))
+            entry['previous_data'] = counters[name]
+    
+    def _new_interface_entry(self, traffic_data):
+        """Mục data_history mới: lịch sử là bộ đệm vòng cố định, không cần lock khi ghi/đọc."""
+        return {
+            'previous_data': traffic_data,
+            'history': TrafficHistory(self.history_depth),
+            'max_history_length': self.history_depth
+        }
     
     def _init_interface_data(self):
-        """Khởi tạo dữ liệu cho tất cả các interfaces."""
-        active_interfaces = self.get_active_interfaces()
-        if not active_interfaces:
-            return
+        """Khởi tạo dữ liệu cho tất cả các interfaces, trả về tập tên interface đang hoạt động."""
+        active_names = {iface['name'] for iface in self.get_active_interfaces()}
+        if not active_names:
+            return active_names
         
-        with self.lock:
-            for iface in active_interfaces:
-                name = iface['name']
-                if name not in self.data_history:
-                    traffic_data = self.get_interface_traffic(name)
-                    if traffic_data:
-                        self.data_history[name] = {
-                            'previous_data': traffic_data,
-                            'history': [],
-                            'max_history_length': 60  # Giữ 60 điểm dữ liệu
-                        }
-    
-    def _update_interface_data(self, interface_name, interval):
-        """Cập nhật dữ liệu cho một interface cụ thể."""
-        if interface_name not in self.data_history:
-            # Khởi tạo nếu chưa có
-            traffic_data = self.get_interface_traffic(interface_name)
-            if traffic_data:
-                with self.lock:
-                    self.data_history[interface_name] = {
-                        'previous_data': traffic_data,
-                        'history': [],
-                        'max_history_length': 60
-                    }
-            return
-        
-        # Lấy dữ liệu traffic mới
-        current_data = self.get_interface_traffic(interface_name)
-        if not current_data:
-            return
-        
-        with self.lock:
-            previous_data = self.data_history[interface_name]['previous_data']
-            if previous_data:
-                # Tính toán tốc độ dựa trên sự khác biệt
-                tx_bytes = current_data[0] - previous_data[0]
-                rx_bytes = current_data[1] - previous_data[1]
-                
-                # Bytes/giây
-                tx_bytes_per_second = tx_bytes / interval
-                rx_bytes_per_second = rx_bytes / interval
-                
-                # Bits/giây (1 byte = 8 bits)
-                tx_bits_per_second = tx_bytes_per_second * 8
-                rx_bits_per_second = rx_bytes_per_second * 8
-                
-                # Chuyển đổi sang KB/s và MB/s
-                tx_kbps = tx_bits_per_second / 1024
-                rx_kbps = rx_bits_per_second / 1024
-                tx_mbps = tx_kbps / 1024
-                rx_mbps = rx_kbps / 1024
-                
-                # Thêm vào lịch sử
-                timestamp = time.time()
-                self.data_history[interface_name]['history'].append({
-                    'timestamp': timestamp,
-                    'tx_kbps': tx_kbps,
-                    'rx_kbps': rx_kbps,
-                    'tx_mbps': tx_mbps,
-                    'rx_mbps': rx_mbps
-                })
-                
-                # Giới hạn kích thước lịch sử
-                max_length = self.data_history[interface_name]['max_history_length']
-                if len(self.data_history[interface_name]['history']) > max_length:
-                    self.data_history[interface_name]['history'] = self.data_history[interface_name]['history'][-max_length:]
-            
-            # Cập nhật dữ liệu trước đó
-            self.data_history[interface_name]['previous_data'] = current_data
+        counters = self.get_all_interface_traffic() or {}
+        self._record_counters({name: counters[name] for name in active_names if name in counters}, time.monotonic())
+        return active_names
     
     def get_current_data(self):
         """Lấy dữ liệu mới nhất về thiết bị và traffic."""
         with self.lock:
-            result = {
-                'device': self.device_info,
-                'interfaces': {}
-            }
-            
-            # Thêm dữ liệu traffic cho mỗi interface
-            for name, data in self.data_history.items():
-                if data['history']:
-                    latest = data['history'][-1]
-                    result['interfaces'][name] = {
-                        'current': latest,
-                        'history': data['history']
-                    }
-            
-            return result
-
-
-class ConnectionManager:
-    """Quản lý các kết nối WebSocket."""
-    
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-    
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-    
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Lỗi khi gửi dữ liệu: {e}")
+            entries = list(self.data_history.items())
+        
+        result = {
+            'device': self.device_info,
+            'interfaces': {},
+            'history_depth': self.snapshot_points
+        }
+        
+        # Thêm dữ liệu traffic cho mỗi interface (đọc bộ đệm vòng không cần lock)
+        for name, data in entries:
+            history = data['history'].points(self.snapshot_points)
+            if history:
+                result['interfaces'][name] = {
+                    'current': history[-1],
+                    'history': history
+                }
+        
+        return result
 
 
 # Khởi tạo ứng dụng FastAPI
@@ -356,8 +339,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Khởi tạo connection manager
-manager = ConnectionManager()
+
+def get_monitor_snapshot():
+    """Snapshot của monitor hiện tại cho WebSocket (None nếu chưa kết nối)."""
+    monitor = mikrotik_monitor
+    return monitor.get_current_data() if monitor else None
+
+
+# Một producer chung cho mọi kết nối /ws
+manager = BroadcastPump(
+    get_monitor_snapshot,
+    interval=float(os.getenv('WS_BROADCAST_INTERVAL', 1.0)),
+    queue_size=int(os.getenv('WS_QUEUE_SIZE', 2))
+)
 
 # Thiết lập thư mục templates
 templates = Jinja2Templates(directory="templates")
@@ -375,12 +369,18 @@ os.makedirs("static/js", exist_ok=True)
 site_manager = None    # Site Manager
 current_site = None    # Site hiện tại
 mikrotik_monitor = None  # Monitor chính
-client_monitor = None    # Client Monitor
-firewall_manager = None  # Firewall Manager
-capsman_manager = None   # CAPsMAN Manager
-backup_manager = None    # Backup Manager
 vpn_manager = None       # VPN Manager
 
+
+def get_site_module(attr):
+    """Module quản lý (client_monitor, firewall_manager, ...) của site đang chọn.
+    
+    Module được Site khởi tạo khi endpoint dùng lần đầu; None nếu chưa chọn site.
+    """
+    site = site_manager.get_site(current_site) if site_manager and current_site else None
+    return getattr(site, attr) if site else None
+
+
 # Trang HTML Dashboard
 @app.get("/", response_class=HTMLResponse)
 async def get_dashboard(request: Request):
@@ -440,25 +440,22 @@ async def websocket_endpoint(websocket: WebSocket):
     """Endpoint WebSocket để gửi dữ liệu theo thời gian thực."""
     await manager.connect(websocket)
     try:
-        while True:
-            if mikrotik_monitor:
-                # Lấy dữ liệu mới nhất
-                data = mikrotik_monitor.get_current_data()
-                
-                # Gửi dữ liệu qua WebSocket
-                if data:
-                    await websocket.send_text(json.dumps(data))
-            
-            # Đợi 1 giây trước khi gửi dữ liệu mới
-            await asyncio.sleep(1)
+        # Frame do producer chung tạo và serialize, ở đây chỉ gửi đi
+        await manager.serve(websocket)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         logger.info("Client đã ngắt kết nối")
     except Exception as e:
         logger.error(f"Lỗi WebSocket: {e}")
+    finally:
         manager.disconnect(websocket)
 
 
+@app.get("/api/ws/stats")
+async def get_ws_stats():
+    """API endpoint để xem chỉ số phát WebSocket (frame đã gửi, frame bị bỏ)."""
+    return JSONResponse(content=manager.stats())
+
+
 # API ENDPOINT SITES
 @app.get("/api/sites")
 async def api_get_sites():
@@ -508,7 +505,7 @@ async def api_remove_site(name: str = Form(...)):
 @app.post("/api/sites/connect")
 async def api_connect_site(name: str = Form(...)):
     """API endpoint để kết nối đến site."""
-    global site_manager, current_site, mikrotik_monitor, client_monitor, firewall_manager, capsman_manager, backup_manager, vpn_manager
+    global site_manager, current_site, mikrotik_monitor, vpn_manager
     
     if not site_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
@@ -518,10 +515,6 @@ async def api_connect_site(name: str = Form(...)):
         site_manager.disconnect_site(current_site)
         current_site = None
         mikrotik_monitor = None
-        client_monitor = None
-        firewall_manager = None
-        capsman_manager = None
-        backup_manager = None
         vpn_manager = None
     
     # Kết nối đến site mới
@@ -530,12 +523,8 @@ async def api_connect_site(name: str = Form(...)):
         current_site = name
         site = site_manager.get_site(name)
         
-        # Cập nhật các biến global
+        # Cập nhật các biến global; các module quản lý khác lấy qua get_site_module() khi dùng
         mikrotik_monitor = site.monitor
-        client_monitor = site.client_monitor
-        firewall_manager = site.firewall_manager
-        capsman_manager = site.capsman_manager
-        backup_manager = site.backup_manager
         
         return JSONResponse(content={"success": True, "message": f"Đã kết nối đến site {name}"})
     else:
@@ -544,7 +533,7 @@ async def api_connect_site(name: str = Form(...)):
 @app.post("/api/sites/disconnect")
 async def api_disconnect_site(name: str = Form(...)):
     """API endpoint để ngắt kết nối khỏi site."""
-    global site_manager, current_site, mikrotik_monitor, client_monitor, firewall_manager, capsman_manager, backup_manager, vpn_manager
+    global site_manager, current_site, mikrotik_monitor, vpn_manager
     
     if not site_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
@@ -555,10 +544,6 @@ async def api_disconnect_site(name: str = Form(...)):
     if result and current_site == name:
         current_site = None
         mikrotik_monitor = None
-        client_monitor = None
-        firewall_manager = None
-        capsman_manager = None
-        backup_manager = None
         vpn_manager = None
         
     if result:
@@ -566,7 +551,42 @@ async def api_disconnect_site(name: str = Form(...)):
     else:
         return JSONResponse(content={"success": False, "message": "Không thể ngắt kết nối khỏi site"}, status_code=500)
 
+@app.get("/api/fleet")
+async def api_get_fleet():
+    """API endpoint để lấy telemetry mới nhất của tất cả các site (từ bảng trạng thái, không gọi router)."""
+    global site_manager
+    
+    if not site_manager or not site_manager.fleet:
+        return JSONResponse(content={"error": "Chưa bật thu thập telemetry"}, status_code=500)
+    
+    return JSONResponse(content={
+        "sites": site_manager.get_fleet_state(),
+        "stats": site_manager.fleet.stats()
+    })
+
+@app.get("/api/fleet/{name}")
+async def api_get_fleet_site(name: str):
+    """API endpoint để lấy telemetry mới nhất của một site."""
+    global site_manager
+    
+    if not site_manager or not site_manager.fleet:
+        return JSONResponse(content={"error": "Chưa bật thu thập telemetry"}, status_code=500)
+    
+    state = site_manager.fleet.get(name)
+    if state is None:
+        return JSONResponse(content={"error": f"Chưa có telemetry cho site {name}"}, status_code=404)
+    return JSONResponse(content=state)
+
 # API ENDPOINTS DEVICE INFO
+@app.get("/api/poll/stats")
+async def get_poll_stats():
+    """API endpoint để xem chỉ số polling (chu kỳ bị bỏ qua, histogram độ trễ đọc counter)."""
+    if not mikrotik_monitor:
+        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+    
+    return JSONResponse(content=mikrotik_monitor.get_poll_stats())
+
+
 @app.get("/api/device-info")
 async def get_device_info():
     """API endpoint để lấy thông tin thiết bị."""
@@ -588,23 +608,30 @@ async def get_interfaces():
 
 
 @app.get("/api/traffic/{interface_name}")
-async def get_interface_traffic(interface_name: str):
-    """API endpoint để lấy dữ liệu traffic của một interface cụ thể."""
+async def get_interface_traffic(interface_name: str, max_points: int = 0):
+    """API endpoint để lấy dữ liệu traffic của một interface cụ thể.
+    
+    max_points > 0 giảm lịch sử bằng LTTB xuống tối đa số điểm đó.
+    """
     if not mikrotik_monitor:
         return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
     with mikrotik_monitor.lock:
-        if interface_name in mikrotik_monitor.data_history:
-            return JSONResponse(content=mikrotik_monitor.data_history[interface_name])
-        else:
+        if interface_name not in mikrotik_monitor.data_history:
             return JSONResponse(content={"error": f"Không tìm thấy interface {interface_name}"}, status_code=404)
+        data = dict(mikrotik_monitor.data_history[interface_name])
+    data['history'] = data['history'].points()
+    
+    if max_points > 0:
+        data['history'] = downsample_points(data['history'], max_points, y_keys=('tx_kbps', 'rx_kbps'))
+    return JSONResponse(content=data)
 
 
 # CLIENTS API ENDPOINTS
 @app.get("/api/clients")
 async def get_clients():
     """API endpoint để lấy danh sách các clients."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -616,7 +643,7 @@ async def get_clients():
 @app.get("/api/clients/wireless")
 async def get_wireless_clients():
     """API endpoint để lấy danh sách các clients kết nối không dây."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -628,7 +655,7 @@ async def get_wireless_clients():
 @app.get("/api/clients/dhcp")
 async def get_dhcp_leases():
     """API endpoint để lấy danh sách các DHCP leases."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -640,7 +667,7 @@ async def get_dhcp_leases():
 @app.get("/api/clients/blocked")
 async def get_blocked_clients():
     """API endpoint để lấy danh sách các clients bị block."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -652,7 +679,7 @@ async def get_blocked_clients():
 @app.post("/api/clients/block")
 async def block_client(ip: str = Form(None), mac: str = Form(None), comment: str = Form(None)):
     """API endpoint để block một client."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -670,7 +697,7 @@ async def block_client(ip: str = Form(None), mac: str = Form(None), comment: str
 @app.post("/api/clients/unblock")
 async def unblock_client(ip: str = Form(None), mac: str = Form(None)):
     """API endpoint để unblock một client."""
-    global client_monitor
+    client_monitor = get_site_module('client_monitor')
     
     if not client_monitor:
         return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
@@ -689,7 +716,7 @@ async def unblock_client(ip: str = Form(None), mac: str = Form(None)):
 @app.get("/api/firewall/filter")
 async def get_filter_rules():
     """API endpoint để lấy danh sách các filter rules."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -701,7 +728,7 @@ async def get_filter_rules():
 @app.get("/api/firewall/nat")
 async def get_nat_rules():
     """API endpoint để lấy danh sách các NAT rules."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -713,7 +740,7 @@ async def get_nat_rules():
 @app.get("/api/firewall/address-list")
 async def get_address_lists():
     """API endpoint để lấy danh sách các address lists."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -735,7 +762,7 @@ async def add_filter_rule(
     disabled: bool = Form(False)
 ):
     """API endpoint để thêm một filter rule mới."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -768,7 +795,7 @@ async def add_port_forward(
     disabled: bool = Form(False)
 ):
     """API endpoint để thêm một port forward rule mới."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -791,7 +818,7 @@ async def add_port_forward(
 @app.post("/api/firewall/rule/remove")
 async def remove_firewall_rule(rule_type: str = Form(...), rule_id: str = Form(...)):
     """API endpoint để xóa một rule."""
-    global firewall_manager
+    firewall_manager = get_site_module('firewall_manager')
     
     if not firewall_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
@@ -808,7 +835,7 @@ async def remove_firewall_rule(rule_type: str = Form(...), rule_id: str = Form(.
 @app.get("/api/capsman/status")
 async def get_capsman_status():
     """API endpoint để kiểm tra trạng thái CAPsMAN."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -820,7 +847,7 @@ async def get_capsman_status():
 @app.post("/api/capsman/enable")
 async def enable_capsman(enabled: bool = Form(True)):
     """API endpoint để bật/tắt CAPsMAN."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -837,7 +864,7 @@ async def enable_capsman(enabled: bool = Form(True)):
 @app.get("/api/capsman/profiles")
 async def get_configuration_profiles():
     """API endpoint để lấy danh sách configuration profiles."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -849,7 +876,7 @@ async def get_configuration_profiles():
 @app.get("/api/capsman/aps")
 async def get_access_points():
     """API endpoint để lấy danh sách Access Points."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -867,7 +894,7 @@ async def add_configuration_profile(
     datapath: str = Form(None)
 ):
     """API endpoint để thêm một configuration profile mới."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -883,7 +910,7 @@ async def add_configuration_profile(
 @app.post("/api/capsman/ap/reboot")
 async def reboot_access_point(mac: str = Form(...)):
     """API endpoint để khởi động lại một Access Point."""
-    global capsman_manager
+    capsman_manager = get_site_module('capsman_manager')
     
     if not capsman_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
@@ -900,7 +927,7 @@ async def reboot_access_point(mac: str = Form(...)):
 @app.get("/api/backup/list")
 async def list_backups():
     """API endpoint để liệt kê các file backup."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -912,7 +939,7 @@ async def list_backups():
 @app.get("/api/backup/exports")
 async def list_exports():
     """API endpoint để liệt kê các file export."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -924,7 +951,7 @@ async def list_exports():
 @app.post("/api/backup/create")
 async def create_backup(name: str = Form(None), include_sensitive: bool = Form(False)):
     """API endpoint để tạo một backup mới."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -944,7 +971,7 @@ async def create_export(
     include_sensitive: bool = Form(False)
 ):
     """API endpoint để xuất cấu hình."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -960,7 +987,7 @@ async def create_export(
 @app.post("/api/backup/restore")
 async def restore_backup(file: str = Form(...)):
     """API endpoint để khôi phục từ file backup."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -976,7 +1003,7 @@ async def restore_backup(file: str = Form(...)):
 @app.post("/api/backup/upload")
 async def upload_backup(backup_file: UploadFile = File(...)):
     """API endpoint để tải file backup lên."""
-    global backup_manager
+    backup_manager = get_site_module('backup_manager')
     
     if not backup_manager:
         return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
@@ -1088,6 +1115,10 @@ async def startup_event():
     site_manager = SiteManager()
     logger.info(f"Đã khởi tạo Site Manager")
     
+    # Thu thập telemetry của tất cả các site (FLEET_POLLING=0 để tắt)
+    if os.getenv('FLEET_POLLING', '1') != '0':
+        site_manager.start_fleet_polling()
+    
     # Tạo file templates
     create_template_files()
 
@@ -1101,6 +1132,9 @@ async def shutdown_event():
     if current_site:
         site_manager.disconnect_site(current_site)
         logger.info(f"Đã ngắt kết nối từ site {current_site}")
+    
+    if site_manager:
+        site_manager.stop_fleet_polling()
         
     logger.info("Đã ngắt kết nối từ thiết bị MikroTik")
 
@@ -1381,20 +1415,50 @@ def create_template_files():
         setupFormSubmission();
     });
 
+    // Lịch sử dựng lại từ frame full/append của /ws?protocol=delta;
+    // số điểm tối đa do server gửi kèm frame full (depth)
+    let maxHistory = 0;
+    let wsState = {device: null, interfaces: {}};
+    
+    function toPoint(row) {
+        return {timestamp: row[0], tx_kbps: row[1], rx_kbps: row[2], tx_mbps: row[1] / 1024, rx_mbps: row[2] / 1024};
+    }
+    
+    function applyFrame(frame) {
+        if (frame.device) wsState.device = frame.device;
+        if (frame.depth) maxHistory = frame.depth;
+        for (const name of frame.removed || []) delete wsState.interfaces[name];
+        for (const [name, rows] of Object.entries(frame.full || {})) {
+            wsState.interfaces[name] = rows.map(toPoint);
+        }
+        for (const [name, rows] of Object.entries(frame.append || {})) {
+            const history = (wsState.interfaces[name] || []).concat(rows.map(toPoint));
+            wsState.interfaces[name] = maxHistory ? history.slice(-maxHistory) : history;
+        }
+        
+        // Cùng dạng với snapshot đầy đủ (get_current_data) để giữ nguyên phần hiển thị
+        const interfaces = {};
+        for (const [name, history] of Object.entries(wsState.interfaces)) {
+            if (history.length) interfaces[name] = {current: history[history.length - 1], history: history};
+        }
+        return {device: wsState.device, interfaces: interfaces};
+    }
+
     // WebSocket Connection
     function connectWebSocket() {
         const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        const wsUrl = `${protocol}//${window.location.host}/ws?protocol=delta`;
         const socket = new WebSocket(wsUrl);
         
         socket.onopen = function(e) {
+            wsState = {device: null, interfaces: {}};
             console.log('WebSocket connection established');
             document.getElementById('connection-status').textContent = 'Đã kết nối';
             document.getElementById('connection-status').classList.add('status-connected');
         };
         
         socket.onmessage = function(event) {
-            const data = JSON.parse(event.data);
+            const data = applyFrame(JSON.parse(event.data));
             updateDashboard(data);
         };
         
@@ -2620,7 +2684,7 @@ def main():
     print(f"=== MikroTik Integrated Web Manager ===")
     print(f"Server đang chạy tại http://{args.host}:{args.port}")
     
-    uvicorn.run(app, host=args.host, port=args.port)
+    uvicorn.run(app, host=args.host, port=args.port, ws_per_message_deflate=True)
 
 
 if __name__ == "__main__":
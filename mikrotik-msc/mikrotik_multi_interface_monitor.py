@@ -39,6 +39,8 @@ except ImportError:
     os.system("pip install tabulate")
     from tabulate import tabulate
 
+from mikrotik_rates import RateEngine, to_kbps
+
 
 class MikroTikMultiInterfaceMonitor:
     """Lớp giám sát nhiều interface của thiết bị MikroTik."""
@@ -53,6 +55,7 @@ class MikroTikMultiInterfaceMonitor:
         self.running = False
         self.interfaces_data = {}  # Dữ liệu về mỗi interface
         self.lock = threading.Lock()  # Lock để đồng bộ hóa truy cập vào data
+        self.rates = RateEngine()  # Tốc độ theo thời gian monotonic đo thực tế
     
     def connect(self):
         """Kết nối đến thiết bị MikroTik và trả về API object."""
@@ -146,26 +149,14 @@ class MikroTikMultiInterfaceMonitor:
             if traffic_data:
                 current_tx, current_rx = traffic_data
                 
-                # Nếu đã có dữ liệu trước đó, tính toán tốc độ
+                # Tốc độ theo thời gian đo thực tế; None ở lần đầu hoặc khi counter bị reset
+                rates = self.rates.update(interface_name, traffic_data)
+                
                 with self.lock:
-                    previous_values = self.interfaces_data[interface_name]['previous_values']
-                    
-                    if previous_values:
-                        # Tính toán tốc độ dựa trên sự khác biệt
-                        tx_bytes = current_tx - previous_values[0]
-                        rx_bytes = current_rx - previous_values[1]
-                        
-                        # Bytes/giây
-                        tx_bytes_per_second = tx_bytes / interval
-                        rx_bytes_per_second = rx_bytes / interval
-                        
-                        # Bits/giây (1 byte = 8 bits)
-                        tx_bits_per_second = tx_bytes_per_second * 8
-                        rx_bits_per_second = rx_bytes_per_second * 8
-                        
+                    if rates:
                         # Chuyển đổi sang KB/s
-                        tx_kbps = tx_bits_per_second / 1024
-                        rx_kbps = rx_bits_per_second / 1024
+                        tx_kbps = to_kbps(rates[0])
+                        rx_kbps = to_kbps(rates[1])
                         
                         # Cập nhật dữ liệu
                         self.interfaces_data[interface_name]['history'].append({
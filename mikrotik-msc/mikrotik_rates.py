@@ -0,0 +1,178 @@
+"""
+Module tính tốc độ từ counter tích lũy (tx-byte, rx-byte, ...) của MikroTik
+
+- Dùng thời gian monotonic đo thực tế giữa hai lần đọc thay cho chu kỳ danh
+  nghĩa, nên lệnh API chậm không làm tốc độ tăng/giảm giả
+- Counter giảm được phân biệt giữa tràn (wrap) 32/64 bit và reset do router
+  khởi động lại; mẫu reset bị bỏ thay vì tạo đỉnh âm rất lớn
+- Có bản vector hóa (NumPy) cho nhiều counter cùng lúc và bản cho một giá trị
+  với cùng quy tắc
+"""
+
+import time
+import threading
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+
+COUNTER_32_MAX = 2 ** 32
+COUNTER_64_MAX = 2 ** 64
+
+# Counter giảm chỉ được coi là tràn nếu giá trị trước nằm ở phần trên này của dải
+WRAP_THRESHOLD = 0.75
+
+_WRAP_32_FLOOR = int(COUNTER_32_MAX * WRAP_THRESHOLD)
+_WRAP_64_FLOOR = int(COUNTER_64_MAX * WRAP_THRESHOLD)
+
+
+def counter_delta(previous: int, current: int) -> Optional[int]:
+    """Mức tăng của counter giữa hai lần đọc, None nếu counter bị reset
+
+    Counter giảm sau khi đã gần giá trị lớn nhất 32 hoặc 64 bit được tính là
+    tràn; các trường hợp giảm khác là reset (router khởi động lại, xóa counter).
+    """
+    if current >= previous:
+        return current - previous
+    if _WRAP_32_FLOOR <= previous < COUNTER_32_MAX and current < COUNTER_32_MAX:
+        return current + COUNTER_32_MAX - previous
+    if previous >= _WRAP_64_FLOOR:
+        return current + COUNTER_64_MAX - previous
+    return None
+
+
+def counter_deltas(previous: Any, current: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """Bản vector hóa của counter_delta
+
+    Returns:
+        tuple: (mức tăng dạng uint64, mask hợp lệ); phần tử reset có mask False
+    """
+    previous = np.asarray(previous, dtype=np.uint64)
+    current = np.asarray(current, dtype=np.uint64)
+    # Phép trừ uint64 tự quay vòng theo 2^64, nên tràn 64 bit không cần xử lý thêm
+    delta = current - previous
+    forward = current >= previous
+    wrap32 = (~forward & (previous >= _WRAP_32_FLOOR) & (previous < COUNTER_32_MAX)
+              & (current < COUNTER_32_MAX))
+    wrap64 = ~forward & (previous >= np.uint64(_WRAP_64_FLOOR))
+    delta = np.where(wrap32, delta & np.uint64(COUNTER_32_MAX - 1), delta)
+    valid = forward | wrap32 | wrap64
+    return np.where(valid, delta, np.uint64(0)), valid
+
+
+def compute_rates(previous: Any, current: Any, elapsed: Any,
+                  max_rate: Optional[float] = None) -> np.ndarray:
+    """Tốc độ (đơn vị counter/giây) cho mảng counter, NaN khi không hợp lệ
+
+    Args:
+        previous, current: Counter ở hai lần đọc (cùng shape)
+        elapsed: Số giây đo thực tế giữa hai lần đọc (số hoặc mảng broadcast được)
+        max_rate (float): Tốc độ lớn hơn giá trị này bị coi là reset
+    """
+    delta, valid = counter_deltas(previous, current)
+    elapsed = np.asarray(elapsed, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = delta.astype(np.float64) / elapsed
+    valid = valid & (elapsed > 0)
+    if max_rate is not None:
+        valid &= rates <= max_rate
+    return np.where(valid, rates, np.nan)
+
+
+def to_kbps(bytes_per_second: float) -> float:
+    """Đổi bytes/giây sang KB/s theo cách các monitor đang hiển thị (bit / 1024)"""
+    return bytes_per_second * 8 / 1024
+
+
+class RateEngine:
+    """Giữ lần đọc trước của mỗi khóa (interface) và trả về tốc độ cho lần đọc mới
+
+    Mỗi lần đọc là một bộ counter (ví dụ (tx_bytes, rx_bytes)) kèm thời điểm
+    monotonic. Lần đọc đầu tiên và lần đọc sau reset không có tốc độ (None).
+
+    Args:
+        max_rate (float): Tốc độ tối đa hợp lý (counter/giây), vượt quá coi là reset
+    """
+
+    def __init__(self, max_rate: Optional[float] = None):
+        self.max_rate = max_rate
+        self.resets = 0
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def reset(self, key: Optional[Hashable] = None) -> None:
+        """Quên lần đọc trước của một khóa (hoặc tất cả)"""
+        with self._lock:
+            if key is None:
+                self._previous.clear()
+            else:
+                self._previous.pop(key, None)
+
+    def update(self, key: Hashable, counters: Sequence[int],
+               now: Optional[float] = None) -> Optional[Tuple[float, ...]]:
+        """Ghi nhận một lần đọc, trả về tốc độ của từng counter hoặc None
+
+        `now` nên là time.monotonic() lấy ngay sau khi lệnh API trả về.
+        """
+        now = time.monotonic() if now is None else now
+        counters = tuple(int(value) for value in counters)
+        with self._lock:
+            previous = self._previous.get(key)
+            if previous is not None and now <= previous[1]:
+                # Hai lần đọc cùng thời điểm: giữ mốc cũ để lần sau có elapsed đúng
+                return None
+            self._previous[key] = (counters, now)
+        if previous is None:
+            return None
+
+        elapsed = now - previous[1]
+        rates = []
+        for old, new in zip(previous[0], counters):
+            delta = counter_delta(old, new)
+            rate = delta / elapsed if delta is not None else None
+            if rate is None or (self.max_rate is not None and rate > self.max_rate):
+                with self._lock:
+                    self.resets += 1
+                return None
+            rates.append(rate)
+        return tuple(rates)
+
+    def update_many(self, samples: Dict[Hashable, Sequence[int]],
+                    now: Optional[float] = None) -> Dict[Hashable, Optional[Tuple[float, ...]]]:
+        """Ghi nhận lần đọc của nhiều khóa cùng thời điểm (vector hóa)
+
+        Args:
+            samples (dict): khóa -> bộ counter (mọi khóa có cùng số counter)
+
+        Returns:
+            dict: khóa -> tốc độ của từng counter, hoặc None
+        """
+        now = time.monotonic() if now is None else now
+        results = {key: None for key in samples}
+        keys = []
+        previous_rows = []
+        current_rows = []
+        elapsed = []
+        with self._lock:
+            for key, counters in samples.items():
+                previous = self._previous.get(key)
+                if previous is not None and now <= previous[1]:
+                    continue
+                counters = tuple(int(value) for value in counters)
+                self._previous[key] = (counters, now)
+                if previous is not None:
+                    keys.append(key)
+                    previous_rows.append(previous[0])
+                    current_rows.append(counters)
+                    elapsed.append(now - previous[1])
+        if not keys:
+            return results
+
+        rates = compute_rates(previous_rows, current_rows,
+                              np.asarray(elapsed)[:, None], self.max_rate)
+        ok = ~np.isnan(rates).any(axis=1)
+        with self._lock:
+            self.resets += int((~ok).sum())
+        for key, row, valid in zip(keys, rates.tolist(), ok.tolist()):
+            if valid:
+                results[key] = tuple(row)
+        return results
@@ -0,0 +1,145 @@
+"""
+Lịch polling theo hạn chót và histogram độ trễ
+
+- DeadlineSchedule: các lần chạy rơi vào origin + k * interval (không trôi
+  theo thời gian thực thi); nếu một lần chạy quá lâu, các hạn chót đã lỡ bị
+  bỏ qua thay vì dồn lại chạy bù
+- LatencyHistogram: đếm độ trễ theo bucket cố định, ước lượng phân vị để
+  biết thiết bị nào phản hồi chậm hoặc bị tụt lại
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+# Biên trên các bucket độ trễ (giây)
+DEFAULT_LATENCY_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class DeadlineSchedule:
+    """Hạn chót chạy định kỳ theo thời gian monotonic
+
+    Args:
+        interval (float): Chu kỳ (giây)
+        start (float): Hạn chót đầu tiên (mặc định: ngay bây giờ)
+    """
+
+    def __init__(self, interval: float, start: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if interval <= 0:
+            raise ValueError(f"Chu kỳ không hợp lệ: {interval}")
+        self.interval = float(interval)
+        self.clock = clock
+        self.next_deadline = clock() if start is None else start
+        self.ticks = 0
+        self.skipped = 0
+
+    def delay(self) -> float:
+        """Số giây còn lại đến hạn chót kế tiếp (0 nếu đã đến hạn)"""
+        return max(0.0, self.next_deadline - self.clock())
+
+    def due(self) -> bool:
+        return self.clock() >= self.next_deadline
+
+    def advance(self) -> int:
+        """Chuyển sang hạn chót kế tiếp sau khi chạy xong một lần
+
+        Returns:
+            int: Số hạn chót đã lỡ và bị bỏ qua
+        """
+        now = self.clock()
+        self.ticks += 1
+        self.next_deadline += self.interval
+        missed = 0
+        if now >= self.next_deadline:
+            missed = int((now - self.next_deadline) // self.interval) + 1
+            self.next_deadline += missed * self.interval
+            self.skipped += missed
+        return missed
+
+    def reschedule(self, delay: float) -> None:
+        """Đặt hạn chót kế tiếp sau `delay` giây (dùng cho backoff)"""
+        self.next_deadline = self.clock() + delay
+
+    def wait(self, stop: Optional[threading.Event] = None) -> bool:
+        """Ngủ đến hạn chót kế tiếp; False nếu `stop` được set trong lúc chờ"""
+        delay = self.delay()
+        if stop is not None:
+            return not stop.wait(delay)
+        if delay:
+            time.sleep(delay)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval': self.interval,
+            'ticks': self.ticks,
+            'skipped': self.skipped
+        }
+
+
+class LatencyHistogram:
+    """Histogram độ trễ (giây) với các bucket cố định, an toàn giữa các thread
+
+    Args:
+        bounds (list): Biên trên của từng bucket, bucket cuối là +Inf
+    """
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_LATENCY_BOUNDS):
+        self.bounds = tuple(sorted(bounds))
+        self._counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Ước lượng phân vị q (0-100): biên trên của bucket chứa mẫu đó
+
+        Mẫu rơi vào bucket +Inf được ước lượng bằng giá trị lớn nhất đã gặp.
+        """
+        with self._lock:
+            if not self.count:
+                return math.nan
+            rank = max(math.ceil(self.count * q / 100.0), 1)
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[index] if index < len(self.bounds) else self.max
+            return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Thống kê dạng dict (mili giây) cho API/JSON"""
+        with self._lock:
+            counts = list(self._counts)
+            count, total, maximum, last = self.count, self.total, self.max, self.last
+        buckets = {f"le_{bound * 1000:g}ms": n for bound, n in zip(self.bounds, counts)}
+        buckets['inf'] = counts[-1]
+
+        def ms(value):
+            return None if value is None or math.isnan(value) else round(value * 1000, 3)
+
+        return {
+            'count': count,
+            'mean_ms': ms(total / count) if count else None,
+            'max_ms': ms(maximum) if count else None,
+            'last_ms': ms(last),
+            'p50_ms': ms(self.quantile(50)),
+            'p95_ms': ms(self.quantile(95)),
+            'p99_ms': ms(self.quantile(99)),
+            'buckets': buckets
+        }
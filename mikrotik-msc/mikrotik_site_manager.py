@@ -12,6 +12,7 @@ import json
 import time
 import logging
 import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
@@ -28,14 +29,119 @@ logger = logging.getLogger('mikrotik_site_manager')
 
 # Import các module quản lý nếu có
 try:
+    import routeros_api
     from mikrotik_web_monitor import MikroTikMonitor
     from mikrotik_client_monitor import MikroTikClientMonitor
     from mikrotik_firewall_manager import MikroTikFirewallManager
     from mikrotik_capsman_manager import MikroTikCAPsMANManager
     from mikrotik_backup_manager import MikroTikBackupManager
+    from mikrotik_rates import RateEngine, to_kbps
+    from mikrotik_fleet import FleetPoller, DEFAULT_WORKERS as FLEET_WORKERS
 except ImportError as e:
     logger.warning(f"Không thể import một số module: {e}")
 
+# Số site kết nối/kiểm tra đồng thời và thời hạn (giây) cho toàn bộ lần kết nối/kiểm tra một site
+DEFAULT_CONNECT_WORKERS = int(os.getenv('SITE_CONNECT_WORKERS', 32))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('SITE_CONNECT_TIMEOUT', 5))
+
+# Trường interface đọc mỗi lần poll telemetry
+TELEMETRY_PROPLIST = 'name,tx-byte,rx-byte,running,disabled'
+
+
+class _SerializedResource:
+    """Resource RouterOS mà mọi lệnh đều chạy dưới lock của phiên (và trong hạn chót của phiên)."""
+    
+    def __init__(self, resource, session):
+        self._resource = resource
+        self._session = session
+    
+    def __getattr__(self, name):
+        attr = getattr(self._resource, name)
+        if not callable(attr):
+            return attr
+        
+        def call(*args, **kwargs):
+            with self._session.lock:
+                self._session.check_deadline()
+                return attr(*args, **kwargs)
+        return call
+
+
+class _SerializedApi:
+    """API RouterOS dùng chung: routeros_api không an toàn khi nhiều thread gửi lệnh
+    trên cùng một kết nối, nên các lệnh được tuần tự hóa."""
+    
+    def __init__(self, api, session):
+        self._api = api
+        self._session = session
+    
+    def get_resource(self, *args, **kwargs):
+        return _SerializedResource(self._api.get_resource(*args, **kwargs), self._session)
+    
+    def get_binary_resource(self, *args, **kwargs):
+        return _SerializedResource(self._api.get_binary_resource(*args, **kwargs), self._session)
+    
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+
+class SiteSession:
+    """Một phiên RouterOS API (một lần đăng nhập) dùng chung cho mọi module của site."""
+    
+    def __init__(self, host, username, password, timeout=DEFAULT_CONNECT_TIMEOUT):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.connection = None
+        self.api = None
+        self.lock = threading.RLock()
+        self.deadline = None  # Hạn chót (time.monotonic) của thao tác đang làm, None: không giới hạn
+    
+    def check_deadline(self):
+        """Raise TimeoutError nếu đã quá hạn chót của phiên."""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise TimeoutError(f"Quá thời hạn khi làm việc với {self.host}")
+    
+    def connect(self):
+        """Mở kết nối và đăng nhập; mỗi thao tác socket bị giới hạn bởi timeout
+        (và không quá thời gian còn lại đến hạn chót)."""
+        try:
+            self.check_deadline()
+            timeout = self.timeout
+            if self.deadline is not None:
+                timeout = min(timeout, self.deadline - time.monotonic())
+            connection = routeros_api.RouterOsApiPool(
+                self.host,
+                username=self.username,
+                password=self.password,
+                plaintext_login=True
+            )
+            connection.set_timeout(timeout)
+            api = connection.get_api()
+            self.connection = connection
+            self.api = _SerializedApi(api, self)
+            return self.api
+        except Exception as e:
+            logger.error(f"Lỗi kết nối đến {self.host}: {e}")
+            return None
+    
+    def disconnect(self):
+        if self.connection:
+            try:
+                self.connection.disconnect()
+            finally:
+                self.connection = None
+                self.api = None
+    
+    def ping(self):
+        """Gửi một lệnh nhẹ (/system/identity) và trả về độ trễ (giây); lỗi sẽ được raise."""
+        if not self.api:
+            raise ConnectionError(f"Chưa kết nối đến {self.host}")
+        started = time.monotonic()
+        self.api.get_resource('/system/identity').get()
+        return time.monotonic() - started
+
 
 class Site:
     """Lớp đại diện cho một site (thiết bị MikroTik)."""
@@ -50,93 +156,228 @@ class Site:
         self.location = None
         self.contact = None
         self.tags = []
+        self.poll_interval = None  # Chu kỳ poll telemetry riêng (None: mặc định của fleet)
         self.last_seen = None
         self.status = "offline"
         
-        # Các module quản lý
+        # Phiên API dùng chung và monitor chính
+        self.session = None
         self.monitor = None
-        self.client_monitor = None
-        self.firewall_manager = None
-        self.capsman_manager = None
-        self.backup_manager = None
+        self._telemetry_session = None  # Phiên của fleet poller khi site không kết nối
+        
+        # Các module quản lý khác, khởi tạo khi dùng lần đầu (không đăng nhập thêm)
+        self._modules = {}
         
         self.lock = threading.Lock()
         self.connection_thread = None
         self._connected = False
+    
+    # Thuộc tính module -> tên lớp
+    MODULES = {
+        'client_monitor': 'MikroTikClientMonitor',
+        'firewall_manager': 'MikroTikFirewallManager',
+        'capsman_manager': 'MikroTikCAPsMANManager',
+        'backup_manager': 'MikroTikBackupManager'
+    }
+    
+    def _get_module(self, attr):
+        """Lấy (hoặc khởi tạo lần đầu) một module quản lý trên phiên dùng chung."""
+        with self.lock:
+            module = self._modules.get(attr)
+            if module is None and self._connected and self.session:
+                module_class = globals().get(self.MODULES[attr])
+                if module_class is None:
+                    logger.warning(f"Module {self.MODULES[attr]} không khả dụng")
+                    return None
+                # connection giữ None để disconnect() của module không đóng phiên dùng chung
+                module = module_class(self.host, self.username, self.password)
+                module.api = self.session.api
+                self._modules[attr] = module
+            return module
+    
+    @property
+    def client_monitor(self):
+        return self._get_module('client_monitor')
+    
+    @property
+    def firewall_manager(self):
+        return self._get_module('firewall_manager')
+    
+    @property
+    def capsman_manager(self):
+        return self._get_module('capsman_manager')
+    
+    @property
+    def backup_manager(self):
+        return self._get_module('backup_manager')
+    
+    def connect(self, timeout=DEFAULT_CONNECT_TIMEOUT, start_monitoring=True):
+        """Kết nối đến site bằng một phiên API dùng chung.
         
-    def connect(self):
-        """Kết nối đến site."""
-        # Khởi tạo monitor chính
-        if 'MikroTikMonitor' in globals():
-            self.monitor = MikroTikMonitor(self.host, self.username, self.password)
-            api = self.monitor.connect()
-            if api:
-                self._connected = True
-                self.status = "online"
-                self.last_seen = datetime.now()
-                self.monitor.start_monitoring(interval=2)
-            else:
-                self._connected = False
-                self.status = "error"
-                return False
-        else:
+        timeout là thời hạn cho cả lần kết nối (kết nối TCP, đăng nhập và các lệnh
+        đọc thông tin thiết bị): không gửi thêm lệnh sau hạn chót, và nếu đã quá hạn
+        khi xong thì phiên bị đóng, site được coi là kết nối thất bại.
+        """
+        if 'MikroTikMonitor' not in globals():
             logger.warning("Module MikroTikMonitor không khả dụng")
             return False
-            
-        # Khởi tạo các module khác nếu có
+        
         if self._connected:
-            try:
-                if 'MikroTikClientMonitor' in globals():
-                    self.client_monitor = MikroTikClientMonitor(self.host, self.username, self.password)
-                    self.client_monitor.connect()
-                
-                if 'MikroTikFirewallManager' in globals():
-                    self.firewall_manager = MikroTikFirewallManager(self.host, self.username, self.password)
-                    self.firewall_manager.connect()
-                
-                if 'MikroTikCAPsMANManager' in globals():
-                    self.capsman_manager = MikroTikCAPsMANManager(self.host, self.username, self.password)
-                    self.capsman_manager.connect()
-                
-                if 'MikroTikBackupManager' in globals():
-                    self.backup_manager = MikroTikBackupManager(self.host, self.username, self.password)
-                    self.backup_manager.connect()
-                    
-                logger.info(f"Đã kết nối đến site {self.name} ({self.host})")
-                return True
-            except Exception as e:
-                logger.error(f"Lỗi khi khởi tạo các module cho site {self.name}: {e}")
-                return False
-        else:
+            return True
+        
+        session = SiteSession(self.host, self.username, self.password, timeout)
+        session.deadline = time.monotonic() + timeout
+        if not session.connect():
+            self._connected = False
+            self.status = "error"
             return False
+        
+        try:
+            # Monitor chính dùng phiên chung thay vì tự đăng nhập
+            monitor = MikroTikMonitor(self.host, self.username, self.password)
+            monitor.api = session.api
+            monitor.get_device_info()
+            session.check_deadline()
+            session.deadline = None
+            
+            with self.lock:
+                self.session = session
+                self.monitor = monitor
+                self._modules = {}
+                self._connected = True
+            self.status = "online"
+            self.last_seen = datetime.now()
+            
+            # Fleet poller chuyển sang phiên chung: đóng phiên riêng để mỗi site chỉ một lần đăng nhập
+            self.close_telemetry()
+
+            if start_monitoring:
+                monitor.start_monitoring(interval=2)
             
+            logger.info(f"Đã kết nối đến site {self.name} ({self.host})")
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi khi khởi tạo các module cho site {self.name}: {e}")
+            session.disconnect()
+            self.status = "error"
+            return False
+    
     def disconnect(self):
         """Ngắt kết nối khỏi site."""
         try:
             if self.monitor:
                 self.monitor.stop_monitoring()
-                self.monitor.disconnect()
-                
-            if self.client_monitor:
-                self.client_monitor.disconnect()
-                
-            if self.firewall_manager:
-                self.firewall_manager.disconnect()
-                
-            if self.capsman_manager:
-                self.capsman_manager.disconnect()
-                
-            if self.backup_manager:
-                self.backup_manager.disconnect()
-                
-            self._connected = False
+            
+            with self.lock:
+                self._modules = {}
+                self._connected = False
+                session, self.session = self.session, None
+            if session:
+                session.disconnect()
+            
             self.status = "offline"
             logger.info(f"Đã ngắt kết nối khỏi site {self.name} ({self.host})")
             return True
         except Exception as e:
             logger.error(f"Lỗi khi ngắt kết nối khỏi site {self.name}: {e}")
             return False
+    
+    def check_health(self, timeout=DEFAULT_CONNECT_TIMEOUT):
+        """Kiểm tra site có phản hồi không.
+        
+        Site đang kết nối được kiểm tra trên phiên hiện có; site chưa kết nối được
+        kiểm tra bằng một phiên tạm (đăng nhập rồi đóng ngay).
+        """
+        result = {"name": self.name, "host": self.host, "latency_ms": None, "error": None}
+        session = self.session if self._connected else None
+        temporary = session is None
+        try:
+            if temporary:
+                session = SiteSession(self.host, self.username, self.password, timeout)
+                session.deadline = time.monotonic() + timeout
+                if not session.connect():
+                    raise ConnectionError(f"Không thể kết nối đến {self.host}")
+            result["latency_ms"] = round(session.ping() * 1000, 1)
+            self.last_seen = datetime.now()
+            if not temporary:
+                self.status = "online"
+        except Exception as e:
+            result["error"] = str(e)
+            if not temporary:
+                self.status = "error"
+        finally:
+            if temporary and session:
+                session.disconnect()
+        
+        result["status"] = "online" if result["error"] is None else "error"
+        return result
             
+    def poll_telemetry(self, rates, timeout=DEFAULT_CONNECT_TIMEOUT):
+        """Đọc tài nguyên hệ thống và counter interface của site (hai lệnh trên một phiên).
+        
+        Dùng phiên của site nếu đang kết nối, nếu không thì giữ một phiên riêng cho
+        fleet poller giữa các lần poll. rates là RateEngine dùng chung, khóa (site, interface).
+        Lỗi được raise để poller áp dụng backoff.
+        """
+        session = self.session if self._connected else self._telemetry_session
+        if session is None or not session.api:
+            session = SiteSession(self.host, self.username, self.password, timeout)
+            if not session.connect():
+                raise ConnectionError(f"Không thể kết nối đến {self.host}")
+            self._telemetry_session = session
+        
+        try:
+            resource = session.api.get_resource('/system/resource').get()[0]
+            rows = session.api.get_resource('/interface').call('print', {'.proplist': TELEMETRY_PROPLIST})
+        except Exception:
+            if session is self._telemetry_session:
+                self.close_telemetry()
+            raise
+        now = time.monotonic()
+        self.last_seen = datetime.now()
+        
+        counters = {}
+        interfaces = {}
+        for row in rows:
+            name = row.get('name')
+            if not name:
+                continue
+            counters[(self.name, name)] = (int(row.get('tx-byte', '0')), int(row.get('rx-byte', '0')))
+            interfaces[name] = {
+                'running': row.get('running') == 'true',
+                'disabled': row.get('disabled') == 'true',
+                'tx_kbps': None,
+                'rx_kbps': None
+            }
+        
+        # Tốc độ của mọi interface trong một lượt (None ở lần đầu hoặc khi counter bị reset)
+        for (_, name), rate in rates.update_many(counters, now).items():
+            if rate:
+                interfaces[name]['tx_kbps'] = round(to_kbps(rate[0]), 2)
+                interfaces[name]['rx_kbps'] = round(to_kbps(rate[1]), 2)
+        
+        return {
+            'site': self.name,
+            'host': self.host,
+            'resource': {
+                'model': resource.get('board-name', 'Unknown'),
+                'ros_version': resource.get('version', 'Unknown'),
+                'uptime': resource.get('uptime', 'Unknown'),
+                'cpu_load': int(resource.get('cpu-load', '0')),
+                'free_memory': int(resource.get('free-memory', '0')) // 1024 // 1024,
+                'total_memory': int(resource.get('total-memory', '0')) // 1024 // 1024
+            },
+            'interfaces': interfaces,
+            'tx_kbps': round(sum(iface['tx_kbps'] or 0 for iface in interfaces.values()), 2),
+            'rx_kbps': round(sum(iface['rx_kbps'] or 0 for iface in interfaces.values()), 2)
+        }
+    
+    def close_telemetry(self):
+        """Đóng phiên riêng của fleet poller (nếu có)."""
+        session, self._telemetry_session = self._telemetry_session, None
+        if session:
+            session.disconnect()
+    
     def is_connected(self):
         """Kiểm tra xem site có đang kết nối không."""
         return self._connected
@@ -168,6 +409,8 @@ class SiteManager:
         """Khởi tạo với file cấu hình các site."""
         self.sites = {}  # name -> Site object
         self.active_site = None
+        self.fleet = None  # FleetPoller khi đang thu thập telemetry toàn bộ site
+        self.fleet_rates = None
         self.config_file = config_file or "sites.json"
         
         # Tạo file cấu hình mặc định nếu chưa có
@@ -231,6 +474,7 @@ class SiteManager:
                     site.location = site_config.get("location")
                     site.contact = site_config.get("contact")
                     site.tags = site_config.get("tags", [])
+                    site.poll_interval = site_config.get("poll_interval")
                     
                     self.sites[name] = site
                     
@@ -239,7 +483,8 @@ class SiteManager:
             # Nếu chỉ có một site, đặt làm active site
             if len(self.sites) == 1:
                 self.active_site = list(self.sites.keys())[0]
-                
+            
+            self._sync_fleet()
             return True
         except Exception as e:
             logger.error(f"Lỗi khi load cấu hình site: {e}")
@@ -261,6 +506,8 @@ class SiteManager:
                     "contact": site.contact,
                     "tags": site.tags
                 }
+                if site.poll_interval:
+                    site_config["poll_interval"] = site.poll_interval
                 
                 config["sites"].append(site_config)
                 
@@ -281,6 +528,8 @@ class SiteManager:
             
         site = Site(name, host, username, password, description)
         self.sites[name] = site
+        if self.fleet:
+            self.fleet.add(name, site.poll_interval)
         
         # Kết nối đến site nếu yêu cầu
         if connect:
@@ -305,6 +554,9 @@ class SiteManager:
             
         # Xóa site
         del self.sites[name]
+        if self.fleet:
+            self.fleet.remove(name)
+        site.close_telemetry()
         
         # Cập nhật active site nếu cần
         if self.active_site == name:
@@ -351,10 +603,13 @@ class SiteManager:
     def get_sites(self):
         """Lấy danh sách tất cả các site."""
         result = []
+        telemetry = self.get_fleet_state()
         
         for name, site in self.sites.items():
             info = site.get_info()
             info["active"] = (name == self.active_site)
+            if self.fleet:
+                info["telemetry"] = telemetry.get(name)
             result.append(info)
             
         return result
@@ -373,32 +628,145 @@ class SiteManager:
             
         return self.sites[self.active_site]
     
-    def connect_all(self):
-        """Kết nối đến tất cả các site."""
-        for name, site in self.sites.items():
-            try:
-                site.connect()
-            except Exception as e:
-                logger.error(f"Lỗi khi kết nối đến site {name}: {e}")
+    def _run_all(self, func, sites=None, workers=None, timeout=None):
+        """Chạy func(site) song song cho các site với số thread giới hạn, trả về dict tên -> kết quả.
+        
+        timeout: thời hạn (giây) của mỗi site tính từ lúc func(site) bắt đầu chạy. Site quá
+        hạn có kết quả None và không được chờ thêm; thread của nó tự kết thúc sau đó.
+        """
+        sites = list(self.sites.values()) if sites is None else sites
+        if not sites:
+            return {}
+        
+        started = {}
+        
+        def run(site):
+            started[site.name] = time.monotonic()
+            return func(site)
+        
+        workers = min(workers or DEFAULT_CONNECT_WORKERS, len(sites))
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='site')
+        futures = {executor.submit(run, site): site.name for site in sites}
+        pending = set(futures)
+        results = {}
+        try:
+            while pending:
+                wait_timeout = None
+                if timeout is not None:
+                    now = time.monotonic()
+                    deadlines = [started[futures[future]] + timeout for future in pending if futures[future] in started]
+                    wait_timeout = max(0.0, min(deadlines, default=now + timeout) - now)
+                done, pending = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"Lỗi khi xử lý site {name}: {e}")
+                        results[name] = None
                 
+                if timeout is not None:
+                    now = time.monotonic()
+                    for future in [f for f in pending if futures[f] in started and now - started[futures[f]] >= timeout]:
+                        pending.discard(future)
+                        logger.warning(f"Site {futures[future]}: quá thời hạn {timeout} giây")
+                        results[futures[future]] = None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return {site.name: results.get(site.name) for site in sites}
+    
+    def connect_all(self, workers=None, timeout=DEFAULT_CONNECT_TIMEOUT, start_monitoring=None):
+        """Kết nối song song đến tất cả các site.
+        
+        Mỗi site có thời hạn riêng (timeout) cho cả lần kết nối, tính từ lúc bắt đầu
+        kết nối site đó; site quá hạn được báo thất bại và không chặn các site khác. Khi fleet poller đang chạy,
+        mặc định không khởi động thread MikroTikMonitor cho từng site.
+        Trả về dict tên site -> True/False.
+        """
+        if start_monitoring is None:
+            start_monitoring = self.fleet is None
+        started = time.monotonic()
+        results = self._run_all(lambda site: site.connect(timeout=timeout, start_monitoring=start_monitoring),
+                                workers=workers, timeout=timeout)
+        results = {name: bool(result) for name, result in results.items()}
+        
         # Đặt active site là site đầu tiên đã kết nối thành công
         for name, site in self.sites.items():
             if site.is_connected():
                 self.active_site = name
                 break
-                
-        return True
+        
+        connected = sum(results.values())
+        logger.info(f"Đã kết nối {connected}/{len(results)} site trong {time.monotonic() - started:.1f} giây")
+        return results
     
-    def disconnect_all(self):
-        """Ngắt kết nối khỏi tất cả các site."""
-        for name, site in self.sites.items():
-            try:
-                site.disconnect()
-            except Exception as e:
-                logger.error(f"Lỗi khi ngắt kết nối khỏi site {name}: {e}")
-                
+    def disconnect_all(self, workers=None):
+        """Ngắt kết nối song song khỏi tất cả các site."""
+        self._run_all(lambda site: site.disconnect(), workers=workers)
         self.active_site = None
         return True
+    
+    def check_all(self, workers=None, timeout=DEFAULT_CONNECT_TIMEOUT):
+        """Kiểm tra tình trạng song song của tất cả các site, trả về danh sách kết quả."""
+        results = self._run_all(lambda site: site.check_health(timeout=timeout), workers=workers, timeout=timeout)
+        return [
+            results.get(name) or {
+                "name": name, "host": site.host, "latency_ms": None,
+                "error": f"Quá thời hạn {timeout} giây", "status": "error"
+            }
+            for name, site in self.sites.items()
+        ]
+    
+    def start_fleet_polling(self, interval=None, workers=None):
+        """Bắt đầu thu thập telemetry định kỳ cho tất cả các site.
+        
+        Kết quả mới nhất của mỗi site nằm trong bảng trạng thái (get_fleet_state),
+        giao diện web đọc bảng này thay vì gọi router khi có request.
+        """
+        if self.fleet:
+            return self.fleet
+        
+        self.fleet_rates = RateEngine()
+        kwargs = {'workers': workers or FLEET_WORKERS}
+        if interval:
+            kwargs['interval'] = interval
+        self.fleet = FleetPoller(self._poll_site, **kwargs)
+        self._sync_fleet()
+        self.fleet.start()
+        return self.fleet
+    
+    def stop_fleet_polling(self):
+        """Dừng thu thập telemetry và đóng các phiên riêng của poller."""
+        if not self.fleet:
+            return
+        
+        self.fleet.stop()
+        self.fleet = None
+        self._run_all(lambda site: site.close_telemetry())
+    
+    def get_fleet_state(self):
+        """Bảng trạng thái telemetry mới nhất: tên site -> dict (rỗng nếu chưa bật)."""
+        return self.fleet.snapshot() if self.fleet else {}
+    
+    def _poll_site(self, name):
+        site = self.sites.get(name)
+        if site is None:
+            raise KeyError(f"Site {name} không tồn tại")
+        return site.poll_telemetry(self.fleet_rates)
+    
+    def _sync_fleet(self):
+        """Đồng bộ danh sách thiết bị của fleet poller với các site hiện có."""
+        if not self.fleet:
+            return
+        
+        current = set(self.fleet.devices())
+        for name in current:
+            if name not in self.sites:
+                self.fleet.remove(name)
+        for name, site in self.sites.items():
+            if name not in current:
+                self.fleet.add(name, site.poll_interval)
 
 
 def main():
@@ -443,6 +811,17 @@ def main():
     # Lệnh disconnect all
     disconnect_all_parser = subparsers.add_parser('disconnect-all', help='Ngắt kết nối khỏi tất cả các site')
     
+    # Lệnh fleet
+    fleet_parser = subparsers.add_parser('fleet', help='Thu thập telemetry của tất cả các site trong một khoảng thời gian')
+    fleet_parser.add_argument('--duration', type=float, default=60, help='Thời gian thu thập (giây)')
+    fleet_parser.add_argument('--interval', type=float, help='Chu kỳ poll mặc định (giây)')
+    fleet_parser.add_argument('--workers', type=int, help='Số site poll đồng thời')
+    
+    # Lệnh health
+    health_parser = subparsers.add_parser('health', help='Kiểm tra tình trạng tất cả các site')
+    health_parser.add_argument('--workers', type=int, default=DEFAULT_CONNECT_WORKERS, help='Số site kiểm tra đồng thời')
+    health_parser.add_argument('--timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT, help='Thời hạn cho mỗi site (giây)')
+    
     # Parse arguments
     args = parser.parse_args()
     
@@ -491,13 +870,43 @@ def main():
             print(f"Không thể ngắt kết nối khỏi site {args.name}")
     
     elif args.command == 'connect-all':
-        site_manager.connect_all()
-        print("Đã kết nối đến tất cả các site")
+        results = site_manager.connect_all()
+        print(f"Đã kết nối đến {sum(results.values())}/{len(results)} site")
     
     elif args.command == 'disconnect-all':
         site_manager.disconnect_all()
         print("Đã ngắt kết nối khỏi tất cả các site")
     
+    elif args.command == 'fleet':
+        fleet = site_manager.start_fleet_polling(interval=args.interval, workers=args.workers)
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        state = site_manager.get_fleet_state()
+        stats = fleet.stats()
+        site_manager.stop_fleet_polling()
+        
+        print(f"Telemetry {len(state)}/{stats['devices']} site: {stats['polls']} lần poll, "
+              f"{stats['failures']} lỗi, p95 {stats['latency']['p95_ms']} ms")
+        for name, entry in sorted(state.items()):
+            if entry['status'] == 'online':
+                resource = entry.get('resource', {})
+                print(f"  \033[92monline\033[0m      {name} - CPU {resource.get('cpu_load')}% - "
+                      f"TX {entry['tx_kbps']:.1f} KB/s - RX {entry['rx_kbps']:.1f} KB/s - {entry['latency_ms']} ms")
+            else:
+                print(f"  \033[91munreachable\033[0m {name} - {entry['error']} ({entry['failures']} lần lỗi)")
+    
+    elif args.command == 'health':
+        results = site_manager.check_all(workers=args.workers, timeout=args.timeout)
+        online = [result for result in results if result['status'] == 'online']
+        print(f"Tình trạng {len(results)} site ({len(online)} online):")
+        for result in results:
+            if result['status'] == 'online':
+                print(f"  \033[92monline\033[0m  {result['name']} - {result['host']} - {result['latency_ms']} ms")
+            else:
+                print(f"  \033[91merror\033[0m   {result['name']} - {result['host']} - {result['error']}")
+    
     else:
         # Nếu không có lệnh nào được chỉ định, hiển thị trợ giúp
         parser.print_help()
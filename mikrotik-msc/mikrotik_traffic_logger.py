@@ -12,6 +12,8 @@ import sqlite3
 import logging
 import argparse
 import threading
+import collections
+import numpy as np
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -32,23 +34,409 @@ except ImportError:
     logger.error("Không thể import routeros_api. Chạy: pip install routeros-api")
     sys.exit(1)
 
+from mikrotik_rates import RateEngine, counter_delta, to_kbps
+from mikrotik_columnar import ColumnarTrafficStore, open_traffic_source
+
+# Chỉ lấy các trường counter khi đọc /interface/print cho toàn bộ interface
+TRAFFIC_PROPLIST = 'name,tx-byte,rx-byte,tx-packet,rx-packet'
+
+# Nhịp commit mặc định của TrafficDataWriter
+DEFAULT_COMMIT_INTERVAL = float(os.getenv('TRAFFIC_COMMIT_INTERVAL', 1.0))
+DEFAULT_COMMIT_ROWS = int(os.getenv('TRAFFIC_COMMIT_ROWS', 5000))
+
+# Độ dài (giây) mỗi khoảng lịch sử được đọc khi tính lại thống kê từ traffic_chunks
+BACKFILL_WINDOW = 86400
+
+INSERT_TRAFFIC_SQL = '''
+INSERT INTO traffic_data 
+(interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class TrafficDataWriter:
+    """Ghi traffic_data theo lô trên một kết nối SQLite (WAL) dùng lâu dài.
+    
+    Các luồng thu thập gọi submit() với một lô dòng; một luồng ghi duy nhất
+    gom các lô và ghi bằng executemany trong một transaction mỗi khi đủ
+    commit_rows dòng hoặc sau commit_interval giây.
+    
+    backend='columnar' ghi vào các khối nén của ColumnarTrafficStore thay vì
+    bảng traffic_data.
+    """
+    
+    def __init__(self, db_file, commit_interval=DEFAULT_COMMIT_INTERVAL,
+                 commit_rows=DEFAULT_COMMIT_ROWS, max_backlog=200000, backend='sqlite'):
+        """Khởi tạo writer, luồng ghi được tạo khi gọi start()."""
+        self.db_file = db_file
+        self.backend = backend
+        self.commit_interval = commit_interval
+        self.commit_rows = commit_rows
+        self.max_backlog = max_backlog
+        self._pending = collections.deque()
+        self._pending_rows = 0
+        self._submitted = 0
+        self._written = 0
+        self._dropped = 0
+        self._commits = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+    
+    def start(self):
+        """Mở kết nối và bắt đầu luồng ghi (nếu chưa chạy)."""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return self
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='traffic-writer', daemon=True)
+            self._thread.start()
+        return self
+    
+    def submit(self, rows):
+        """Đưa một lô dòng (interface_id, timestamp, tx_bytes, ..., rx_rate_kbps) vào hàng đợi."""
+        rows = [
+            (row[0], row[1].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row[1], datetime) else row[1]) + tuple(row[2:])
+            for row in rows
+        ]
+        if not rows:
+            return
+        
+        with self._cond:
+            self._pending.append(rows)
+            self._pending_rows += len(rows)
+            self._submitted += len(rows)
+            # Quá tải: bỏ lô cũ nhất để không dùng hết bộ nhớ
+            while self._pending_rows > self.max_backlog and len(self._pending) > 1:
+                dropped = self._pending.popleft()
+                self._pending_rows -= len(dropped)
+                self._dropped += len(dropped)
+                logger.warning(f"Hàng đợi ghi traffic đầy, bỏ {len(dropped)} dòng cũ nhất")
+            if self._pending_rows >= self.commit_rows:
+                self._cond.notify_all()
+    
+    def flush(self, timeout=5.0):
+        """Chờ đến khi mọi dòng đã submit được xử lý (commit hoặc bị bỏ), trả về True nếu kịp.
+        
+        Dòng của lô ghi lỗi được tính vào dropped (xem stats()) nên không làm
+        flush() chờ hết timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._submitted
+            self._cond.notify_all()
+            while self._written + self._dropped < target and self._thread and self._thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return self._written + self._dropped >= target
+    
+    def close(self, timeout=5.0):
+        """Ghi nốt hàng đợi và dừng luồng ghi."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def stats(self):
+        """Thống kê hàng đợi và số dòng đã ghi."""
+        with self._cond:
+            return {
+                'pending_rows': self._pending_rows,
+                'submitted': self._submitted,
+                'written': self._written,
+                'dropped': self._dropped,
+                'commits': self._commits
+            }
+    
+    def _take(self):
+        """Lấy toàn bộ các lô đang chờ khi đủ số dòng, hết thời gian hoặc khi dừng."""
+        with self._cond:
+            deadline = time.monotonic() + self.commit_interval
+            while self._running and self._pending_rows < self.commit_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            rows = []
+            while self._pending:
+                rows.extend(self._pending.popleft())
+            self._pending_rows = 0
+            return rows
+    
+    def _run(self):
+        """Vòng lặp của luồng ghi, dùng một kết nối duy nhất."""
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        store = ColumnarTrafficStore(conn) if self.backend == 'columnar' else None
+        try:
+            while True:
+                running = self._running
+                rows = self._take()
+                if rows:
+                    try:
+                        with conn:
+                            if store is not None:
+                                store.write_rows(rows)
+                            else:
+                                conn.executemany(INSERT_TRAFFIC_SQL, rows)
+                    except Exception as e:
+                        if store is not None:
+                            store.discard_cache()
+                        logger.error(f"Lỗi khi lưu dữ liệu traffic: {e}")
+                        with self._cond:
+                            self._dropped += len(rows)
+                    else:
+                        with self._cond:
+                            self._written += len(rows)
+                            self._commits += 1
+                with self._cond:
+                    self._cond.notify_all()
+                    if not running and not self._pending:
+                        break
+        finally:
+            conn.close()
+
+
+# Cột tổng hợp dùng chung cho daily_stats và hourly_stats
+STATS_AGGREGATE_COLUMNS = [
+    ('samples', 'INTEGER'),
+    ('sum_tx_kbps', 'REAL'),
+    ('sum_rx_kbps', 'REAL'),
+    ('first_tx_bytes', 'BIGINT'),
+    ('last_tx_bytes', 'BIGINT'),
+    ('first_rx_bytes', 'BIGINT'),
+    ('last_rx_bytes', 'BIGINT'),
+    ('sum_tx_bytes', 'BIGINT'),
+    ('sum_rx_bytes', 'BIGINT')
+]
+
+
+def volume_delta(previous, current):
+    """Lưu lượng (byte) giữa hai mẫu liên tiếp của một interface.
+    
+    Dùng chung cho tổng hợp chạy và backfill: 0 ở mẫu đầu tiên hoặc khi
+    counter bị reset, tràn 32/64 bit được tính đúng (mikrotik_rates.counter_delta).
+    """
+    if previous is None or current is None:
+        return 0
+    return counter_delta(int(previous), int(current)) or 0
+
+
+def stats_upsert_sql(table, key_column):
+    """Câu UPSERT cộng dồn một phần tổng hợp vào daily_stats/hourly_stats.
+    
+    Bên phải của SET luôn đọc giá trị cũ của dòng, nên trung bình và tổng
+    lưu lượng được tính lại từ tổng tích lũy mới. Tổng lưu lượng là tổng các
+    mức tăng counter từng mẫu (sum_tx_bytes/sum_rx_bytes), không phải
+    last - first, nên không bị âm khi router khởi động lại hoặc counter tràn.
+    """
+    return f'''
+    INSERT INTO {table}
+    (interface_id, {key_column}, samples, sum_tx_kbps, sum_rx_kbps, max_tx_kbps, max_rx_kbps,
+     first_tx_bytes, last_tx_bytes, first_rx_bytes, last_rx_bytes, sum_tx_bytes, sum_rx_bytes,
+     avg_tx_kbps, avg_rx_kbps, total_tx_mb, total_rx_mb)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11, ?12, ?13,
+            ?4 / ?3, ?5 / ?3, ?12 / 1048576.0, ?13 / 1048576.0)
+    ON CONFLICT (interface_id, {key_column}) DO UPDATE SET
+        samples = COALESCE(samples, 0) + excluded.samples,
+        sum_tx_kbps = COALESCE(sum_tx_kbps, 0) + excluded.sum_tx_kbps,
+        sum_rx_kbps = COALESCE(sum_rx_kbps, 0) + excluded.sum_rx_kbps,
+        max_tx_kbps = MAX(COALESCE(max_tx_kbps, excluded.max_tx_kbps), excluded.max_tx_kbps),
+        max_rx_kbps = MAX(COALESCE(max_rx_kbps, excluded.max_rx_kbps), excluded.max_rx_kbps),
+        first_tx_bytes = COALESCE(first_tx_bytes, excluded.first_tx_bytes),
+        last_tx_bytes = excluded.last_tx_bytes,
+        first_rx_bytes = COALESCE(first_rx_bytes, excluded.first_rx_bytes),
+        last_rx_bytes = excluded.last_rx_bytes,
+        sum_tx_bytes = COALESCE(sum_tx_bytes, 0) + excluded.sum_tx_bytes,
+        sum_rx_bytes = COALESCE(sum_rx_bytes, 0) + excluded.sum_rx_bytes,
+        avg_tx_kbps = (COALESCE(sum_tx_kbps, 0) + excluded.sum_tx_kbps) / (COALESCE(samples, 0) + excluded.samples),
+        avg_rx_kbps = (COALESCE(sum_rx_kbps, 0) + excluded.sum_rx_kbps) / (COALESCE(samples, 0) + excluded.samples),
+        total_tx_mb = (COALESCE(sum_tx_bytes, 0) + excluded.sum_tx_bytes) / 1048576.0,
+        total_rx_mb = (COALESCE(sum_rx_bytes, 0) + excluded.sum_rx_bytes) / 1048576.0
+    '''
+
+
+def stats_backfill_sql(table, key_column, key_expr):
+    """Câu tính lại toàn bộ daily_stats/hourly_stats từ traffic_data (ghi đè).
+    
+    Mức tăng counter từng mẫu được tính bằng LAG trên chuỗi mẫu của mỗi
+    interface và hàm SQL volume_delta (đăng ký từ volume_delta), cùng quy tắc
+    với TrafficStatsAggregator nên hai cách cho cùng tổng lưu lượng.
+    """
+    return f'''
+    WITH samples AS (
+        SELECT interface_id, {key_expr} AS period, tx_rate_kbps, rx_rate_kbps, tx_bytes, rx_bytes,
+               volume_delta(LAG(tx_bytes) OVER series, tx_bytes) AS tx_delta,
+               volume_delta(LAG(rx_bytes) OVER series, rx_bytes) AS rx_delta,
+               FIRST_VALUE(tx_bytes) OVER period_series AS first_tx,
+               FIRST_VALUE(rx_bytes) OVER period_series AS first_rx,
+               ROW_NUMBER() OVER (PARTITION BY interface_id, {key_expr} ORDER BY timestamp DESC, id DESC) AS from_end
+        FROM traffic_data
+        WHERE timestamp IS NOT NULL
+        WINDOW series AS (PARTITION BY interface_id ORDER BY timestamp, id),
+               period_series AS (PARTITION BY interface_id, {key_expr} ORDER BY timestamp, id)
+    )
+    INSERT INTO {table}
+    (interface_id, {key_column}, samples, sum_tx_kbps, sum_rx_kbps, max_tx_kbps, max_rx_kbps,
+     first_tx_bytes, last_tx_bytes, first_rx_bytes, last_rx_bytes, sum_tx_bytes, sum_rx_bytes,
+     avg_tx_kbps, avg_rx_kbps, total_tx_mb, total_rx_mb)
+    SELECT interface_id, period, COUNT(*), SUM(tx_rate_kbps), SUM(rx_rate_kbps),
+           MAX(tx_rate_kbps), MAX(rx_rate_kbps),
+           MAX(first_tx), MAX(CASE WHEN from_end = 1 THEN tx_bytes END),
+           MAX(first_rx), MAX(CASE WHEN from_end = 1 THEN rx_bytes END),
+           SUM(tx_delta), SUM(rx_delta),
+           AVG(tx_rate_kbps), AVG(rx_rate_kbps),
+           SUM(tx_delta) / 1048576.0,
+           SUM(rx_delta) / 1048576.0
+    FROM samples
+    WHERE 1
+    GROUP BY interface_id, period
+    ON CONFLICT (interface_id, {key_column}) DO UPDATE SET
+        samples = excluded.samples,
+        sum_tx_kbps = excluded.sum_tx_kbps,
+        sum_rx_kbps = excluded.sum_rx_kbps,
+        max_tx_kbps = excluded.max_tx_kbps,
+        max_rx_kbps = excluded.max_rx_kbps,
+        first_tx_bytes = excluded.first_tx_bytes,
+        last_tx_bytes = excluded.last_tx_bytes,
+        first_rx_bytes = excluded.first_rx_bytes,
+        last_rx_bytes = excluded.last_rx_bytes,
+        sum_tx_bytes = excluded.sum_tx_bytes,
+        sum_rx_bytes = excluded.sum_rx_bytes,
+        avg_tx_kbps = excluded.avg_tx_kbps,
+        avg_rx_kbps = excluded.avg_rx_kbps,
+        total_tx_mb = excluded.total_tx_mb,
+        total_rx_mb = excluded.total_rx_mb
+    '''
+
+
+class TrafficStatsAggregator:
+    """Tổng hợp chạy (running aggregate) theo ngày và theo giờ cho mỗi interface.
+    
+    Mỗi mẫu được cộng vào bộ nhớ khi đến; flush() upsert phần tích lũy vào
+    daily_stats và hourly_stats rồi xóa, nên không phải quét lại traffic_data.
+    Lưu lượng giữa hai mẫu liên tiếp (volume_delta) được tính vào kỳ của mẫu sau.
+    """
+    
+    # (bảng, cột khóa, độ dài tiền tố timestamp, hậu tố)
+    PERIODS = [
+        ('daily_stats', 'date', 10, ''),
+        ('hourly_stats', 'hour', 13, ':00:00')
+    ]
+    
+    def __init__(self):
+        """Khởi tạo bộ tổng hợp rỗng."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_counters = {}  # interface_id -> (tx_bytes, rx_bytes) của mẫu gần nhất
+    
+    def seed(self, interface_id, tx_bytes, rx_bytes):
+        """Đặt counter của mẫu trước đó (mẫu cuối đã lưu) cho một interface."""
+        with self._lock:
+            self._last_counters.setdefault(interface_id, (tx_bytes, rx_bytes))
+    
+    def add(self, rows):
+        """Cộng các mẫu (interface_id, timestamp, tx_bytes, rx_bytes, ..., tx_rate_kbps, rx_rate_kbps)."""
+        with self._lock:
+            for interface_id, timestamp, tx_bytes, rx_bytes, _, _, tx_kbps, rx_kbps in rows:
+                previous_tx, previous_rx = self._last_counters.get(interface_id, (None, None))
+                self._last_counters[interface_id] = (tx_bytes, rx_bytes)
+                tx_delta = volume_delta(previous_tx, tx_bytes)
+                rx_delta = volume_delta(previous_rx, rx_bytes)
+                for table, _, length, suffix in self.PERIODS:
+                    key = (table, interface_id, timestamp[:length] + suffix)
+                    agg = self._pending.get(key)
+                    if agg is None:
+                        self._pending[key] = [1, tx_kbps, rx_kbps, tx_kbps, rx_kbps,
+                                              tx_bytes, tx_bytes, rx_bytes, rx_bytes, tx_delta, rx_delta]
+                        continue
+                    agg[0] += 1
+                    agg[1] += tx_kbps
+                    agg[2] += rx_kbps
+                    agg[3] = max(agg[3], tx_kbps)
+                    agg[4] = max(agg[4], rx_kbps)
+                    agg[6] = tx_bytes
+                    agg[8] = rx_bytes
+                    agg[9] += tx_delta
+                    agg[10] += rx_delta
+    
+    def take(self, interface_id=None):
+        """Lấy và xóa phần tích lũy (của một interface hoặc tất cả)."""
+        with self._lock:
+            keys = [key for key in self._pending if interface_id is None or key[1] == interface_id]
+            return {key: self._pending.pop(key) for key in keys}
+    
+    def restore(self, pending):
+        """Trả lại phần tích lũy chưa ghi được (gộp với dữ liệu mới đến sau)."""
+        with self._lock:
+            for key, agg in pending.items():
+                newer = self._pending.get(key)
+                if newer is not None:
+                    agg = [agg[0] + newer[0], agg[1] + newer[1], agg[2] + newer[2],
+                           max(agg[3], newer[3]), max(agg[4], newer[4]),
+                           agg[5], newer[6], agg[7], newer[8],
+                           agg[9] + newer[9], agg[10] + newer[10]]
+                self._pending[key] = agg
+    
+    def flush(self, db_file, interface_id=None):
+        """Upsert phần tích lũy vào cơ sở dữ liệu, trả về số dòng thống kê đã cập nhật."""
+        pending = self.take(interface_id)
+        if not pending:
+            return 0
+        
+        try:
+            conn = sqlite3.connect(db_file)
+            with conn:
+                self.write(conn, pending)
+            conn.close()
+            return len(pending)
+        except Exception:
+            self.restore(pending)
+            raise
+    
+    def write(self, conn, pending):
+        """Upsert phần tích lũy đã lấy bằng take() qua kết nối có sẵn (không commit)."""
+        for table, key_column, _, _ in self.PERIODS:
+            params = [
+                (key[1], key[2], *agg)
+                for key, agg in pending.items() if key[0] == table
+            ]
+            if params:
+                conn.executemany(stats_upsert_sql(table, key_column), params)
+
 
 class MikroTikTrafficLogger:
     """Lớp thu thập và lưu trữ dữ liệu traffic từ MikroTik."""
     
-    def __init__(self, host, username, password, db_file='mikrotik_traffic.db'):
-        """Khởi tạo với thông tin kết nối và database."""
+    def __init__(self, host, username, password, db_file='mikrotik_traffic.db',
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, commit_rows=DEFAULT_COMMIT_ROWS,
+                 storage_backend='sqlite'):
+        """Khởi tạo với thông tin kết nối và database.
+        
+        storage_backend: 'sqlite' (bảng traffic_data) hoặc 'columnar' (khối nén
+        trong traffic_chunks, xem mikrotik_columnar).
+        """
         self.host = host
         self.username = username
         self.password = password
         self.connection = None
         self.api = None
         self.db_file = db_file
+        self.storage_backend = storage_backend
         self.running = False
         self.interfaces_data = {}  # Dữ liệu về mỗi interface
+        self.writer = TrafficDataWriter(db_file, commit_interval=commit_interval, commit_rows=commit_rows,
+                                        backend=storage_backend)
+        self.stats = TrafficStatsAggregator()
+        self.rates = RateEngine()  # Tốc độ theo thời gian monotonic đo thực tế
         
         # Tạo cơ sở dữ liệu nếu chưa tồn tại
         self.init_database()
+        self._seed_stats_counters()
     
     def init_database(self):
         """Khởi tạo cơ sở dữ liệu SQLite."""
@@ -56,6 +444,9 @@ class MikroTikTrafficLogger:
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
             
+            # WAL cho phép đọc báo cáo trong khi luồng ghi đang commit
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
             # Tạo bảng lưu trữ thông tin thiết bị
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS devices (
@@ -112,6 +503,60 @@ class MikroTikTrafficLogger:
             )
             ''')
             
+            # Tạo bảng lưu trữ thống kê theo giờ (cùng cấu trúc với daily_stats)
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hourly_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                interface_id INTEGER,
+                hour TIMESTAMP,
+                avg_tx_kbps REAL,
+                avg_rx_kbps REAL,
+                max_tx_kbps REAL,
+                max_rx_kbps REAL,
+                total_tx_mb REAL,
+                total_rx_mb REAL,
+                FOREIGN KEY (interface_id) REFERENCES interfaces (id)
+            )
+            ''')
+            
+            # Thêm các cột tổng hợp chạy cho database cũ
+            for table, key_column in (('daily_stats', 'date'), ('hourly_stats', 'hour')):
+                existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+                for column, column_type in STATS_AGGREGATE_COLUMNS:
+                    if column not in existing:
+                        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                
+                # Dòng cũ: lấy tổng lưu lượng đã lưu làm điểm bắt đầu cho tổng chạy
+                if 'sum_tx_bytes' not in existing:
+                    cursor.execute(f'''
+                    UPDATE {table} SET
+                        sum_tx_bytes = CAST(MAX(COALESCE(total_tx_mb, 0), 0) * 1048576 AS INTEGER),
+                        sum_rx_bytes = CAST(MAX(COALESCE(total_rx_mb, 0), 0) * 1048576 AS INTEGER)
+                    ''')
+                
+                # Mỗi interface chỉ có một dòng thống kê cho mỗi ngày/giờ: xóa dòng
+                # trùng của database cũ một lần, trước khi tạo unique index
+                index_name = f'idx_{table}_interface_{key_column}'
+                has_index = cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)
+                ).fetchone()
+                if not has_index:
+                    cursor.execute(f'''
+                    DELETE FROM {table} WHERE id NOT IN (
+                        SELECT MAX(id) FROM {table} GROUP BY interface_id, {key_column}
+                    )
+                    ''')
+                    cursor.execute(f'''
+                    CREATE UNIQUE INDEX {index_name}
+                    ON {table} (interface_id, {key_column})
+                    ''')
+            
+            # Index cho truy vấn theo interface và khoảng thời gian
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_traffic_data_interface_time
+            ON traffic_data (interface_id, timestamp)
+            ''')
+            
             conn.commit()
             conn.close()
             logger.info(f"Đã khởi tạo cơ sở dữ liệu {self.db_file}")
@@ -120,6 +565,23 @@ class MikroTikTrafficLogger:
             logger.error(f"Lỗi khi khởi tạo cơ sở dữ liệu: {e}")
             sys.exit(1)
     
+    def _seed_stats_counters(self):
+        """Nạp counter của mẫu cuối đã lưu cho từng interface vào bộ tổng hợp.
+        
+        Nhờ vậy lưu lượng giữa lần chạy trước và mẫu đầu tiên của lần chạy này
+        được tính giống như khi backfill từ traffic_data.
+        """
+        try:
+            conn = sqlite3.connect(self.db_file)
+            source = open_traffic_source(conn, self.storage_backend)
+            for interface_id in source.interface_ids():
+                samples = source.read(interface_id, last=1)
+                if len(samples):
+                    self.stats.seed(interface_id, int(samples['tx_bytes'][0]), int(samples['rx_bytes'][0]))
+            conn.close()
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc counter cuối cùng đã lưu: {e}")
+    
     def connect(self):
         """Kết nối đến thiết bị MikroTik và trả về API object."""
         try:
@@ -324,8 +786,135 @@ class MikroTikTrafficLogger:
             logger.error(f"Lỗi khi lấy dữ liệu traffic cho {interface_name}: {e}")
             return None
     
+    def get_interface_ids(self):
+        """Lấy ID của mọi interface của thiết bị trong một truy vấn."""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT i.name, i.id FROM interfaces i
+            JOIN devices d ON i.device_id = d.id
+            WHERE d.ip_address = ?
+            ''', (self.host,))
+            
+            result = dict(cursor.fetchall())
+            conn.close()
+            return result
+            
+        except Exception as e:
+            logger.error(f"Lỗi khi lấy ID interface: {e}")
+            return {}
+    
+    def get_all_interface_traffic(self):
+        """Đọc counter của mọi interface bằng một lệnh /interface/print.
+        
+        Chỉ yêu cầu các trường trong TRAFFIC_PROPLIST để giảm dữ liệu trả về.
+        Trả về dict tên interface -> counter, hoặc None nếu lỗi.
+        """
+        if not self.api:
+            return None
+        
+        try:
+            interfaces = self.api.get_resource('/interface')
+            rows = interfaces.call('print', {'.proplist': TRAFFIC_PROPLIST})
+            
+            result = {}
+            for row in rows:
+                name = row.get('name')
+                if not name:
+                    continue
+                result[name] = {
+                    'tx_bytes': int(row.get('tx-byte', '0')),
+                    'rx_bytes': int(row.get('rx-byte', '0')),
+                    'tx_packets': int(row.get('tx-packet', '0')),
+                    'rx_packets': int(row.get('rx-packet', '0'))
+                }
+            return result
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc counter các interface: {e}")
+            return None
+    
+    def collect_traffic(self, interface_names, interval=5):
+        """Thread function thu thập traffic của nhiều interface bằng một lệnh mỗi chu kỳ.
+        
+        Mỗi chu kỳ đọc counter của tất cả interface một lần, tính tốc độ cho
+        từng interface trong một lượt và ghi cả lô vào cơ sở dữ liệu.
+        """
+        logger.info(f"Bắt đầu thu thập traffic cho {len(interface_names)} interface (một lệnh mỗi chu kỳ)")
+        
+        # Lấy interface_id của tất cả interface một lần
+        interface_ids = self.get_interface_ids()
+        missing = [name for name in interface_names if name not in interface_ids]
+        for name in missing:
+            logger.warning(f"Không tìm thấy interface {name} trong database, bỏ qua")
+        names = [name for name in interface_names if name in interface_ids]
+        
+        initial_data = self.get_all_interface_traffic()
+        if initial_data is None:
+            logger.error("Không thể đọc dữ liệu traffic của các interface")
+            return False
+        self.rates.update_many({
+            name: (data['tx_bytes'], data['rx_bytes']) for name, data in initial_data.items()
+        })
+        
+        last_save_time = datetime.now()
+        next_poll = time.monotonic() + interval
+        
+        while self.running:
+            # Ngủ đến lần cập nhật tiếp theo
+            time.sleep(max(0, next_poll - time.monotonic()))
+            next_poll += interval
+            if not self.running:
+                break
+            
+            current_time = datetime.now()
+            current_data = self.get_all_interface_traffic()
+            if current_data is None:
+                continue
+            
+            # Tốc độ của mọi interface trong một lượt (bỏ mẫu khi counter bị reset)
+            rates = self.rates.update_many({
+                name: (current_data[name]['tx_bytes'], current_data[name]['rx_bytes'])
+                for name in names if name in current_data
+            })
+            batch = []
+            for name, rate in rates.items():
+                if rate is None:
+                    continue
+                current = current_data[name]
+                tx_kbps, rx_kbps = to_kbps(rate[0]), to_kbps(rate[1])
+                
+                batch.append((
+                    interface_ids[name],
+                    current_time,
+                    current['tx_bytes'],
+                    current['rx_bytes'],
+                    current['tx_packets'],
+                    current['rx_packets'],
+                    tx_kbps,
+                    rx_kbps
+                ))
+                logger.debug(f"{name}: TX: {tx_kbps:.2f} KB/s, RX: {rx_kbps:.2f} KB/s")
+            
+            # Ghi cả lô trong một transaction
+            if batch:
+                self.store_traffic_batch(batch)
+            
+            # Cập nhật thống kê hàng ngày mỗi 15 phút
+            if (current_time - last_save_time).total_seconds() >= 900:  # 15 phút
+                self.update_daily_stats()
+                last_save_time = current_time
+        
+        logger.info("Đã dừng thu thập traffic")
+        return True
+    
     def monitor_interface(self, interface_name, interval=5):
-        """Thread function để giám sát và ghi log một interface cụ thể."""
+        """Thread function để giám sát và ghi log một interface cụ thể.
+        
+        Chỉ dùng làm phương án dự phòng khi không thể đọc toàn bộ interface
+        trong một lệnh (xem collect_traffic).
+        """
         logger.info(f"Bắt đầu ghi log traffic cho interface {interface_name}")
         
         # Lấy interface_id
@@ -339,6 +928,7 @@ class MikroTikTrafficLogger:
         if not previous_data:
             logger.error(f"Không thể đọc dữ liệu traffic cho {interface_name}")
             return
+        self.rates.update(interface_name, (previous_data['tx_bytes'], previous_data['rx_bytes']))
         
         last_save_time = datetime.now()
         
@@ -348,24 +938,15 @@ class MikroTikTrafficLogger:
             # Lấy dữ liệu traffic hiện tại
             current_data = self.get_interface_traffic(interface_name)
             
-            if current_data and previous_data:
-                # Tính toán tốc độ dựa trên sự khác biệt
-                tx_bytes = current_data['tx_bytes'] - previous_data['tx_bytes']
-                rx_bytes = current_data['rx_bytes'] - previous_data['rx_bytes']
-                tx_packets = current_data['tx_packets'] - previous_data['tx_packets']
-                rx_packets = current_data['rx_packets'] - previous_data['rx_packets']
-                
-                # Bytes/giây
-                tx_bytes_per_second = tx_bytes / interval
-                rx_bytes_per_second = rx_bytes / interval
-                
-                # Bits/giây (1 byte = 8 bits)
-                tx_bits_per_second = tx_bytes_per_second * 8
-                rx_bits_per_second = rx_bytes_per_second * 8
-                
+            # Tốc độ theo thời gian đo thực tế; None ở lần đọc sau khi counter bị reset
+            rates = None
+            if current_data:
+                rates = self.rates.update(interface_name, (current_data['tx_bytes'], current_data['rx_bytes']))
+            
+            if rates:
                 # Chuyển đổi sang KB/s
-                tx_kbps = tx_bits_per_second / 1024
-                rx_kbps = rx_bits_per_second / 1024
+                tx_kbps = to_kbps(rates[0])
+                rx_kbps = to_kbps(rates[1])
                 
                 # Lưu vào cơ sở dữ liệu
                 self.store_traffic_data(
@@ -387,112 +968,127 @@ class MikroTikTrafficLogger:
                     self.update_daily_stats(interface_id, current_time.date())
                     last_save_time = current_time
             
-            # Lưu giá trị hiện tại cho lần sau
-            previous_data = current_data
-            
             # Ngủ đến lần cập nhật tiếp theo
             time.sleep(interval)
         
         logger.info(f"Đã dừng ghi log traffic cho interface {interface_name}")
     
     def store_traffic_data(self, interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps):
-        """Lưu dữ liệu traffic vào cơ sở dữ liệu."""
+        """Lưu một mẫu traffic (qua TrafficDataWriter)."""
+        self.store_traffic_batch([(
+            interface_id, timestamp, tx_bytes, rx_bytes,
+            tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+        )])
+    
+    def store_traffic_batch(self, rows):
+        """Lưu một lô mẫu traffic (cùng định dạng tham số với store_traffic_data).
+        
+        Các dòng được cộng vào thống kê ngày/giờ trong bộ nhớ và đưa vào hàng
+        đợi của TrafficDataWriter để ghi theo lô trong một transaction.
+        """
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            INSERT INTO traffic_data 
-            (interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                interface_id, 
-                timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                tx_bytes,
-                rx_bytes,
-                tx_packets,
-                rx_packets,
-                tx_rate_kbps,
-                rx_rate_kbps
-            ))
-            
-            conn.commit()
-            conn.close()
-            
+            rows = [
+                (row[0], row[1].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row[1], datetime) else row[1]) + tuple(row[2:])
+                for row in rows
+            ]
+            self.stats.add(rows)
+            self.writer.start()
+            self.writer.submit(rows)
         except Exception as e:
             logger.error(f"Lỗi khi lưu dữ liệu traffic: {e}")
     
-    def update_daily_stats(self, interface_id, date):
-        """Cập nhật thống kê hàng ngày."""
+    def update_daily_stats(self, interface_id=None, date=None):
+        """Ghi thống kê ngày và giờ đã tích lũy trong bộ nhớ vào database.
+        
+        Không quét lại traffic_data: chỉ upsert phần tổng hợp chạy của các mẫu
+        mới từ lần cập nhật trước (của một interface, hoặc tất cả nếu None).
+        Tham số date được giữ để tương thích và không còn được dùng.
+        """
         try:
-            # Chuyển đổi ngày thành string format
-            date_str = date.strftime('%Y-%m-%d')
+            updated = self.stats.flush(self.db_file, interface_id)
+            if updated:
+                target = f"interface {interface_id}" if interface_id is not None else "các interface"
+                logger.info(f"Đã cập nhật {updated} dòng thống kê ngày/giờ cho {target}")
             
+        except Exception as e:
+            logger.error(f"Lỗi khi cập nhật thống kê hàng ngày: {e}")
+    
+    def backfill_stats(self):
+        """Tính lại daily_stats và hourly_stats từ toàn bộ traffic_data.
+        
+        Dùng một lần cho database đã có dữ liệu trước khi có thống kê
+        tích lũy; các dòng thống kê hiện có bị ghi đè.
+        """
+        try:
             conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            # Lấy dữ liệu traffic trong ngày
-            cursor.execute('''
-            SELECT 
-                AVG(tx_rate_kbps), 
-                AVG(rx_rate_kbps),
-                MAX(tx_rate_kbps),
-                MAX(rx_rate_kbps),
-                (MAX(tx_bytes) - MIN(tx_bytes)) / 1048576.0, -- Đổi thành MB
-                (MAX(rx_bytes) - MIN(rx_bytes)) / 1048576.0  -- Đổi thành MB
-            FROM traffic_data
-            WHERE interface_id = ? AND date(timestamp) = ?
-            ''', (interface_id, date_str))
-            
-            result = cursor.fetchone()
+            conn.create_function('volume_delta', 2, volume_delta, deterministic=True)
+            if self.storage_backend == 'columnar':
+                self._backfill_stats_columnar(conn)
+            else:
+                with conn:
+                    conn.execute(stats_backfill_sql('daily_stats', 'date', 'substr(timestamp, 1, 10)'))
+                    conn.execute(stats_backfill_sql('hourly_stats', 'hour', "substr(timestamp, 1, 13) || ':00:00'"))
+            days = conn.execute('SELECT COUNT(*) FROM daily_stats').fetchone()[0]
+            hours = conn.execute('SELECT COUNT(*) FROM hourly_stats').fetchone()[0]
+            conn.close()
+            logger.info(f"Đã tính lại {days} dòng thống kê ngày và {hours} dòng thống kê giờ")
+            return True
             
-            if result and result[0] is not None:
-                avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb = result
-                
-                # Kiểm tra xem đã có thống kê cho ngày này chưa
-                cursor.execute('''
-                SELECT id FROM daily_stats
-                WHERE interface_id = ? AND date = ?
-                ''', (interface_id, date_str))
-                
-                existing_stat = cursor.fetchone()
-                
-                if existing_stat:
-                    # Cập nhật thống kê hiện có
-                    cursor.execute('''
-                    UPDATE daily_stats
-                    SET avg_tx_kbps = ?, avg_rx_kbps = ?, 
-                        max_tx_kbps = ?, max_rx_kbps = ?,
-                        total_tx_mb = ?, total_rx_mb = ?
-                    WHERE interface_id = ? AND date = ?
-                    ''', (
-                        avg_tx_kbps, avg_rx_kbps, 
-                        max_tx_kbps, max_rx_kbps,
-                        total_tx_mb, total_rx_mb,
-                        interface_id, date_str
-                    ))
-                else:
-                    # Thêm thống kê mới
-                    cursor.execute('''
-                    INSERT INTO daily_stats
-                    (interface_id, date, avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        interface_id, date_str, 
-                        avg_tx_kbps, avg_rx_kbps, 
-                        max_tx_kbps, max_rx_kbps,
-                        total_tx_mb, total_rx_mb
+        except Exception as e:
+            logger.error(f"Lỗi khi tính lại thống kê: {e}")
+            return False
+    
+    def _backfill_stats_columnar(self, conn, window=BACKFILL_WINDOW):
+        """Tính lại thống kê từ các khối traffic_chunks, từng interface một.
+        
+        Lịch sử được đọc theo từng khoảng `window` giây nên bộ nhớ không phụ
+        thuộc độ dài lịch sử; xóa và ghi lại thống kê của một interface nằm
+        trong cùng một transaction trên `conn`.
+        """
+        source = ColumnarTrafficStore(conn)
+        for interface_id in source.interface_ids():
+            first, last = source.time_range(interface_id)
+            if first is None:
+                continue
+            
+            aggregator = TrafficStatsAggregator()
+            with conn:
+                conn.execute('DELETE FROM daily_stats WHERE interface_id = ?', (interface_id,))
+                conn.execute('DELETE FROM hourly_stats WHERE interface_id = ?', (interface_id,))
+                for window_start in range(first, last + 1, window):
+                    samples = source.read(interface_id, window_start, window_start + window - 1)
+                    if not len(samples):
+                        continue
+                    timestamps = np.datetime_as_string(samples['timestamp'].astype('datetime64[s]'))
+                    aggregator.add(zip(
+                        [interface_id] * len(samples),
+                        np.char.replace(timestamps, 'T', ' ').tolist(),
+                        samples['tx_bytes'].tolist(), samples['rx_bytes'].tolist(),
+                        samples['tx_packets'].tolist(), samples['rx_packets'].tolist(),
+                        samples['tx_rate'].tolist(), samples['rx_rate'].tolist()
                     ))
-            
-            conn.commit()
+                    aggregator.write(conn, aggregator.take())
+    
+    def import_columnar(self):
+        """Chép dữ liệu traffic_data hiện có sang định dạng cột (traffic_chunks)."""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            imported = ColumnarTrafficStore(conn).import_from_sqlite()
             conn.close()
-            logger.info(f"Đã cập nhật thống kê ngày {date_str} cho interface {interface_id}")
+            logger.info(f"Đã chuyển {imported} mẫu traffic sang định dạng cột")
+            return True
             
         except Exception as e:
-            logger.error(f"Lỗi khi cập nhật thống kê hàng ngày: {e}")
+            logger.error(f"Lỗi khi chuyển dữ liệu sang định dạng cột: {e}")
+            return False
     
-    def start_logging(self, interface_names=None, interval=5, duration=None):
-        """Bắt đầu ghi log nhiều interface."""
+    def start_logging(self, interface_names=None, interval=5, duration=None, per_interface_threads=False):
+        """Bắt đầu ghi log nhiều interface.
+        
+        Mặc định dùng một luồng thu thập đọc mọi interface bằng một lệnh mỗi
+        chu kỳ. per_interface_threads=True (hoặc khi không đọc được counter
+        theo lô) sẽ quay về cách cũ: mỗi interface một luồng.
+        """
         if not self.api:
             logger.error("Không có kết nối API. Vui lòng kết nối trước.")
             return
@@ -517,13 +1113,28 @@ class MikroTikTrafficLogger:
         # Bắt đầu giám sát
         self.running = True
         
-        # Tạo thread cho mỗi interface
+        # Kiểm tra có đọc được counter của tất cả interface bằng một lệnh không
+        if not per_interface_threads and self.get_all_interface_traffic() is None:
+            logger.warning("Không đọc được counter theo lô, chuyển sang mỗi interface một luồng")
+            per_interface_threads = True
+        
         threads = []
-        for interface_name in interface_names:
+        if per_interface_threads:
+            # Tạo thread cho mỗi interface
+            for interface_name in interface_names:
+                thread = threading.Thread(
+                    target=self.monitor_interface,
+                    args=(interface_name, interval),
+                    daemon=True  # Thread sẽ tự động kết thúc khi chương trình chính kết thúc
+                )
+                thread.start()
+                threads.append(thread)
+        else:
+            # Một thread thu thập cho tất cả interface
             thread = threading.Thread(
-                target=self.monitor_interface,
-                args=(interface_name, interval),
-                daemon=True  # Thread sẽ tự động kết thúc khi chương trình chính kết thúc
+                target=self.collect_traffic,
+                args=(list(interface_names), interval),
+                daemon=True
             )
             thread.start()
             threads.append(thread)
@@ -553,6 +1164,10 @@ class MikroTikTrafficLogger:
             for thread in threads:
                 thread.join(timeout=1)
             
+            # Ghi nốt các mẫu còn trong hàng đợi và thống kê đã tích lũy
+            self.writer.close()
+            self.update_daily_stats()
+            
             print("\n=== THỐNG KÊ GHI LOG ===")
             self.print_logging_stats()
     
@@ -560,32 +1175,30 @@ class MikroTikTrafficLogger:
         """In thông tin thống kê về dữ liệu đã ghi log."""
         try:
             conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            # Lấy số lượng mẫu đã ghi
-            cursor.execute("SELECT COUNT(*) FROM traffic_data")
-            total_samples = cursor.fetchone()[0]
+            source = open_traffic_source(conn, self.storage_backend)
             
-            # Lấy thời gian mẫu đầu tiên và mẫu cuối cùng
-            cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data")
-            min_time, max_time = cursor.fetchone()
+            # Lấy số lượng mẫu và thời gian mẫu đầu tiên, cuối cùng
+            total_samples = source.count()
+            min_time, max_time = source.time_range()
             
             # Lấy thống kê theo interface
-            cursor.execute('''
-            SELECT i.name, COUNT(*), AVG(t.tx_rate_kbps), AVG(t.rx_rate_kbps)
-            FROM traffic_data t
-            JOIN interfaces i ON t.interface_id = i.id
-            GROUP BY t.interface_id
-            ''')
-            interface_stats = cursor.fetchall()
+            names = dict(conn.execute('SELECT id, name FROM interfaces').fetchall())
+            interface_stats = []
+            for interface_id in source.interface_ids():
+                samples = source.read(interface_id)
+                if len(samples):
+                    interface_stats.append((
+                        names.get(interface_id, interface_id), len(samples),
+                        samples['tx_rate'].mean(), samples['rx_rate'].mean()
+                    ))
             
             conn.close()
             
             # In thống kê
-            print(f"Tổng số mẫu đã ghi: {total_samples}")
-            if min_time and max_time:
-                print(f"Thời gian bắt đầu: {min_time}")
-                print(f"Thời gian kết thúc: {max_time}")
+            print(f"Tổng số mẫu đã ghi: {total_samples} ({source.name})")
+            if min_time is not None and max_time is not None:
+                print(f"Thời gian bắt đầu: {np.datetime64(min_time, 's').astype(datetime)}")
+                print(f"Thời gian kết thúc: {np.datetime64(max_time, 's').astype(datetime)}")
             
             print("\nThống kê theo interface:")
             for name, count, avg_tx, avg_rx in interface_stats:
@@ -763,6 +1376,12 @@ def main():
     parser.add_argument('--db', type=str, default='mikrotik_traffic.db', help='Tên file database (mặc định: mikrotik_traffic.db)')
     parser.add_argument('--json', action='store_true', help='Xuất báo cáo dạng JSON thay vì text')
     parser.add_argument('--duration', type=int, help='Thời gian ghi log (giây), nếu không cung cấp thì ghi đến khi bị dừng')
+    parser.add_argument('--commit-interval', type=float, default=DEFAULT_COMMIT_INTERVAL, help=f'Số giây tối đa giữa hai lần commit dữ liệu traffic (mặc định: {DEFAULT_COMMIT_INTERVAL})')
+    parser.add_argument('--commit-rows', type=int, default=DEFAULT_COMMIT_ROWS, help=f'Commit khi hàng đợi đủ số dòng này (mặc định: {DEFAULT_COMMIT_ROWS})')
+    parser.add_argument('--backfill-stats', action='store_true', help='Tính lại thống kê ngày/giờ từ toàn bộ dữ liệu traffic đã lưu')
+    parser.add_argument('--storage', choices=['sqlite', 'columnar'], default='sqlite', help='Backend lưu dữ liệu traffic: bảng traffic_data hoặc khối nén dạng cột (mặc định: sqlite)')
+    parser.add_argument('--columnar-import', action='store_true', help='Chép dữ liệu traffic_data hiện có sang định dạng cột')
+    parser.add_argument('--per-interface-threads', action='store_true', help='Dùng một luồng cho mỗi interface thay vì một lệnh đọc tất cả interface')
     args = parser.parse_args()
     
     # Lấy thông tin kết nối từ biến môi trường
@@ -776,7 +1395,25 @@ def main():
         sys.exit(1)
     
     # Tạo đối tượng logger
-    traffic_logger = MikroTikTrafficLogger(host, username, password, db_file=args.db)
+    traffic_logger = MikroTikTrafficLogger(host, username, password, db_file=args.db,
+                                           commit_interval=args.commit_interval, commit_rows=args.commit_rows,
+                                           storage_backend=args.storage)
+    
+    # Chuyển dữ liệu sang định dạng cột không cần kết nối
+    if args.columnar_import:
+        print(f"=== CHUYỂN DỮ LIỆU {args.db} SANG ĐỊNH DẠNG CỘT ===")
+        if not traffic_logger.import_columnar():
+            sys.exit(1)
+        if not args.log and not args.report and not args.backfill_stats:
+            return
+    
+    # Tính lại thống kê cho database cũ không cần kết nối
+    if args.backfill_stats:
+        print(f"=== TÍNH LẠI THỐNG KÊ TỪ {args.db} ===")
+        if not traffic_logger.backfill_stats():
+            sys.exit(1)
+        if not args.log and not args.report:
+            return
     
     # Nếu chỉ tạo báo cáo thì không cần kết nối
     if args.report and not args.log:
@@ -792,7 +1429,8 @@ def main():
     try:
         if args.log:
             # Bắt đầu ghi log
-            traffic_logger.start_logging(interval=args.interval, duration=args.duration)
+            traffic_logger.start_logging(interval=args.interval, duration=args.duration,
+                                         per_interface_threads=args.per_interface_threads)
         
         if args.report:
             # Tạo báo cáo
@@ -0,0 +1,369 @@
+"""
+Phát dữ liệu giám sát cho nhiều kết nối WebSocket từ một nguồn duy nhất
+
+- Một task duy nhất lấy snapshot mỗi `interval` giây và serialize một lần,
+  không phụ thuộc số trình duyệt đang xem
+- Mỗi client có hàng đợi giới hạn và task gửi riêng, nên các client được
+  gửi song song và client chậm không làm chậm client khác
+- Khi hàng đợi của client đầy, frame cũ nhất bị bỏ (client chỉ cần dữ liệu
+  mới nhất) và được đếm vào chỉ số dropped
+
+Giao thức trên /ws:
+
+- Mặc định (client cũ): mỗi chu kỳ một snapshot JSON đầy đủ như get_current_data()
+- `?protocol=delta`: client nhận frame {"type": "update"} gồm "full" (toàn bộ
+  lịch sử) cho interface mới đăng ký, sau đó chỉ "append" các điểm mới; mỗi
+  điểm là [timestamp, tx_kbps, rx_kbps]. "device" chỉ gửi khi thay đổi,
+  "removed" liệt kê interface không còn dữ liệu. Frame có "full" kèm "depth"
+  (history_depth của snapshot: số điểm lịch sử tối đa client nên giữ cho mỗi
+  interface). Chu kỳ không có điểm mới thì không gửi gì. Client chậm bị bỏ frame sẽ nhận lại "full" ở chu kỳ sau.
+- `&interfaces=ether1,ether2` hoặc tin nhắn {"subscribe": ["ether1"]}
+  (null = tất cả) giới hạn các interface được gửi
+- `&format=binary`: frame nhị phân b'MTW1' | u32 độ dài header | header JSON
+  (device, removed, depth, full/append = [[tên, số điểm], ...]) | đệm đến bội số 8 |
+  với mỗi interface theo thứ tự full rồi append: n float64 timestamp,
+  n float32 tx_kbps, n float32 rx_kbps (little-endian)
+"""
+
+import json
+import time
+import struct
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("mikrotik_ws_broadcast")
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 2
+
+BINARY_MAGIC = b'MTW1'
+
+
+def _point_row(point: Dict[str, Any]) -> List[float]:
+    return [round(point['timestamp'], 3), round(point['tx_kbps'], 3), round(point['rx_kbps'], 3)]
+
+
+def encode_points_json(points: List[Dict[str, Any]]) -> str:
+    """Danh sách điểm dạng [[timestamp, tx_kbps, rx_kbps], ...] không khoảng trắng"""
+    return json.dumps([_point_row(point) for point in points], separators=(',', ':'))
+
+
+def encode_points_binary(points: List[Dict[str, Any]]) -> bytes:
+    """n float64 timestamp, n float32 tx_kbps, n float32 rx_kbps (little-endian)"""
+    n = len(points)
+    return struct.pack(f'<{n}d{2 * n}f',
+                       *(point['timestamp'] for point in points),
+                       *(point['tx_kbps'] for point in points),
+                       *(point['rx_kbps'] for point in points))
+
+
+class _Tick:
+    """Một chu kỳ: snapshot và các mảnh frame đã encode (mỗi interface một lần)"""
+
+    def __init__(self, data: Dict[str, Any], last_timestamps: Dict[str, float], legacy: Optional[str]):
+        self.legacy = legacy
+        self.device = data.get('device')
+        self.device_json = json.dumps(self.device, separators=(',', ':'))
+        self.device_changed = False
+        self.depth = data.get('history_depth')
+        self.history = {name: interface.get('history') or []
+                        for name, interface in (data.get('interfaces') or {}).items()}
+
+        # Điểm mới của từng interface so với chu kỳ trước (cập nhật last_timestamps)
+        self.append = {}
+        for name, history in self.history.items():
+            last = last_timestamps.get(name)
+            points = history if last is None else [point for point in history if point['timestamp'] > last]
+            if points:
+                self.append[name] = points
+                last_timestamps[name] = points[-1]['timestamp']
+        for name in [name for name in last_timestamps if name not in self.history]:
+            del last_timestamps[name]
+        self._encoded = {}
+
+    def points(self, name: str, kind: str, binary: bool):
+        """Mảnh đã encode của interface ('full' hoặc 'append'), có cache trong chu kỳ"""
+        key = (name, kind, binary)
+        if key not in self._encoded:
+            points = self.history[name] if kind == 'full' else self.append[name]
+            self._encoded[key] = encode_points_binary(points) if binary else encode_points_json(points)
+        return self._encoded[key]
+
+    def count(self, name: str, kind: str) -> int:
+        return len(self.history[name] if kind == 'full' else self.append[name])
+
+
+class _Subscriber:
+    """Hàng đợi frame, đăng ký interface và bộ đếm của một kết nối"""
+
+    def __init__(self, websocket, queue_size: int, delta: bool = False,
+                 interfaces: Optional[Iterable[str]] = None, binary: bool = False):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.delta = delta
+        self.binary = binary
+        self.interfaces = set(interfaces) if interfaces is not None else None
+        # known: interface client đang có lịch sử; resync: gửi lại full tất cả
+        # (frame đầu tiên, sau khi bỏ frame)
+        self.resync = True
+        self.known = set()
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+
+    def subscribe(self, interfaces: Optional[Iterable[str]]) -> None:
+        """Đổi tập interface đăng ký; interface mới được gửi full ở chu kỳ sau"""
+        self.interfaces = set(interfaces) if interfaces is not None else None
+
+    def wants(self, name: str) -> bool:
+        return self.interfaces is None or name in self.interfaces
+
+    def offer(self, message) -> bool:
+        """Đưa frame vào hàng đợi; False nếu đã phải bỏ frame
+
+        Client snapshot đầy đủ bỏ frame cũ nhất. Client delta bỏ cả hàng đợi
+        (các delta còn lại không còn liên tục) và nhận lại full ở chu kỳ sau.
+        """
+        if self.delta and self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.dropped += 1
+            self.resync = True
+            return False
+
+        dropped = False
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return not dropped
+            except asyncio.QueueFull:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    dropped = True
+                except asyncio.QueueEmpty:
+                    pass
+
+
+class BroadcastPump:
+    """Lấy snapshot định kỳ, serialize một lần và phát cho mọi subscriber
+
+    Args:
+        snapshot (callable): Hàm trả về dữ liệu cần gửi (None để bỏ qua chu kỳ);
+            chạy trong thread pool vì có thể chờ lock của monitor
+        interval (float): Chu kỳ lấy snapshot (giây)
+        queue_size (int): Số frame tối đa chờ gửi cho mỗi client
+        serializer (callable): Hàm chuyển snapshot thành chuỗi gửi đi (client cũ)
+    """
+
+    def __init__(self, snapshot: Callable[[], Optional[Any]], interval: float = DEFAULT_INTERVAL,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, serializer: Callable[[Any], str] = json.dumps):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.queue_size = max(1, queue_size)
+        self.serializer = serializer
+        self._subscribers: Dict[int, _Subscriber] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_timestamps: Dict[str, float] = {}
+        self._device_json = None
+        self._metrics = {
+            'frames': 0,
+            'sent': 0,
+            'sent_bytes': 0,
+            'dropped': 0,
+            'send_errors': 0,
+            'last_produce_ms': 0.0
+        }
+
+    @property
+    def active_connections(self):
+        return [subscriber.websocket for subscriber in self._subscribers.values()]
+
+    async def connect(self, websocket) -> None:
+        """Chấp nhận kết nối và đăng ký nhận frame; khởi động pump nếu chưa chạy
+
+        Chế độ lấy từ query string của kết nối: protocol=delta, format=binary,
+        interfaces=tên1,tên2.
+        """
+        params = getattr(websocket, 'query_params', None) or {}
+        interfaces = params.get('interfaces')
+        subscriber = _Subscriber(
+            websocket, self.queue_size,
+            delta=params.get('protocol') == 'delta',
+            interfaces=[name for name in interfaces.split(',') if name] if interfaces else None,
+            binary=params.get('format') == 'binary'
+        )
+        await websocket.accept()
+        self._subscribers[id(websocket)] = subscriber
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def disconnect(self, websocket) -> None:
+        self._subscribers.pop(id(websocket), None)
+
+    async def serve(self, websocket) -> None:
+        """Gửi frame và nhận tin nhắn đăng ký cho đến khi kết nối đóng (lỗi được ném ra)"""
+        subscriber = self._subscribers.get(id(websocket))
+        if subscriber is None:
+            return
+        tasks = {asyncio.ensure_future(self._send_loop(subscriber)),
+                 asyncio.ensure_future(self._receive_loop(subscriber))}
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _send_loop(self, subscriber: _Subscriber) -> None:
+        websocket = subscriber.websocket
+        while True:
+            message = await subscriber.queue.get()
+            try:
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+            except Exception:
+                self._metrics['send_errors'] += 1
+                raise
+            subscriber.sent += 1
+            subscriber.sent_bytes += len(message)
+            self._metrics['sent'] += 1
+            self._metrics['sent_bytes'] += len(message)
+
+    async def _receive_loop(self, subscriber: _Subscriber) -> None:
+        """Đọc tin nhắn {"subscribe": [...]} của client (đồng thời phát hiện ngắt kết nối)"""
+        while True:
+            message = await subscriber.websocket.receive_text()
+            try:
+                request = json.loads(message)
+            except ValueError:
+                logger.warning(f"Tin nhắn WebSocket không hợp lệ: {message[:100]}")
+                continue
+            if isinstance(request, dict) and 'subscribe' in request:
+                interfaces = request['subscribe']
+                subscriber.subscribe(None if interfaces is None else [str(name) for name in interfaces])
+
+    def publish(self, message) -> None:
+        """Đưa một frame đã serialize vào hàng đợi của mọi subscriber nhận snapshot đầy đủ"""
+        for subscriber in list(self._subscribers.values()):
+            if not subscriber.delta and not subscriber.offer(message):
+                self._metrics['dropped'] += 1
+
+    async def broadcast(self, message: str) -> None:
+        self._metrics['frames'] += 1
+        self.publish(message)
+
+    def _delta_frame(self, subscriber: _Subscriber, tick: _Tick):
+        """Frame update của một client delta, None nếu không có gì mới"""
+        names = [name for name in tick.history if subscriber.wants(name)]
+        full = [name for name in names if subscriber.resync or name not in subscriber.known]
+        append = [name for name in names if name not in full and name in tick.append]
+        removed = [name for name in subscriber.known if name not in tick.history or not subscriber.wants(name)]
+        send_device = subscriber.resync or tick.device_changed
+
+        subscriber.known = set(names)
+        subscriber.resync = False
+        if not (full or append or removed or send_device):
+            return None
+
+        if subscriber.binary:
+            header = {'type': 'update'}
+            if send_device:
+                header['device'] = tick.device
+            if removed:
+                header['removed'] = removed
+            if full and tick.depth:
+                header['depth'] = tick.depth
+            header['full'] = [[name, tick.count(name, 'full')] for name in full]
+            header['append'] = [[name, tick.count(name, 'append')] for name in append]
+            header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+            padding = -(len(BINARY_MAGIC) + 4 + len(header_bytes)) % 8
+            parts = [BINARY_MAGIC, struct.pack('<I', len(header_bytes) + padding),
+                     header_bytes, b' ' * padding]
+            parts.extend(tick.points(name, 'full', True) for name in full)
+            parts.extend(tick.points(name, 'append', True) for name in append)
+            return b''.join(parts)
+
+        parts = ['{"type":"update"']
+        if send_device:
+            parts.append(f',"device":{tick.device_json}')
+        if removed:
+            parts.append(f',"removed":{json.dumps(removed)}')
+        if full and tick.depth:
+            parts.append(f',"depth":{int(tick.depth)}')
+        for kind, selected in (('full', full), ('append', append)):
+            if selected:
+                fragments = ','.join(f'{json.dumps(name)}:{tick.points(name, kind, False)}' for name in selected)
+                parts.append(f',"{kind}":{{{fragments}}}')
+        parts.append('}')
+        return ''.join(parts)
+
+    def _publish_tick(self, tick: _Tick) -> None:
+        self._metrics['frames'] += 1
+        tick.device_changed = tick.device_json != self._device_json
+        self._device_json = tick.device_json
+        if tick.legacy is not None:
+            self.publish(tick.legacy)
+
+        for subscriber in list(self._subscribers.values()):
+            if not subscriber.delta:
+                continue
+            frame = self._delta_frame(subscriber, tick)
+            if frame is not None and not subscriber.offer(frame):
+                self._metrics['dropped'] += 1
+
+    def _produce(self) -> Optional[_Tick]:
+        data = self.snapshot()
+        if not data:
+            return None
+        legacy = None
+        if any(not subscriber.delta for subscriber in list(self._subscribers.values())):
+            legacy = self.serializer(data)
+        return _Tick(data, self._last_timestamps, legacy)
+
+    async def _run(self) -> None:
+        """Vòng lặp producer, dừng khi không còn subscriber"""
+        loop = asyncio.get_event_loop()
+        next_tick = loop.time()
+        while self._subscribers:
+            started = time.perf_counter()
+            try:
+                tick = await loop.run_in_executor(None, self._produce)
+                if tick is not None:
+                    self._publish_tick(tick)
+            except Exception as e:
+                logger.error(f"Lỗi khi tạo dữ liệu WebSocket: {e}")
+            self._metrics['last_produce_ms'] = (time.perf_counter() - started) * 1000
+
+            next_tick += self.interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Chậm hơn một chu kỳ: bỏ các tick đã lỡ thay vì chạy dồn
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+        self._last_timestamps.clear()
+        self._device_json = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Chỉ số của pump và từng client"""
+        return {
+            **self._metrics,
+            'subscribers': len(self._subscribers),
+            'interval': self.interval,
+            'queue_size': self.queue_size,
+            'clients': [{
+                'protocol': 'delta' if subscriber.delta else 'full',
+                'format': 'binary' if subscriber.binary else 'json',
+                'interfaces': sorted(subscriber.interfaces) if subscriber.interfaces is not None else None,
+                'queued': subscriber.queue.qsize(),
+                'sent': subscriber.sent,
+                'sent_bytes': subscriber.sent_bytes,
+                'dropped': subscriber.dropped
+            } for subscriber in self._subscribers.values()]
+        }
@@ -0,0 +1,31 @@
+"""
+Kiểm tra giảm điểm chuỗi thời gian (utils.downsample)
+"""
+
+from pathlib import Path
+
+import pytest
+
+from utils.downsample import downsample_points
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_mikrotik_msc_copy_is_identical():
+    # mikrotik-msc đóng gói riêng (import phẳng) nên giữ một bản sao của module
+    original = (ROOT / 'utils' / 'downsample.py').read_bytes()
+    copy = (ROOT / 'mikrotik-msc' / 'mikrotik_downsample.py').read_bytes()
+    assert copy == original, "mikrotik-msc/mikrotik_downsample.py khác utils/downsample.py, hãy chép lại"
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+@pytest.mark.parametrize('max_points', [1, 2, 3, 5, 50])
+def test_result_never_exceeds_max_points(method, max_points):
+    points = [
+        {'timestamp': i, 'bytes_in': (i * 37) % 101, 'bytes_out': (i * 53) % 97}
+        for i in range(1000)
+    ]
+    result = downsample_points(points, max_points, method=method)
+    assert 0 < len(result) <= max_points
+    timestamps = [point['timestamp'] for point in result]
+    assert timestamps == sorted(timestamps)
@@ -0,0 +1,75 @@
+"""
+Kiểm tra LivenessProber với backend giả lập (không cần mạng)
+"""
+
+import asyncio
+import time
+
+from utils.liveness import ArpTableBackend, LivenessProber, StaticBackend
+
+
+class CountingBackend(StaticBackend):
+    """StaticBackend ghi lại số probe chạy đồng thời lớn nhất"""
+    
+    def __init__(self, alive=(), delay=0.0):
+        super().__init__(alive, delay)
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    async def probe(self, ip_address, timeout):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().probe(ip_address, timeout)
+        finally:
+            self.in_flight -= 1
+
+
+class RecordingArpBackend(ArpTableBackend):
+    """ArpTableBackend ghi lại các IP được kiểm tra"""
+    
+    def __init__(self, rows):
+        super().__init__(lambda: rows)
+        self.probed = []
+    
+    async def probe(self, ip_address, timeout):
+        self.probed.append(ip_address)
+        return await super().probe(ip_address, timeout)
+
+
+def test_in_flight_is_bounded():
+    targets = [f"10.0.0.{i}" for i in range(1, 51)]
+    backend = CountingBackend(alive=targets, delay=0.01)
+    prober = LivenessProber(backend=backend, max_in_flight=5, timeout=1.0)
+    
+    results = asyncio.run(prober.probe_many(targets))
+    
+    assert all(results[ip] for ip in targets)
+    assert backend.probes == len(targets)
+    assert backend.max_in_flight == 5
+
+
+def test_per_target_timeout():
+    backend = StaticBackend(alive=["10.0.0.1"], delay=0.5)
+    prober = LivenessProber(backend=backend, timeout=0.05)
+    
+    start = time.monotonic()
+    results = asyncio.run(prober.probe_many(["10.0.0.1"]))
+    
+    assert results == {"10.0.0.1": False}
+    assert time.monotonic() - start < 0.4
+
+
+def test_arp_fallback_only_for_non_responders():
+    backend = StaticBackend(alive=["10.0.0.1"])
+    fallback = RecordingArpBackend([
+        {"address": "10.0.0.2", "mac-address": "AA:BB:CC:00:00:02", "status": "reachable"},
+        {"address": "10.0.0.3", "mac-address": "AA:BB:CC:00:00:03", "status": "failed"}
+    ])
+    prober = LivenessProber(backend=backend, fallback=fallback, timeout=0.1)
+    
+    results = asyncio.run(prober.probe_many(["10.0.0.1", "10.0.0.2/24", "10.0.0.3", "10.0.0.4"]))
+    
+    assert results == {"10.0.0.1": True, "10.0.0.2": True, "10.0.0.3": False, "10.0.0.4": False}
+    assert sorted(fallback.probed) == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    assert prober.last_sweep["fallback_checked"] == 3
@@ -0,0 +1,159 @@
+"""
+Kiểm tra AsyncMikroTikAPI với một máy chủ RouterOS API giả lập (asyncio, localhost)
+"""
+
+import asyncio
+import contextlib
+import gc
+
+from utils.mikrotik_api import encode_sentence
+from utils.mikrotik_async_api import AsyncMikroTikAPI
+
+
+class FakeRouter:
+    """Máy chủ API giả: đọc câu có .tag và trả lời theo tên lệnh
+
+    - /login: !done ngay
+    - /slow: không trả lời cho đến khi bị /cancel
+    - /late: trả lời sau `late_delay` giây
+    - /list: 3 dòng !re rồi !done ngay
+    - /stream: 3 dòng !re, không có !done cho đến khi bị /cancel
+    """
+
+    def __init__(self, late_delay=0.0):
+        self.late_delay = late_delay
+        self.commands = []
+        self.cancelled = []
+        self.unknown_cancels = []
+        self._open = {}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    async def _read_sentence(reader):
+        words = []
+        while True:
+            length = (await reader.readexactly(1))[0]
+            if length >= 0x80:
+                length = ((length & 0x3F) << 8) | (await reader.readexactly(1))[0]
+            if not length:
+                return words
+            words.append((await reader.readexactly(length)).decode('utf-8'))
+
+    async def _handle(self, reader, writer):
+        def send(*words):
+            writer.write(encode_sentence(list(words)))
+
+        try:
+            while True:
+                words = await self._read_sentence(reader)
+                command = words[0]
+                tag = next(word[5:] for word in words if word.startswith('.tag='))
+                self.commands.append(command)
+                tagged = f'.tag={tag}'
+                if command == '/login':
+                    send('!done', tagged)
+                elif command in ('/slow', '/stream'):
+                    self._open[tag] = command
+                    if command == '/stream':
+                        for i in range(3):
+                            send('!re', f'=name=item{i}', tagged)
+                elif command == '/late':
+                    await asyncio.sleep(self.late_delay)
+                    send('!re', '=name=late', tagged)
+                    send('!done', tagged)
+                elif command == '/list':
+                    for i in range(3):
+                        send('!re', f'=name=item{i}', tagged)
+                    send('!done', tagged)
+                elif command == '/cancel':
+                    target = next(word[5:] for word in words if word.startswith('=tag='))
+                    if self._open.pop(target, None):
+                        self.cancelled.append(target)
+                        send('!trap', '=message=interrupted', f'.tag={target}')
+                        send('!done', f'.tag={target}')
+                        send('!done', tagged)
+                    else:
+                        self.unknown_cancels.append(target)
+                        send('!trap', '=message=unknown tag', tagged)
+                        send('!done', tagged)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+def run_with_router(scenario, late_delay=0.0, timeout=0.5):
+    """Chạy scenario(api, router) và trả về các lỗi asyncio không được xử lý"""
+    loop_errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: loop_errors.append(context))
+        router = FakeRouter(late_delay)
+        port = await router.start()
+        api = AsyncMikroTikAPI('127.0.0.1', 'admin', 'secret', port=port, timeout=timeout)
+        try:
+            assert await api.connect()
+            await scenario(api, router)
+        finally:
+            await api.disconnect()
+            await router.stop()
+            gc.collect()
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+    return loop_errors
+
+
+def test_timeout_cancels_command_without_closing_session():
+    async def scenario(api, router):
+        async def late():
+            await asyncio.sleep(0.3)
+            return await api.execute_command('/late')
+
+        slow, late_response = await asyncio.gather(
+            api.execute_command('/slow'), late(), return_exceptions=True
+        )
+        assert isinstance(slow, asyncio.TimeoutError)
+        # Lệnh khác đang chạy trên cùng phiên vẫn nhận được kết quả
+        assert late_response['re'] == [{'name': 'late'}]
+        assert api.connected
+        await asyncio.sleep(0.05)
+        assert router.cancelled == ['2']
+        assert (await api.execute_command('/list'))['done']
+
+    assert run_with_router(scenario, late_delay=0.35) == []
+
+
+def test_early_break_cancels_open_stream():
+    async def scenario(api, router):
+        async with contextlib.aclosing(api.iter_command('/stream')) as rows:
+            async for row in rows:
+                assert row == {'name': 'item0'}
+                break
+        await asyncio.sleep(0.05)
+        assert router.cancelled == ['2']
+        assert api.connected
+        assert len((await api.execute_command('/list'))['re']) == 3
+
+    assert run_with_router(scenario) == []
+
+
+def test_early_break_after_done_sends_no_cancel():
+    async def scenario(api, router):
+        rows = api.iter_command('/list')
+        assert await rows.__anext__() == {'name': 'item0'}
+        # !done đã đến trong lúc người dùng chưa đóng generator
+        await asyncio.sleep(0.05)
+        await rows.aclose()
+        await asyncio.sleep(0.05)
+        assert '/cancel' not in router.commands
+        assert router.unknown_cancels == []
+
+    assert run_with_router(scenario) == []
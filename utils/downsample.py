@@ -0,0 +1,178 @@
+"""
+Module giảm số điểm của chuỗi thời gian trước khi gửi cho biểu đồ
+
+- LTTB (Largest-Triangle-Three-Buckets): giữ hình dạng đường với số điểm cố định
+- Min/max: giữ đỉnh và đáy của từng bucket (không làm mất đột biến traffic)
+- Dữ liệu lớn được chọn trước bằng min/max vector hóa (MinMaxLTTB) rồi mới
+  chạy LTTB trên tập ứng viên nhỏ, nên một triệu điểm chỉ mất vài mili giây
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Số ứng viên min/max cho mỗi điểm đầu ra khi chọn trước cho LTTB
+MINMAX_PRESELECT_RATIO = 4
+
+
+def _bucket_edges(start: int, stop: int, buckets: int) -> np.ndarray:
+    """Chia đoạn chỉ số [start, stop) thành `buckets` đoạn gần bằng nhau"""
+    return np.linspace(start, stop, buckets + 1).astype(np.int64)
+
+
+def _segment_first(mask: np.ndarray, segment_ids: np.ndarray) -> np.ndarray:
+    """Chỉ số đầu tiên có mask=True trong mỗi đoạn (mỗi đoạn có ít nhất một)"""
+    idx = np.flatnonzero(mask)
+    seg = segment_ids[idx]
+    keep = np.empty(len(idx), dtype=bool)
+    keep[:1] = True
+    keep[1:] = seg[1:] != seg[:-1]
+    return idx[keep]
+
+
+def minmax_indices(y: np.ndarray, max_points: int, start: int = 0,
+                   stop: Optional[int] = None) -> np.ndarray:
+    """Chỉ số của điểm nhỏ nhất và lớn nhất trong mỗi bucket (vector hóa)
+
+    Trả về tối đa `max_points` chỉ số đã sắp xếp trong đoạn [start, stop).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    stop = len(y) if stop is None else stop
+    n = stop - start
+    if n <= max_points:
+        return np.arange(start, stop)
+
+    buckets = max(1, max_points // 2)
+    edges = _bucket_edges(start, stop, buckets)
+    starts = edges[:-1]
+    lengths = np.diff(edges)
+    values = y[start:stop]
+    segment_ids = np.repeat(np.arange(buckets), lengths)
+    local_starts = starts - start
+
+    mins = np.minimum.reduceat(values, local_starts)
+    maxs = np.maximum.reduceat(values, local_starts)
+    argmin = _segment_first(values == np.repeat(mins, lengths), segment_ids)
+    argmax = _segment_first(values == np.repeat(maxs, lengths), segment_ids)
+    return np.unique(np.concatenate((argmin, argmax))) + start
+
+
+def _lttb_exact(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """LTTB chuẩn trên mảng đã lọc, trả về chỉ số được chọn"""
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n) if n <= max_points else np.array([0, n - 1])
+
+    buckets = max_points - 2
+    edges = _bucket_edges(1, n - 1, buckets)
+    lengths = np.diff(edges)
+    # Trung bình của bucket kế tiếp (bucket cuối dùng điểm cuối cùng)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / lengths
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / lengths
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a_x, a_y = x[0], y[0]
+    for i in range(buckets):
+        s, e = edges[i], edges[i + 1]
+        px = x[s:e]
+        py = y[s:e]
+        c_x, c_y = next_x[i], next_y[i]
+        # Hai lần diện tích tam giác (a, p, c); hằng số 1/2 không ảnh hưởng argmax
+        area = np.abs((a_x - c_x) * (py - a_y) - (a_x - px) * (c_y - a_y))
+        j = s + int(area.argmax())
+        selected[i + 1] = j
+        a_x, a_y = x[j], y[j]
+    return selected
+
+
+def lttb_indices(x: Sequence[float], y: Sequence[float], max_points: int) -> np.ndarray:
+    """Chỉ số các điểm được giữ lại theo LTTB (luôn gồm điểm đầu và cuối)
+
+    Với dữ liệu lớn hơn MINMAX_PRESELECT_RATIO * max_points, các ứng viên được
+    chọn trước bằng min/max của từng bucket rồi mới chạy LTTB.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])[:max(max_points, 0)]
+
+    candidates = None
+    if n > MINMAX_PRESELECT_RATIO * max_points:
+        inner = minmax_indices(y, MINMAX_PRESELECT_RATIO * max_points, 1, n - 1)
+        candidates = np.concatenate(([0], inner, [n - 1]))
+        x = x[candidates]
+        y = y[candidates]
+
+    selected = _lttb_exact(x, y, max_points)
+    return candidates[selected] if candidates is not None else selected
+
+
+def minmax_envelope(x: Sequence[float], y: Sequence[float], buckets: int) -> Dict[str, np.ndarray]:
+    """Dải bao min/max theo bucket: x bắt đầu bucket, giá trị min và max
+
+    Dùng để vẽ vùng dao động quanh đường LTTB.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n == 0:
+        return {'x': x, 'min': y, 'max': y}
+    buckets = max(1, min(buckets, n))
+    starts = _bucket_edges(0, n, buckets)[:-1]
+    return {
+        'x': x[starts],
+        'min': np.minimum.reduceat(y, starts),
+        'max': np.maximum.reduceat(y, starts)
+    }
+
+
+def _numeric_x(values: Sequence[Any]) -> np.ndarray:
+    """Chuyển trục x (số, datetime hoặc chuỗi thời gian) sang số giây"""
+    if len(values) and isinstance(values[0], str):
+        return np.array([v.replace(' ', 'T') for v in values], dtype='datetime64[s]').astype(np.float64)
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64) or array.dtype == object:
+        return array.astype('datetime64[s]').astype(np.float64)
+    return array.astype(np.float64)
+
+
+def downsample_points(points: List[Dict[str, Any]], max_points: int,
+                      x_key: str = 'timestamp', y_keys: Sequence[str] = ('bytes_in', 'bytes_out'),
+                      method: str = 'lttb') -> List[Dict[str, Any]]:
+    """Giảm danh sách điểm (dict) xuống tối đa `max_points` phần tử
+
+    Mỗi chuỗi trong y_keys được chọn riêng với max_points / len(y_keys) điểm,
+    kết quả là hợp các chỉ số nên đỉnh của từng chuỗi đều được giữ.
+
+    Args:
+        points (list): Các điểm đã sắp xếp theo x_key
+        max_points (int): Số điểm tối đa; <= 0 để giữ nguyên
+        method (str): 'lttb' hoặc 'minmax'
+    """
+    if max_points <= 0 or len(points) <= max_points:
+        return points
+    if method not in ('lttb', 'minmax'):
+        raise ValueError(f"Phương pháp giảm điểm không hợp lệ: {method}")
+
+    x = _numeric_x([point[x_key] for point in points])
+    per_series = max(3, max_points // max(1, len(y_keys)))
+    selected = []
+    for key in y_keys:
+        y = np.array([point.get(key) or 0 for point in points], dtype=np.float64)
+        if method == 'lttb':
+            selected.append(lttb_indices(x, y, per_series))
+        else:
+            selected.append(minmax_indices(y, per_series))
+
+    indices = np.unique(np.concatenate(selected))
+    if len(indices) > max_points:
+        # Ngân sách quá nhỏ (dưới 3 điểm mỗi chuỗi): lấy đều trong hợp các chỉ số
+        indices = indices[np.linspace(0, len(indices) - 1, max_points).round().astype(np.int64)]
+    return [points[i] for i in indices.tolist()]
@@ -4,84 +4,180 @@ Module giám sát và quản lý IP
 
 import os
 import time
+import atexit
 import logging
 import datetime
-import sqlite3
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.downsample import MINMAX_PRESELECT_RATIO, downsample_points
+from utils.storage import BatchWriter, SQLiteStorage
+from utils.traffic_rollup import MIGRATION as TRAFFIC_ROLLUP_MIGRATION, TrafficRollup
 
 # Khởi tạo logger
 logger = logging.getLogger(__name__)
 
-# Kết nối đến cơ sở dữ liệu
+# Đường dẫn cơ sở dữ liệu
 DB_PATH = 'data/ip_monitoring.db'
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+# Các migration theo thứ tự phiên bản lược đồ (PRAGMA user_version)
+MIGRATIONS = [
+    # 1: Bảng ban đầu
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS ip_monitoring (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            interface TEXT NOT NULL,
+            mac_address TEXT,
+            status TEXT DEFAULT 'inactive',
+            monitoring BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ip_traffic (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            bytes_in INTEGER DEFAULT 0,
+            bytes_out INTEGER DEFAULT 0,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ip_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            event TEXT NOT NULL,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ],
+    # 2: Index cho các truy vấn theo IP, theo khoảng thời gian và theo cờ giám sát
+    [
+        'CREATE INDEX IF NOT EXISTS idx_ip_monitoring_ip_address ON ip_monitoring (ip_address)',
+        'CREATE INDEX IF NOT EXISTS idx_ip_monitoring_monitoring ON ip_monitoring (monitoring)',
+        'CREATE INDEX IF NOT EXISTS idx_ip_traffic_ip_timestamp ON ip_traffic (ip_address, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_ip_history_ip_timestamp ON ip_history (ip_address, timestamp)'
+    ],
+    # 3: Bảng gộp traffic theo 1 phút / 15 phút / 1 ngày
+    TRAFFIC_ROLLUP_MIGRATION
+]
+
+_storage: Optional[SQLiteStorage] = None
+_writer: Optional[BatchWriter] = None
+_rollup: Optional[TrafficRollup] = None
+_retention_thread: Optional[threading.Thread] = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> SQLiteStorage:
+    """Lấy lớp truy cập cơ sở dữ liệu dùng chung (kết nối theo từng luồng, WAL)"""
+    global _storage
+    with _storage_lock:
+        if _storage is None or _storage.db_path != DB_PATH:
+            _storage = SQLiteStorage(DB_PATH, MIGRATIONS)
+        return _storage
+
+def get_writer() -> BatchWriter:
+    """Lấy hàng đợi ghi nền cho ip_traffic và ip_history"""
+    global _writer
+    storage = get_storage()
+    with _storage_lock:
+        if _writer is None or _writer.storage is not storage:
+            if _writer is not None:
+                _writer.close()
+            _writer = BatchWriter(
+                storage,
+                name='ip_monitoring',
+                batch_size=int(os.getenv('IP_MONITORING_WRITE_BATCH', 500)),
+                flush_interval=float(os.getenv('IP_MONITORING_WRITE_INTERVAL', 1.0)),
+                max_backlog=int(os.getenv('IP_MONITORING_WRITE_BACKLOG', 50000)),
+                overflow=os.getenv('IP_MONITORING_WRITE_OVERFLOW', 'drop_oldest')
+            ).start()
+        return _writer
+
+def get_writer_stats() -> Dict:
+    """Số liệu hàng đợi ghi: độ sâu, số dòng bị bỏ, độ trễ flush"""
+    return get_writer().stats()
+
+def flush_writes(timeout: Optional[float] = None) -> bool:
+    """Ghi ngay các dòng đang chờ trong hàng đợi"""
+    return get_writer().flush(timeout)
+
+@atexit.register
+def _close_writer():
+    """Ghi nốt hàng đợi khi tiến trình kết thúc"""
+    if _writer is not None:
+        _writer.close()
+
+def get_traffic_rollup() -> TrafficRollup:
+    """Lấy bộ gộp/lưu giữ dữ liệu ip_traffic"""
+    global _rollup
+    storage = get_storage()
+    with _storage_lock:
+        if _rollup is None or _rollup.storage is not storage:
+            _rollup = TrafficRollup(storage)
+        return _rollup
+
+def run_traffic_retention() -> Dict[str, int]:
+    """Gộp mẫu traffic mới vào các mức 1m/15m/1d và dọn dữ liệu quá hạn"""
+    try:
+        result = get_traffic_rollup().run()
+        logger.debug(f"Đã bảo trì dữ liệu traffic: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Lỗi khi gộp/dọn dữ liệu traffic: {str(e)}")
+        return {}
+
+def _retention_loop(interval: float):
+    while True:
+        run_traffic_retention()
+        time.sleep(interval)
+
+def start_retention_worker(interval: float = 60) -> threading.Thread:
+    """Chạy nền việc gộp và dọn dữ liệu traffic mỗi `interval` giây"""
+    global _retention_thread
+    with _storage_lock:
+        if _retention_thread is None or not _retention_thread.is_alive():
+            _retention_thread = threading.Thread(
+                target=_retention_loop, args=(interval,), name='ip-traffic-retention', daemon=True)
+            _retention_thread.start()
+        return _retention_thread
+
+def _utc_now() -> str:
+    """Thời điểm hiện tại theo định dạng của CURRENT_TIMESTAMP (UTC)"""
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
 def init_database():
-    """Khởi tạo cơ sở dữ liệu"""
+    """Khởi tạo/nâng cấp cơ sở dữ liệu
+    
+    Đây là điểm chạy migration duy nhất; ứng dụng gọi một lần khi khởi động
+    (hoặc chạy `python -m utils.ip_monitoring`).
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Bảng ip_monitoring
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ip_monitoring (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT NOT NULL,
-                interface TEXT NOT NULL,
-                mac_address TEXT,
-                status TEXT DEFAULT 'inactive',
-                monitoring BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Bảng ip_traffic
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ip_traffic (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT NOT NULL,
-                bytes_in INTEGER DEFAULT 0,
-                bytes_out INTEGER DEFAULT 0,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Bảng ip_history
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ip_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT NOT NULL,
-                event TEXT NOT NULL,
-                details TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("Đã khởi tạo cơ sở dữ liệu thành công")
+        version = get_storage().migrate()
+        logger.info(f"Đã khởi tạo cơ sở dữ liệu thành công (phiên bản lược đồ {version})")
+        return True
     except Exception as e:
         logger.error(f"Lỗi khi khởi tạo cơ sở dữ liệu: {str(e)}")
+        return False
 
 def add_ip_to_monitoring(ip_address: str, interface: str, mac_address: Optional[str] = None):
     """Thêm IP vào danh sách giám sát"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO ip_monitoring (ip_address, interface, mac_address, monitoring)
-            VALUES (?, ?, ?, 1)
-        ''', (ip_address, interface, mac_address))
-        
-        # Ghi lịch sử
-        cursor.execute('''
-            INSERT INTO ip_history (ip_address, event, details)
-            VALUES (?, 'add', 'Thêm IP vào giám sát')
-        ''', (ip_address,))
+        with get_storage().transaction() as conn:
+            conn.execute('''
+                INSERT INTO ip_monitoring (ip_address, interface, mac_address, monitoring)
+                VALUES (?, ?, ?, 1)
+            ''', (ip_address, interface, mac_address))
+            
+            # Ghi lịch sử
+            conn.execute('''
+                INSERT INTO ip_history (ip_address, event, details)
+                VALUES (?, 'add', 'Thêm IP vào giám sát')
+            ''', (ip_address,))
         
-        conn.commit()
-        conn.close()
         logger.info(f"Đã thêm IP {ip_address} vào giám sát")
         return True
     except Exception as e:
@@ -91,23 +187,19 @@ def add_ip_to_monitoring(ip_address: str, interface: str, mac_address: Optional[
 def remove_ip_from_monitoring(ip_address: str):
     """Xóa IP khỏi danh sách giám sát"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE ip_monitoring
-            SET monitoring = 0
-            WHERE ip_address = ?
-        ''', (ip_address,))
-        
-        # Ghi lịch sử
-        cursor.execute('''
-            INSERT INTO ip_history (ip_address, event, details)
-            VALUES (?, 'remove', 'Xóa IP khỏi giám sát')
-        ''', (ip_address,))
+        with get_storage().transaction() as conn:
+            conn.execute('''
+                UPDATE ip_monitoring
+                SET monitoring = 0
+                WHERE ip_address = ?
+            ''', (ip_address,))
+            
+            # Ghi lịch sử
+            conn.execute('''
+                INSERT INTO ip_history (ip_address, event, details)
+                VALUES (?, 'remove', 'Xóa IP khỏi giám sát')
+            ''', (ip_address,))
         
-        conn.commit()
-        conn.close()
         logger.info(f"Đã xóa IP {ip_address} khỏi giám sát")
         return True
     except Exception as e:
@@ -117,56 +209,53 @@ def remove_ip_from_monitoring(ip_address: str):
 def is_ip_monitored(ip_address: str) -> bool:
     """Kiểm tra xem IP có đang được giám sát không"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        row = get_storage().query_one('''
             SELECT monitoring
             FROM ip_monitoring
             WHERE ip_address = ?
         ''', (ip_address,))
         
-        row = cursor.fetchone()
-        conn.close()
-        
         return bool(row and row[0])
     except Exception as e:
         logger.error(f"Lỗi khi kiểm tra monitoring của IP {ip_address}: {str(e)}")
         return False
 
+def get_monitored_ips() -> Set[str]:
+    """Lấy tập các IP đang được giám sát (một truy vấn cho toàn bộ danh sách)"""
+    try:
+        rows = get_storage().query('SELECT ip_address FROM ip_monitoring WHERE monitoring = 1')
+        return {row[0] for row in rows}
+    except Exception as e:
+        logger.error(f"Lỗi khi lấy danh sách IP đang giám sát: {str(e)}")
+        return set()
+
 def enable_ip_monitoring(ip_address: str) -> bool:
     """Bật giám sát cho một IP"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Kiểm tra xem IP đã tồn tại trong bảng chưa
-        cursor.execute('SELECT id FROM ip_monitoring WHERE ip_address = ?', (ip_address,))
-        row = cursor.fetchone()
-        
-        if row:
-            # Cập nhật trạng thái monitoring
-            cursor.execute('''
-                UPDATE ip_monitoring
-                SET monitoring = 1
-                WHERE ip_address = ?
-            ''', (ip_address,))
-        else:
-            # Thêm mới vào bảng với interface mặc định
-            cursor.execute('''
-                INSERT INTO ip_monitoring (ip_address, interface, monitoring)
-                VALUES (?, 'unknown', 1)
+        with get_storage().transaction() as conn:
+            # Kiểm tra xem IP đã tồn tại trong bảng chưa
+            row = conn.execute('SELECT id FROM ip_monitoring WHERE ip_address = ?', (ip_address,)).fetchone()
+            
+            if row:
+                # Cập nhật trạng thái monitoring
+                conn.execute('''
+                    UPDATE ip_monitoring
+                    SET monitoring = 1
+                    WHERE ip_address = ?
+                ''', (ip_address,))
+            else:
+                # Thêm mới vào bảng với interface mặc định
+                conn.execute('''
+                    INSERT INTO ip_monitoring (ip_address, interface, monitoring)
+                    VALUES (?, 'unknown', 1)
+                ''', (ip_address,))
+            
+            # Ghi lịch sử
+            conn.execute('''
+                INSERT INTO ip_history (ip_address, event, details)
+                VALUES (?, 'enable_monitoring', 'Bật giám sát')
             ''', (ip_address,))
         
-        # Ghi lịch sử
-        cursor.execute('''
-            INSERT INTO ip_history (ip_address, event, details)
-            VALUES (?, 'enable_monitoring', 'Bật giám sát')
-        ''', (ip_address,))
-        
-        conn.commit()
-        conn.close()
-        
         logger.info(f"Đã bật monitoring cho IP {ip_address}")
         return True
     except Exception as e:
@@ -176,23 +265,18 @@ def enable_ip_monitoring(ip_address: str) -> bool:
 def disable_ip_monitoring(ip_address: str) -> bool:
     """Tắt giám sát cho một IP"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE ip_monitoring
-            SET monitoring = 0
-            WHERE ip_address = ?
-        ''', (ip_address,))
-        
-        # Ghi lịch sử
-        cursor.execute('''
-            INSERT INTO ip_history (ip_address, event, details)
-            VALUES (?, 'disable_monitoring', 'Tắt giám sát')
-        ''', (ip_address,))
-        
-        conn.commit()
-        conn.close()
+        with get_storage().transaction() as conn:
+            conn.execute('''
+                UPDATE ip_monitoring
+                SET monitoring = 0
+                WHERE ip_address = ?
+            ''', (ip_address,))
+            
+            # Ghi lịch sử
+            conn.execute('''
+                INSERT INTO ip_history (ip_address, event, details)
+                VALUES (?, 'disable_monitoring', 'Tắt giám sát')
+            ''', (ip_address,))
         
         logger.info(f"Đã tắt monitoring cho IP {ip_address}")
         return True
@@ -201,47 +285,33 @@ def disable_ip_monitoring(ip_address: str) -> bool:
         return False
 
 def update_ip_traffic(ip_address: str, bytes_in: int, bytes_out: int):
-    """Cập nhật thông tin traffic của IP"""
+    """Cập nhật thông tin traffic của IP
+    
+    Dòng được đưa vào hàng đợi ghi nền và ghi theo batch; thời điểm lấy mẫu
+    được gắn ngay lúc gọi.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        queued = get_writer().submit('''
+            INSERT INTO ip_traffic (ip_address, bytes_in, bytes_out, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', (ip_address, bytes_in, bytes_out, _utc_now()))
         
-        cursor.execute('''
-            INSERT INTO ip_traffic (ip_address, bytes_in, bytes_out)
-            VALUES (?, ?, ?)
-        ''', (ip_address, bytes_in, bytes_out))
-        
-        conn.commit()
-        conn.close()
         logger.debug(f"Đã cập nhật traffic cho IP {ip_address}")
-        return True
+        return queued
     except Exception as e:
         logger.error(f"Lỗi khi cập nhật traffic cho IP {ip_address}: {str(e)}")
         return False
 
-def get_ip_traffic_history(ip_address: str, hours: int = 24) -> List[Dict]:
-    """Lấy lịch sử traffic của IP"""
+def get_ip_traffic_history(ip_address: str, hours: int = 24, max_points: int = 500) -> List[Dict]:
+    """Lấy lịch sử traffic của IP
+    
+    Dữ liệu được lấy từ mẫu thô hoặc mức gộp (1m/15m/1d) phù hợp rồi giảm
+    bằng LTTB để không vượt quá max_points điểm.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT bytes_in, bytes_out, timestamp
-            FROM ip_traffic
-            WHERE ip_address = ? AND timestamp >= datetime('now', '-' || ? || ' hours')
-            ORDER BY timestamp ASC
-        ''', (ip_address, hours))
-        
-        results = []
-        for row in cursor.fetchall():
-            results.append({
-                'bytes_in': row[0],
-                'bytes_out': row[1],
-                'timestamp': row[2]
-            })
-        
-        conn.close()
-        return results
+        data = get_traffic_rollup().series(
+            hours * 3600, ip_address=ip_address, max_points=max_points * MINMAX_PRESELECT_RATIO)
+        return downsample_points(data, max_points)
     except Exception as e:
         logger.error(f"Lỗi khi lấy lịch sử traffic cho IP {ip_address}: {str(e)}")
         return []
@@ -249,10 +319,7 @@ def get_ip_traffic_history(ip_address: str, hours: int = 24) -> List[Dict]:
 def get_ip_history(ip_address: str) -> List[Dict]:
     """Lấy lịch sử hoạt động của IP"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = get_storage().query('''
             SELECT event, details, timestamp
             FROM ip_history
             WHERE ip_address = ?
@@ -261,80 +328,96 @@ def get_ip_history(ip_address: str) -> List[Dict]:
         ''', (ip_address,))
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             results.append({
                 'event': row[0],
                 'details': row[1],
                 'timestamp': row[2]
             })
         
-        conn.close()
         return results
     except Exception as e:
         logger.error(f"Lỗi khi lấy lịch sử cho IP {ip_address}: {str(e)}")
         return []
 
-def check_ip_status(ip_address: str) -> Tuple[bool, Optional[str]]:
-    """Kiểm tra trạng thái của IP"""
+def _record_status(ip_address: str, status: bool, old_status: Optional[str]) -> str:
+    """Đưa thay đổi trạng thái và lịch sử vào hàng đợi ghi, trả về trạng thái mới"""
+    new_status = 'active' if status else 'inactive'
+    if old_status != new_status:
+        writer = get_writer()
+        writer.submit('''
+            UPDATE ip_monitoring
+            SET status = ?
+            WHERE ip_address = ?
+        ''', (new_status, ip_address))
+        
+        # Ghi lịch sử
+        writer.submit('''
+            INSERT INTO ip_history (ip_address, event, details, timestamp)
+            VALUES (?, 'status_change', ?, ?)
+        ''', (ip_address, f'Trạng thái thay đổi từ {old_status} sang {new_status}', _utc_now()))
+    return new_status
+
+def check_ip_status(ip_address: str, status: Optional[bool] = None) -> Tuple[bool, Optional[str]]:
+    """Kiểm tra trạng thái của IP
+    
+    Args:
+        ip_address (str): Địa chỉ IP
+        status (bool): Kết quả liveness đã có sẵn (từ một lượt kiểm tra chung);
+            nếu bỏ trống sẽ kiểm tra riêng IP này
+    """
     try:
-        # Ping đến IP
-        response = os.system(f"ping -c 1 -W 1 {ip_address} > /dev/null 2>&1")
-        status = response == 0
+        if status is None:
+            from utils.mikrotik_utils import is_ip_active
+            status = is_ip_active(ip_address)
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        # Ghi nốt thay đổi đang chờ để đọc đúng trạng thái cũ
+        get_writer().flush(timeout=5)
         
         # Lấy trạng thái cũ
-        cursor.execute('''
+        row = get_storage().query_one('''
             SELECT status
             FROM ip_monitoring
             WHERE ip_address = ?
         ''', (ip_address,))
-        row = cursor.fetchone()
         old_status = row[0] if row else None
         
-        # Cập nhật trạng thái mới
-        new_status = 'active' if status else 'inactive'
-        if old_status != new_status:
-            cursor.execute('''
-                UPDATE ip_monitoring
-                SET status = ?
-                WHERE ip_address = ?
-            ''', (new_status, ip_address))
-            
-            # Ghi lịch sử
-            cursor.execute('''
-                INSERT INTO ip_history (ip_address, event, details)
-                VALUES (?, 'status_change', ?)
-            ''', (ip_address, f'Trạng thái thay đổi từ {old_status} sang {new_status}'))
-            
-            conn.commit()
-        
-        conn.close()
-        return status, new_status
+        return status, _record_status(ip_address, status, old_status)
     except Exception as e:
         logger.error(f"Lỗi khi kiểm tra trạng thái IP {ip_address}: {str(e)}")
         return False, None
 
+def check_ips_status(ip_addresses: List[str]) -> Dict[str, bool]:
+    """Kiểm tra đồng thời nhiều IP rồi cập nhật trạng thái của từng IP"""
+    from utils.liveness import host_address
+    from utils.mikrotik_utils import check_ips_active
+    
+    statuses = check_ips_active(ip_addresses)
+    results = {ip: statuses.get(host_address(ip), False) for ip in ip_addresses}
+    try:
+        # Ghi nốt thay đổi đang chờ rồi lấy trạng thái cũ của mọi IP trong một truy vấn
+        get_writer().flush(timeout=5)
+        old_statuses = dict(get_storage().query('''
+            SELECT ip_address, status
+            FROM ip_monitoring
+            WHERE monitoring = 1
+        '''))
+        for ip, status in results.items():
+            _record_status(ip, status, old_statuses.get(ip))
+    except Exception as e:
+        logger.error(f"Lỗi khi cập nhật trạng thái các IP: {str(e)}")
+    return results
+
 def get_monitoring_stats() -> Dict:
     """Lấy thống kê về giám sát IP"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Tổng số IP đang giám sát
-        cursor.execute('SELECT COUNT(*) FROM ip_monitoring WHERE monitoring = 1')
-        total_monitored = cursor.fetchone()[0]
-        
-        # Số IP đang hoạt động
-        cursor.execute('SELECT COUNT(*) FROM ip_monitoring WHERE monitoring = 1 AND status = "active"')
-        active_ips = cursor.fetchone()[0]
-        
-        # Số IP không hoạt động
-        cursor.execute('SELECT COUNT(*) FROM ip_monitoring WHERE monitoring = 1 AND status = "inactive"')
-        inactive_ips = cursor.fetchone()[0]
-        
-        conn.close()
+        total_monitored, active_ips, inactive_ips = get_storage().query_one('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(status = 'active'), 0),
+                   COALESCE(SUM(status = 'inactive'), 0)
+            FROM ip_monitoring
+            WHERE monitoring = 1
+        ''')
         
         return {
             'total_monitored': total_monitored,
@@ -353,24 +436,20 @@ def monitor_ip_status():
     """Hàm chạy nền để giám sát trạng thái IP"""
     while True:
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
             # Lấy danh sách IP cần giám sát
-            cursor.execute('SELECT ip_address FROM ip_monitoring WHERE monitoring = 1')
-            ip_addresses = [row[0] for row in cursor.fetchall()]
-            
-            conn.close()
+            ip_addresses = sorted(get_monitored_ips())
             
-            # Kiểm tra từng IP
-            for ip in ip_addresses:
-                check_ip_status(ip)
+            # Kiểm tra mọi IP trong một lượt song song
+            started = time.monotonic()
+            if ip_addresses:
+                check_ips_status(ip_addresses)
             
-            # Nghỉ 60 giây trước khi kiểm tra lại
-            time.sleep(60)
+            # Nghỉ đến hết chu kỳ 60 giây trước khi kiểm tra lại
+            time.sleep(max(0, 60 - (time.monotonic() - started)))
         except Exception as e:
             logger.error(f"Lỗi trong quá trình giám sát IP: {str(e)}")
             time.sleep(60)  # Nghỉ 60 giây trước khi thử lại
 
-# Khởi tạo cơ sở dữ liệu khi import module
-init_database()
\ No newline at end of file
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    init_database()
@@ -0,0 +1,274 @@
+"""
+Module kiểm tra IP còn hoạt động (liveness) song song
+
+Thay cho việc gọi `ping` qua os.system cho từng IP, module gửi ICMP echo
+qua socket datagram không cần quyền root (Linux: net.ipv4.ping_group_range)
+cho hàng nghìn IP cùng lúc, giới hạn số probe đang chạy và thời gian chờ
+cho mỗi IP. IP không trả lời ICMP được kiểm tra lại bằng bảng ARP của router.
+
+Backend có thể thay thế (ví dụ StaticBackend) để chạy thử không cần mạng.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import itertools
+import ipaddress
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_MAX_IN_FLIGHT = 256
+
+# Trạng thái ARP (RouterOS 7) coi là host vừa trả lời
+FRESH_ARP_STATES = {'reachable', 'delay', 'probe', 'permanent'}
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+
+def host_address(address: str) -> str:
+    """Bỏ phần prefix (/24) của địa chỉ"""
+    return (address or '').split('/', 1)[0].strip()
+
+
+def _checksum(data: bytes) -> int:
+    """Checksum Internet (RFC 1071)"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(int.from_bytes(data[i:i + 2], 'big') for i in range(0, len(data), 2))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(sequence: int, payload: bytes = b'mikrotik-liveness', ipv6: bool = False) -> bytes:
+    """Tạo gói ICMP echo request (identifier do kernel gán cho socket datagram)"""
+    icmp_type = ICMPV6_ECHO_REQUEST if ipv6 else ICMP_ECHO_REQUEST
+    header = bytes([icmp_type, 0, 0, 0, 0, 0]) + sequence.to_bytes(2, 'big')
+    checksum = _checksum(header + payload)
+    return header[:2] + checksum.to_bytes(2, 'big') + header[4:] + payload
+
+
+class ProbeBackend(ABC):
+    """Giao diện backend kiểm tra liveness
+    
+    - `prepare(targets)` chạy một lần trước mỗi lượt kiểm tra
+    - `probe(ip, timeout)` trả về True nếu IP hoạt động
+    """
+    
+    name = 'base'
+    
+    def available(self) -> bool:
+        return True
+    
+    async def prepare(self, targets: List[str]) -> None:
+        pass
+    
+    @abstractmethod
+    async def probe(self, ip_address: str, timeout: float) -> bool:
+        """Trả về True nếu IP trả lời trong `timeout` giây"""
+
+
+class IcmpDatagramBackend(ProbeBackend):
+    """ICMP echo qua socket SOCK_DGRAM/IPPROTO_ICMP, không cần quyền root"""
+    
+    name = 'icmp'
+    
+    def __init__(self):
+        self._sequence = itertools.count(os.getpid() & 0xFFFF)
+        self._available = None
+    
+    def available(self) -> bool:
+        """Kiểm tra kernel cho phép mở socket ping không cần quyền"""
+        if self._available is None:
+            try:
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+                self._available = True
+            except OSError as e:
+                logger.info(f"Không dùng được ICMP datagram socket: {str(e)}")
+                self._available = False
+        return self._available
+    
+    async def probe(self, ip_address: str, timeout: float) -> bool:
+        ip = ipaddress.ip_address(ip_address)
+        ipv6 = ip.version == 6
+        family = socket.AF_INET6 if ipv6 else socket.AF_INET
+        proto = socket.IPPROTO_ICMPV6 if ipv6 else socket.IPPROTO_ICMP
+        reply_type = ICMPV6_ECHO_REPLY if ipv6 else ICMP_ECHO_REPLY
+        sequence = next(self._sequence) & 0xFFFF
+        
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+        try:
+            sock.setblocking(False)
+            sock.connect((str(ip), 0))
+            await loop.sock_sendall(sock, build_echo_request(sequence, ipv6=ipv6))
+            deadline = loop.time() + timeout
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    reply = await asyncio.wait_for(loop.sock_recv(sock, 1024), remaining)
+                except asyncio.TimeoutError:
+                    return False
+                # Socket datagram nhận gói ICMP không kèm IP header
+                if len(reply) >= 8 and reply[0] == reply_type and int.from_bytes(reply[6:8], 'big') == sequence:
+                    return True
+        except OSError as e:
+            logger.debug(f"Lỗi khi ping {ip_address}: {str(e)}")
+            return False
+        finally:
+            sock.close()
+
+
+class ArpTableBackend(ProbeBackend):
+    """Kiểm tra liveness theo độ mới của bảng ARP trên router
+    
+    `fetch_arp` trả về các dòng /ip/arp; bảng được đọc một lần cho mỗi lượt.
+    """
+    
+    name = 'arp'
+    
+    def __init__(self, fetch_arp: Callable[[], List[Dict]]):
+        self.fetch_arp = fetch_arp
+        self._entries = {}
+    
+    @staticmethod
+    def is_fresh(entry: Dict) -> bool:
+        """RouterOS 7 có trường status; RouterOS 6 chỉ có cờ complete/invalid"""
+        if entry.get('disabled') or entry.get('invalid'):
+            return False
+        status = entry.get('status')
+        if status:
+            return status in FRESH_ARP_STATES
+        return bool(entry.get('mac-address')) and entry.get('complete', True) is not False
+    
+    async def prepare(self, targets: List[str]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            rows = await loop.run_in_executor(None, self.fetch_arp)
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc bảng ARP: {str(e)}")
+            rows = []
+        self._entries = {}
+        for row in rows or []:
+            address = row.get('address')
+            # Một IP có thể có nhiều dòng ARP, chỉ cần một dòng còn mới
+            if address and (address not in self._entries or self.is_fresh(row)):
+                self._entries[address] = row
+    
+    async def probe(self, ip_address: str, timeout: float) -> bool:
+        entry = self._entries.get(ip_address)
+        return bool(entry) and self.is_fresh(entry)
+
+
+class StaticBackend(ProbeBackend):
+    """Backend giả lập: IP trong `alive` trả lời sau `delay` giây"""
+    
+    name = 'static'
+    
+    def __init__(self, alive: Iterable[str] = (), delay: float = 0.0):
+        self.alive = set(alive)
+        self.delay = delay
+        self.probes = 0
+    
+    async def probe(self, ip_address: str, timeout: float) -> bool:
+        self.probes += 1
+        if self.delay:
+            await asyncio.sleep(min(self.delay, timeout))
+        return ip_address in self.alive and self.delay <= timeout
+
+
+class LivenessProber:
+    """Kiểm tra liveness cho nhiều IP song song
+    
+    Args:
+        backend: Backend chính (mặc định ICMP datagram)
+        fallback: Backend dùng lại cho IP không trả lời backend chính
+        max_in_flight (int): Số probe tối đa chạy cùng lúc
+        timeout (float): Thời gian chờ cho mỗi IP (giây)
+    """
+    
+    def __init__(self, backend: Optional[ProbeBackend] = None,
+                 fallback: Optional[ProbeBackend] = None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.backend = backend if backend is not None else IcmpDatagramBackend()
+        self.fallback = fallback
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.last_sweep = {}
+    
+    async def _run(self, backend: ProbeBackend, targets: List[str]) -> Dict[str, bool]:
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        
+        async def _probe(ip_address):
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(backend.probe(ip_address, self.timeout), self.timeout + 0.5)
+                except asyncio.TimeoutError:
+                    return False
+                except Exception as e:
+                    logger.debug(f"Lỗi khi kiểm tra {ip_address} bằng {backend.name}: {str(e)}")
+                    return False
+        
+        await backend.prepare(targets)
+        results = await asyncio.gather(*(_probe(ip) for ip in targets))
+        return dict(zip(targets, results))
+    
+    async def probe_many(self, ip_addresses: Iterable[str],
+                         fallback: Optional[ProbeBackend] = None) -> Dict[str, bool]:
+        """Kiểm tra các IP (bỏ prefix, bỏ trùng), trả về dict IP -> đang hoạt động
+        
+        `fallback` thay backend dự phòng cho lượt này, ví dụ khi đã có sẵn bảng ARP.
+        """
+        start = time.monotonic()
+        results = {}
+        targets = []
+        for address in ip_addresses:
+            host = host_address(address)
+            if host in results:
+                continue
+            try:
+                ipaddress.ip_address(host)
+                results[host] = False
+                targets.append(host)
+            except ValueError:
+                logger.warning(f"Địa chỉ IP không hợp lệ: {address}")
+                results[host] = False
+        
+        fallback = fallback if fallback is not None else self.fallback
+        primary = self.backend if self.backend.available() else None
+        pending = targets
+        if primary is not None and pending:
+            results.update(await self._run(primary, pending))
+            pending = [ip for ip in pending if not results[ip]]
+        if fallback is not None and pending:
+            results.update(await self._run(fallback, pending))
+        
+        self.last_sweep = {
+            'targets': len(targets),
+            'alive': sum(1 for ip in targets if results[ip]),
+            'backend': primary.name if primary else None,
+            'fallback_checked': len(pending) if fallback is not None else 0,
+            'duration': time.monotonic() - start
+        }
+        return results
+    
+    def check(self, ip_addresses: Iterable[str],
+              fallback: Optional[ProbeBackend] = None) -> Dict[str, bool]:
+        """Phiên bản đồng bộ của probe_many cho code không chạy asyncio"""
+        return asyncio.run(self.probe_many(ip_addresses, fallback))
+    
+    def is_alive(self, ip_address: str) -> bool:
+        """Kiểm tra một IP"""
+        return self.check([ip_address]).get(host_address(ip_address), False)
@@ -8,8 +8,389 @@ import hashlib
 import binascii
 import logging
 import time
+import itertools
+from concurrent.futures import Future
 import config
 
+# Kích thước mặc định của bộ đệm nhận (byte)
+RECV_BUFFER_SIZE = 65536
+
+
+def encode_word(word):
+    """Mã hóa một từ: tiền tố độ dài (big-endian) + nội dung UTF-8"""
+    data = word.encode('utf-8')
+    length = len(data)
+    if length < 0x80:
+        prefix = length.to_bytes(1, 'big')
+    elif length < 0x4000:
+        prefix = (length | 0x8000).to_bytes(2, 'big')
+    elif length < 0x200000:
+        prefix = (length | 0xC00000).to_bytes(3, 'big')
+    elif length < 0x10000000:
+        prefix = (length | 0xE0000000).to_bytes(4, 'big')
+    else:
+        prefix = b'\xF0' + length.to_bytes(4, 'big')
+    return prefix + data
+
+
+def encode_sentence(words):
+    """Mã hóa cả một câu (kèm từ rỗng kết thúc) thành một khối bytes liền"""
+    return b''.join([encode_word(word) for word in words]) + b'\x00'
+
+
+def build_command_words(command, params=None):
+    """Tạo danh sách từ của một lệnh từ tên lệnh và dict tham số
+    
+    Khóa bắt đầu bằng '?' là điều kiện truy vấn và được gửi nguyên dạng
+    (?address=...), các khóa khác được gửi dưới dạng thuộc tính =key=value.
+    """
+    words = [command]
+    if params:
+        for key, value in params.items():
+            if key.startswith('?'):
+                words.append(f'{key}={value}')
+            else:
+                words.append(f'={key}={value}')
+    return words
+
+
+def _parse_attributes(sentence):
+    """Chuyển các từ thuộc tính (=key=value) của một câu thành dict"""
+    attrs = {}
+    for word in sentence[1:]:
+        if word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attrs[key] = value
+        elif word.startswith('.tag='):
+            attrs['.tag'] = word[5:]
+    return attrs
+
+
+def _add_reply(response, reply, attrs):
+    """Gộp một câu trả lời (!re, !trap, !done...) vào dict phản hồi"""
+    if reply == '!re':
+        response['re'].append(attrs)
+    elif reply in ('!trap', '!fatal'):
+        response['trap'].append(attrs)
+    elif reply == '!done':
+        response['done'] = True
+        # Thuộc tính của !done (ví dụ =ret=) được gắn vào phản hồi
+        for key, value in attrs.items():
+            if key == 'ret':
+                response['ret'].append(value)
+            else:
+                response[key] = value
+
+
+def _new_response():
+    """Tạo dict phản hồi rỗng"""
+    return {'re': [], 'ret': [], 'trap': [], 'done': False}
+
+
+def _format_device_info(system_info, identity_info, version_info):
+    """Tổng hợp thông tin thiết bị từ các phản hồi /system"""
+    return {
+        'identity': identity_info.get('name', 'Unknown'),
+        'model': system_info.get('board-name', 'Unknown'),
+        'serial_number': system_info.get('serial-number', 'Unknown'),
+        'version': system_info.get('version', 'Unknown'),
+        'uptime': system_info.get('uptime', 'Unknown'),
+        'cpu_load': system_info.get('cpu-load', '0'),
+        'total_memory': int(system_info.get('total-memory', 0)),
+        'free_memory': int(system_info.get('free-memory', 0)),
+        'total_hdd_space': int(system_info.get('total-hdd-space', 0)),
+        'free_hdd_space': int(system_info.get('free-hdd-space', 0)),
+        'architecture': system_info.get('architecture-name', 'Unknown'),
+        'board': system_info.get('board-name', 'Unknown'),
+        'current_channel': version_info.get('channel', 'Unknown')
+    }
+
+
+def _format_interface(interface_data):
+    """Chuyển một dòng /interface thành dict interface"""
+    return {
+        'name': interface_data.get('name', 'Unknown'),
+        'type': interface_data.get('type', 'Unknown'),
+        'mac_address': interface_data.get('mac-address', 'Unknown'),
+        'mtu': interface_data.get('mtu', '1500'),
+        'actual_mtu': interface_data.get('actual-mtu', '1500'),
+        'running': interface_data.get('running', 'false') == 'true',
+        'disabled': interface_data.get('disabled', 'false') == 'true',
+        'comment': interface_data.get('comment', '')
+    }
+
+
+def _apply_interface_traffic(interfaces, traffic_rows):
+    """Gắn thông tin traffic vào danh sách interfaces theo tên"""
+    by_name = {interface['name']: interface for interface in reversed(interfaces)}
+    for traffic_data in traffic_rows:
+        interface = by_name.get(traffic_data.get('name'))
+        if interface is not None:
+            interface['rx_byte'] = traffic_data.get('rx-byte', '0')
+            interface['tx_byte'] = traffic_data.get('tx-byte', '0')
+            interface['rx_packet'] = traffic_data.get('rx-packet', '0')
+            interface['tx_packet'] = traffic_data.get('tx-packet', '0')
+    return interfaces
+
+
+def _format_filter_rule(rule):
+    """Chuyển một dòng /ip/firewall/filter thành dict rule"""
+    return {
+        'id': rule.get('.id', 'Unknown'),
+        'chain': rule.get('chain', 'Unknown'),
+        'action': rule.get('action', 'Unknown'),
+        'protocol': rule.get('protocol', 'any'),
+        'src_address': rule.get('src-address', ''),
+        'dst_address': rule.get('dst-address', ''),
+        'src_port': rule.get('src-port', ''),
+        'dst_port': rule.get('dst-port', ''),
+        'comment': rule.get('comment', ''),
+        'disabled': rule.get('disabled', 'false') == 'true',
+        'type': 'filter'
+    }
+
+
+def _format_nat_rule(rule):
+    """Chuyển một dòng /ip/firewall/nat thành dict rule"""
+    return {
+        'id': rule.get('.id', 'Unknown'),
+        'chain': rule.get('chain', 'Unknown'),
+        'action': rule.get('action', 'Unknown'),
+        'protocol': rule.get('protocol', 'any'),
+        'src_address': rule.get('src-address', ''),
+        'dst_address': rule.get('dst-address', ''),
+        'to_addresses': rule.get('to-addresses', ''),
+        'to_ports': rule.get('to-ports', ''),
+        'comment': rule.get('comment', ''),
+        'disabled': rule.get('disabled', 'false') == 'true',
+        'type': 'nat'
+    }
+
+
+def _format_ip_address(addr):
+    """Chuyển một dòng /ip/address thành dict địa chỉ IP"""
+    return {
+        'id': addr.get('.id', 'Unknown'),
+        'address': addr.get('address', 'Unknown'),
+        'network': addr.get('network', ''),
+        'interface': addr.get('interface', 'Unknown'),
+        'type': 'static' if 'dynamic' not in addr else 'dynamic',
+        'status': 'active' if addr.get('disabled', 'false') == 'false' else 'inactive',
+        'comment': addr.get('comment', '')
+    }
+
+
+def _format_log(log):
+    """Chuyển một dòng /log thành dict log"""
+    return {
+        'time': log.get('time', 'Unknown'),
+        'topics': log.get('topics', '').split(','),
+        'message': log.get('message', 'Unknown')
+    }
+
+
+def _log_params(topics=None, limit=50):
+    """Tạo tham số cho lệnh /log/print"""
+    params = {}
+    if topics:
+        params['topics'] = ','.join(topics)
+    if limit:
+        params['limit'] = str(limit)
+    return params
+
+
+class _ClientTable:
+    """Gộp DHCP leases, bảng đăng ký wireless và bảng ARP thành danh sách clients"""
+    
+    def __init__(self):
+        self.clients = []
+        self.by_mac = {}
+    
+    def _add(self, client):
+        self.clients.append(client)
+        self.by_mac.setdefault(client['mac_address'], client)
+    
+    def add_lease(self, lease):
+        """Thêm một DHCP lease"""
+        self._add({
+            'hostname': lease.get('host-name', 'Unknown'),
+            'ip_address': lease.get('address', 'Unknown'),
+            'mac_address': lease.get('mac-address', 'Unknown'),
+            'client_id': lease.get('client-id', ''),
+            'status': 'active' if lease.get('status', '') == 'bound' else 'inactive',
+            'expires': lease.get('expires-after', 'Unknown'),
+            'type': 'dhcp',
+            'comment': lease.get('comment', '')
+        })
+    
+    def add_registration(self, client):
+        """Thêm hoặc cập nhật một wireless client"""
+        # Tìm thông tin DHCP tương ứng
+        mac = client.get('mac-address', '')
+        existing_client = self.by_mac.get(mac)
+        
+        if existing_client:
+            # Cập nhật thông tin wireless
+            existing_client['connection_type'] = 'wireless'
+            existing_client['interface'] = client.get('interface', 'Unknown')
+            existing_client['signal_strength'] = client.get('signal-strength', '0')
+            existing_client['tx_rate'] = client.get('tx-rate', '0')
+            existing_client['rx_rate'] = client.get('rx-rate', '0')
+        else:
+            # Thêm client mới
+            self._add({
+                'hostname': 'Unknown',
+                'ip_address': 'Unknown',
+                'mac_address': mac,
+                'status': 'active',
+                'connection_type': 'wireless',
+                'interface': client.get('interface', 'Unknown'),
+                'signal_strength': client.get('signal-strength', '0'),
+                'tx_rate': client.get('tx-rate', '0'),
+                'rx_rate': client.get('rx-rate', '0'),
+                'type': 'wireless'
+            })
+    
+    def add_arp(self, arp):
+        """Bổ sung thông tin từ một dòng bảng ARP"""
+        mac = arp.get('mac-address', '')
+        ip = arp.get('address', '')
+        existing_client = self.by_mac.get(mac)
+        
+        if existing_client and existing_client['ip_address'] == 'Unknown':
+            existing_client['ip_address'] = ip
+            existing_client['interface'] = arp.get('interface', 'Unknown')
+        elif not existing_client and mac and ip:
+            # Thêm client mới từ bảng ARP
+            self._add({
+                'hostname': 'Unknown',
+                'ip_address': ip,
+                'mac_address': mac,
+                'status': 'active' if arp.get('complete', 'false') == 'true' else 'inactive',
+                'connection_type': 'wired',
+                'interface': arp.get('interface', 'Unknown'),
+                'type': 'arp'
+            })
+    
+    def to_list(self):
+        """Trả về danh sách clients kèm ID duy nhất"""
+        for i, client in enumerate(self.clients):
+            client['id'] = f"client{i+1}"
+        return self.clients
+
+
+class ReceiveBuffer:
+    """Bộ đệm nhận cho giao thức RouterOS API
+    
+    Dữ liệu được đọc vào một bytearray bằng các lệnh recv_into lớn, sau đó
+    tiền tố độ dài và nội dung của từng từ được giải mã trực tiếp từ bộ đệm
+    qua memoryview, tránh một syscall cho mỗi byte và việc nối bytes liên tục.
+    """
+    
+    def __init__(self, sock, size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+    
+    def _ensure(self, needed):
+        """Đảm bảo có ít nhất `needed` byte chưa đọc trong bộ đệm"""
+        available = self._end - self._start
+        if available >= needed:
+            return
+        
+        if not available:
+            # Bộ đệm đã đọc hết, nhận tiếp từ đầu
+            self._start = self._end = 0
+        if self._start + needed > len(self._buf):
+            # Dồn phần dữ liệu còn lại về đầu bộ đệm, mở rộng nếu cần
+            pending = bytes(self._view[self._start:self._end])
+            if needed > len(self._buf):
+                self._view.release()
+                self._buf = bytearray(max(needed, len(self._buf) * 2))
+                self._view = memoryview(self._buf)
+            self._view[:available] = pending
+            self._start = 0
+            self._end = available
+        
+        while self._end - self._start < needed:
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionError("Kết nối MikroTik API đã bị đóng")
+            self._end += received
+    
+    def _read_length(self):
+        """Giải mã tiền tố độ dài của một từ"""
+        self._ensure(1)
+        buf = self._buf
+        pos = self._start
+        first_byte = buf[pos]
+        
+        if first_byte < 0x80:
+            self._start = pos + 1
+            return first_byte
+        if first_byte < 0xC0:
+            self._ensure(2)
+            pos = self._start
+            self._start = pos + 2
+            return ((buf[pos] & 0x3F) << 8) | buf[pos + 1]
+        if first_byte < 0xE0:
+            self._ensure(3)
+            pos = self._start
+            self._start = pos + 3
+            return ((buf[pos] & 0x1F) << 16) | (buf[pos + 1] << 8) | buf[pos + 2]
+        if first_byte < 0xF0:
+            self._ensure(4)
+            pos = self._start
+            self._start = pos + 4
+            return int.from_bytes(self._buf[pos:pos + 4], 'big') & 0x0FFFFFFF
+        self._ensure(5)
+        pos = self._start
+        self._start = pos + 5
+        return int.from_bytes(self._buf[pos + 1:pos + 5], 'big')
+    
+    def read_word(self):
+        """Đọc một từ; trả về chuỗi rỗng khi gặp từ kết thúc câu"""
+        length = self._read_length()
+        if length == 0:
+            return ''
+        
+        self._ensure(length)
+        start = self._start
+        self._start = start + length
+        return str(self._view[start:start + length], 'utf-8')
+    
+    def read_sentence(self):
+        """Đọc các từ cho đến từ rỗng kết thúc câu"""
+        sentence = []
+        append = sentence.append
+        while True:
+            # Đường nhanh: giải mã liên tiếp các từ ngắn (độ dài 1 byte)
+            # đã nằm trọn trong bộ đệm mà không gọi thêm hàm
+            buf = self._buf
+            view = self._view
+            pos = self._start
+            end = self._end
+            while pos < end:
+                length = buf[pos]
+                if length >= 0x80 or pos + 1 + length > end:
+                    break
+                pos += 1
+                if not length:
+                    self._start = pos
+                    return sentence
+                append(str(view[pos:pos + length], 'utf-8'))
+                pos += length
+            self._start = pos
+            
+            # Đường chậm: từ dài hoặc bị cắt ngang giữa hai lần nhận
+            word = self.read_word()
+            if not word:
+                return sentence
+            append(word)
+
+
 class MikroTikAPI:
     """Lớp kết nối và tương tác với MikroTik API"""
     
@@ -22,6 +403,9 @@ class MikroTikAPI:
         self.port = port or (config.MIKROTIK_API_SSL_PORT if use_ssl else config.MIKROTIK_API_PORT)
         self.timeout = timeout
         self.sock = None
+        self._reader = None
+        self._tags = itertools.count(1)
+        self._pending = {}
         self.connected = False
         self.logger = logging.getLogger('mikrotik_api')
     
@@ -31,6 +415,8 @@ class MikroTikAPI:
             # Tạo socket
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(self.timeout)
+            # Mỗi câu lệnh đã được gửi trong một lần ghi, tắt Nagle để không bị trễ
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             # Sử dụng SSL nếu được yêu cầu
             if self.use_ssl:
@@ -64,8 +450,7 @@ class MikroTikAPI:
     def _login(self):
         """Đăng nhập vào MikroTik API"""
         # Gửi lệnh đăng nhập trống
-        self._send_word('/login')
-        self._send_word('')
+        self._send_sentence(['/login'])
         
         # Nhận challenge từ server
         response = self._get_response()
@@ -82,117 +467,47 @@ class MikroTikAPI:
         password_hash = binascii.hexlify(md5.digest())
         
         # Gửi tên đăng nhập và mật khẩu đã mã hóa
-        self._send_word('/login')
-        self._send_word(f'=name={self.username}')
-        self._send_word(f'=password={password_hash.decode("utf-8")}')
-        self._send_word('')
+        self._send_sentence([
+            '/login',
+            f'=name={self.username}',
+            f'=password={password_hash.decode("utf-8")}'
+        ])
         
         # Kiểm tra kết quả đăng nhập
         response = self._get_response()
-        if 'ret' in response:
+        if response['trap']:
             raise ValueError("Đăng nhập thất bại: Tên đăng nhập hoặc mật khẩu không chính xác")
     
-    def _send_word(self, word):
-        """Gửi một từ đến MikroTik API"""
+    def _send_sentence(self, words):
+        """Gửi một câu đến MikroTik API bằng một lần ghi duy nhất"""
         if not self.sock:
             raise ValueError("Chưa kết nối đến MikroTik API")
         
-        # Mã hóa độ dài từ
-        length = len(word)
-        if length < 0x80:
-            self.sock.send(length.to_bytes(1, byteorder='little'))
-        elif length < 0x4000:
-            length |= 0x8000
-            self.sock.send(length.to_bytes(2, byteorder='little'))
-        elif length < 0x200000:
-            length |= 0xC00000
-            self.sock.send(length.to_bytes(3, byteorder='little'))
-        elif length < 0x10000000:
-            length |= 0xE0000000
-            self.sock.send(length.to_bytes(4, byteorder='little'))
-        else:
-            self.sock.send(b'\xF0')
-            self.sock.send(length.to_bytes(4, byteorder='little'))
-        
-        # Gửi từ
-        self.sock.send(word.encode('utf-8'))
+        self.sock.sendall(encode_sentence(words))
     
     def _read_word(self):
         """Đọc một từ từ MikroTik API"""
         if not self.sock:
             raise ValueError("Chưa kết nối đến MikroTik API")
         
-        # Đọc byte đầu tiên để xác định độ dài
-        first_byte = self.sock.recv(1)
-        if not first_byte:
-            return ''
-        
-        first_byte = first_byte[0]
-        if first_byte < 0x80:
-            length = first_byte
-        elif first_byte < 0xC0:
-            second_byte = self.sock.recv(1)[0]
-            length = ((first_byte & 0x3F) << 8) + second_byte
-        elif first_byte < 0xE0:
-            length_bytes = self.sock.recv(2)
-            length = ((first_byte & 0x1F) << 16) + (length_bytes[0] << 8) + length_bytes[1]
-        elif first_byte < 0xF0:
-            length_bytes = self.sock.recv(3)
-            length = ((first_byte & 0x0F) << 24) + (length_bytes[0] << 16) + (length_bytes[1] << 8) + length_bytes[2]
-        else:
-            length_bytes = self.sock.recv(4)
-            length = (length_bytes[0] << 24) + (length_bytes[1] << 16) + (length_bytes[2] << 8) + length_bytes[3]
-        
-        # Nếu độ dài là 0, trả về chuỗi rỗng
-        if length == 0:
-            return ''
-        
-        # Đọc từ
-        word = b''
-        while len(word) < length:
-            chunk = self.sock.recv(length - len(word))
-            if not chunk:
-                break
-            word += chunk
-        
-        return word.decode('utf-8')
+        return self._get_reader().read_word()
+    
+    def _get_reader(self):
+        """Lấy bộ đệm nhận gắn với socket hiện tại (tạo lại sau mỗi lần kết nối)"""
+        if self._reader is None or self._reader.sock is not self.sock:
+            self._reader = ReceiveBuffer(self.sock)
+        return self._reader
     
     def _get_response(self):
         """Nhận phản hồi từ MikroTik API"""
-        response = {'re': [], 'ret': [], 'trap': [], 'done': False}
+        response = _new_response()
+        reader = self._get_reader()
         
-        # Đọc các từ cho đến khi nhận được !done
-        while True:
-            word = self._read_word()
-            
-            # Nếu từ rỗng, tiếp tục
-            if not word:
-                continue
-            
-            # Kiểm tra loại từ
-            if word.startswith('!re'):
-                response['re'].append({})
-                attrs = response['re'][-1]
-            elif word.startswith('!trap'):
-                response['trap'].append({})
-                attrs = response['trap'][-1]
-            elif word.startswith('!done'):
-                response['done'] = True
-                attrs = {}
-            else:
-                # Nếu từ này là giá trị cần lưu
-                if '=' in word:
-                    key, value = word.split('=', 1)
-                    if key.startswith('='):
-                        key = key[1:]
-                        if response['done']:
-                            response[key] = value
-                        else:
-                            attrs[key] = value
-            
-            # Nếu đã nhận được !done, dừng vòng lặp
-            if response['done']:
-                break
+        # Đọc từng câu cho đến khi nhận được !done
+        while not response['done']:
+            sentence = reader.read_sentence()
+            if sentence:
+                _add_reply(response, sentence[0], _parse_attributes(sentence))
         
         return response
     
@@ -202,17 +517,13 @@ class MikroTikAPI:
             if not self.connect():
                 raise ValueError("Không thể kết nối đến MikroTik API")
         
+        # Nhận nốt phản hồi của các lệnh có tag đang chờ trước khi gửi lệnh không tag
+        if self._pending:
+            self.collect_responses()
+        
         try:
-            # Gửi lệnh
-            self._send_word(command)
-            
-            # Gửi các tham số
-            if params:
-                for key, value in params.items():
-                    self._send_word(f'={key}={value}')
-            
-            # Kết thúc lệnh
-            self._send_word('')
+            # Gửi lệnh cùng các tham số trong một lần ghi
+            self._send_sentence(build_command_words(command, params))
             
             # Nhận phản hồi
             response = self._get_response()
@@ -233,39 +544,244 @@ class MikroTikAPI:
                 self.sock = None
             raise
     
+    def execute_batch(self, commands):
+        """Thực thi nhiều lệnh, gói tất cả các câu vào một lần ghi
+        
+        Args:
+            commands (list): Danh sách (command, params) hoặc chỉ tên lệnh
+            
+        Returns:
+            list: Phản hồi của từng lệnh theo đúng thứ tự gửi
+        """
+        if not self.connected:
+            if not self.connect():
+                raise ValueError("Không thể kết nối đến MikroTik API")
+        
+        commands = [(cmd, None) if isinstance(cmd, str) else cmd for cmd in commands]
+        if not commands:
+            return []
+        
+        try:
+            # Mã hóa tất cả các câu vào một bộ đệm và gửi một lần
+            payload = b''.join(
+                encode_sentence(build_command_words(command, params))
+                for command, params in commands
+            )
+            if not self.sock:
+                raise ValueError("Chưa kết nối đến MikroTik API")
+            self.sock.sendall(payload)
+            
+            # Đọc hết phản hồi để luồng dữ liệu không bị lệch, rồi mới báo lỗi
+            responses = [self._get_response() for _ in commands]
+            for (command, _), response in zip(commands, responses):
+                if response['trap']:
+                    error_message = response['trap'][0].get('message', 'Unknown error')
+                    self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {error_message}")
+                    raise ValueError(f"MikroTik API error: {error_message}")
+            
+            return responses
+        except Exception as e:
+            self.logger.error(f"Lỗi khi thực thi {len(commands)} lệnh theo lô: {str(e)}")
+            if isinstance(e, (socket.error, socket.timeout, OSError)):
+                self.connected = False
+                self.sock = None
+            raise
+    
+    def submit_commands(self, commands):
+        """Gửi nhiều lệnh có gắn .tag trong một lần ghi mà không chờ phản hồi
+        
+        Args:
+            commands (list): Danh sách (command, params) hoặc chỉ tên lệnh
+            
+        Returns:
+            list: Future của từng lệnh, hoàn tất khi collect_responses()
+                  nhận được !done tương ứng
+        """
+        if not self.connected:
+            if not self.connect():
+                raise ValueError("Không thể kết nối đến MikroTik API")
+        
+        futures = []
+        chunks = []
+        for command in commands:
+            command, params = (command, None) if isinstance(command, str) else command
+            tag = str(next(self._tags))
+            words = build_command_words(command, params)
+            words.append(f'.tag={tag}')
+            chunks.append(encode_sentence(words))
+            
+            future = Future()
+            self._pending[tag] = (command, future, _new_response())
+            futures.append(future)
+        
+        try:
+            if not self.sock:
+                raise ValueError("Chưa kết nối đến MikroTik API")
+            self.sock.sendall(b''.join(chunks))
+        except Exception as e:
+            self.logger.error(f"Lỗi khi gửi {len(futures)} lệnh có tag: {str(e)}")
+            self._abort_pending(e)
+            raise
+        
+        return futures
+    
+    def submit_command(self, command, params=None):
+        """Gửi một lệnh có gắn .tag và trả về Future của nó"""
+        return self.submit_commands([(command, params)])[0]
+    
+    def collect_responses(self, futures=None):
+        """Đọc phản hồi và phân phối theo .tag cho đến khi các Future hoàn tất
+        
+        Args:
+            futures (list): Các Future cần chờ; mặc định chờ mọi lệnh đang treo
+        """
+        reader = self._get_reader()
+        
+        try:
+            while self._pending:
+                if futures is not None and all(future.done() for future in futures):
+                    break
+                
+                sentence = reader.read_sentence()
+                if not sentence:
+                    continue
+                
+                self._dispatch_tagged(sentence)
+        except Exception as e:
+            self.logger.error(f"Lỗi khi nhận phản hồi các lệnh có tag: {str(e)}")
+            self._abort_pending(e)
+            raise
+    
+    def _dispatch_tagged(self, sentence):
+        """Gộp một câu trả lời có tag vào phản hồi của lệnh đang chờ tương ứng"""
+        reply = sentence[0]
+        attrs = _parse_attributes(sentence)
+        if reply == '!fatal':
+            raise ConnectionError(f"MikroTik API fatal: {' '.join(sentence[1:])}")
+        
+        tag = attrs.pop('.tag', None)
+        entry = self._pending.get(tag)
+        if entry is None:
+            self.logger.warning(f"Bỏ qua phản hồi với tag không xác định: {tag}")
+            return
+        
+        command, future, response = entry
+        _add_reply(response, reply, attrs)
+        if not response['done']:
+            return
+        
+        del self._pending[tag]
+        if response['trap']:
+            error_message = response['trap'][0].get('message', 'Unknown error')
+            self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {error_message}")
+            future.set_exception(ValueError(f"MikroTik API error: {error_message}"))
+        else:
+            future.set_result(response)
+    
+    def _abort_pending(self, error):
+        """Hủy mọi lệnh có tag đang chờ sau lỗi kết nối"""
+        for command, future, response in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        
+        if isinstance(error, (socket.error, socket.timeout, OSError)):
+            self.connected = False
+            self.sock = None
+    
+    def iter_command(self, command, params=None):
+        """Thực thi một lệnh và trả về từng dòng !re ngay khi được giải mã
+        
+        Khác với execute_command, phản hồi không được gom vào danh sách nên
+        bộ nhớ không tăng theo số dòng. Lệnh được gắn .tag riêng, vì vậy các
+        lệnh pipelined khác vẫn được phân phối về Future của chúng trong lúc
+        đọc. Nếu generator bị đóng giữa chừng, lệnh sẽ bị /cancel và phần
+        phản hồi còn lại được bỏ qua ở lần đọc sau.
+        """
+        if not self.connected:
+            if not self.connect():
+                raise ValueError("Không thể kết nối đến MikroTik API")
+        
+        tag = str(next(self._tags))
+        words = build_command_words(command, params)
+        words.append(f'.tag={tag}')
+        finished = False
+        
+        try:
+            self._send_sentence(words)
+            reader = self._get_reader()
+            error_message = None
+            
+            while True:
+                sentence = reader.read_sentence()
+                if not sentence:
+                    continue
+                
+                if f'.tag={tag}' not in sentence:
+                    self._dispatch_tagged(sentence)
+                    continue
+                
+                reply = sentence[0]
+                attrs = _parse_attributes(sentence)
+                attrs.pop('.tag', None)
+                if reply == '!re':
+                    yield attrs
+                elif reply == '!trap':
+                    error_message = attrs.get('message', 'Unknown error')
+                elif reply == '!done':
+                    finished = True
+                    break
+            
+            if error_message is not None:
+                self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {error_message}")
+                raise ValueError(f"MikroTik API error: {error_message}")
+        except GeneratorExit:
+            if not finished and self.sock:
+                self._cancel_tag(command, tag)
+            raise
+        except Exception as e:
+            if isinstance(e, (socket.error, socket.timeout, OSError)):
+                self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {str(e)}")
+                self._abort_pending(e)
+            raise
+    
+    def _cancel_tag(self, command, tag):
+        """Hủy một lệnh có tag; phản hồi còn lại sẽ được đọc và bỏ qua sau"""
+        cancel_tag = str(next(self._tags))
+        self._pending[tag] = (command, Future(), _new_response())
+        self._pending[cancel_tag] = ('/cancel', Future(), _new_response())
+        try:
+            self._send_sentence(['/cancel', f'=tag={tag}', f'.tag={cancel_tag}'])
+        except Exception as e:
+            self.logger.error(f"Lỗi khi hủy lệnh '{command}': {str(e)}")
+            self._abort_pending(e)
+    
+    def execute_pipelined(self, commands):
+        """Thực thi nhiều lệnh song song trên cùng một phiên (khoảng 1 RTT)
+        
+        Returns:
+            list: Phản hồi của từng lệnh theo thứ tự; lỗi !trap của lệnh nào
+                  sẽ được raise khi lấy kết quả lệnh đó
+        """
+        futures = self.submit_commands(commands)
+        self.collect_responses(futures)
+        return [future.result() for future in futures]
+    
     def get_device_info(self):
         """Lấy thông tin cơ bản về thiết bị"""
         try:
-            # Lấy thông tin hệ thống
-            system_response = self.execute_command('/system/resource/print')
+            # Lấy thông tin hệ thống, thiết bị và phiên bản trong một lượt
+            system_response, identity_response, version_response = self.execute_pipelined([
+                '/system/resource/print',
+                '/system/identity/print',
+                '/system/package/update/print'
+            ])
             system_info = system_response['re'][0] if system_response['re'] else {}
-            
-            # Lấy thông tin thiết bị
-            identity_response = self.execute_command('/system/identity/print')
             identity_info = identity_response['re'][0] if identity_response['re'] else {}
-            
-            # Lấy thông tin phiên bản
-            version_response = self.execute_command('/system/package/update/print')
             version_info = version_response['re'][0] if version_response['re'] else {}
             
             # Tổng hợp thông tin
-            device_info = {
-                'identity': identity_info.get('name', 'Unknown'),
-                'model': system_info.get('board-name', 'Unknown'),
-                'serial_number': system_info.get('serial-number', 'Unknown'),
-                'version': system_info.get('version', 'Unknown'),
-                'uptime': system_info.get('uptime', 'Unknown'),
-                'cpu_load': system_info.get('cpu-load', '0'),
-                'total_memory': int(system_info.get('total-memory', 0)),
-                'free_memory': int(system_info.get('free-memory', 0)),
-                'total_hdd_space': int(system_info.get('total-hdd-space', 0)),
-                'free_hdd_space': int(system_info.get('free-hdd-space', 0)),
-                'architecture': system_info.get('architecture-name', 'Unknown'),
-                'board': system_info.get('board-name', 'Unknown'),
-                'current_channel': version_info.get('channel', 'Unknown')
-            }
-            
-            return device_info
+            return _format_device_info(system_info, identity_info, version_info)
         except Exception as e:
             self.logger.error(f"Lỗi khi lấy thông tin thiết bị: {str(e)}")
             return {'error': str(e)}
@@ -273,45 +789,15 @@ class MikroTikAPI:
     def get_interfaces(self):
         """Lấy danh sách interfaces"""
         try:
-            # Lấy danh sách interfaces
-            interfaces_response = self.execute_command('/interface/print')
-            interfaces = []
-            
-            for interface_data in interfaces_response.get('re', []):
-                # Lấy thông tin cơ bản
-                interface = {
-                    'name': interface_data.get('name', 'Unknown'),
-                    'type': interface_data.get('type', 'Unknown'),
-                    'mac_address': interface_data.get('mac-address', 'Unknown'),
-                    'mtu': interface_data.get('mtu', '1500'),
-                    'actual_mtu': interface_data.get('actual-mtu', '1500'),
-                    'running': interface_data.get('running', 'false') == 'true',
-                    'disabled': interface_data.get('disabled', 'false') == 'true',
-                    'comment': interface_data.get('comment', '')
-                }
-                
-                # Thêm vào danh sách
-                interfaces.append(interface)
-            
-            # Lấy thông tin traffic cho các interfaces
-            traffic_response = self.execute_command('/interface/monitor-traffic', {
-                'interface': 'all',
-                'once': 'yes'
-            })
+            # Lấy danh sách interfaces và thông tin traffic trong một lượt
+            interfaces_response, traffic_response = self.execute_pipelined([
+                '/interface/print',
+                ('/interface/monitor-traffic', {'interface': 'all', 'once': 'yes'})
+            ])
+            interfaces = [_format_interface(row) for row in interfaces_response.get('re', [])]
             
             # Cập nhật thông tin traffic
-            for traffic_data in traffic_response.get('re', []):
-                if 'name' in traffic_data:
-                    interface_name = traffic_data['name']
-                    for interface in interfaces:
-                        if interface['name'] == interface_name:
-                            interface['rx_byte'] = traffic_data.get('rx-byte', '0')
-                            interface['tx_byte'] = traffic_data.get('tx-byte', '0')
-                            interface['rx_packet'] = traffic_data.get('rx-packet', '0')
-                            interface['tx_packet'] = traffic_data.get('tx-packet', '0')
-                            break
-            
-            return interfaces
+            return _apply_interface_traffic(interfaces, traffic_response.get('re', []))
         except Exception as e:
             self.logger.error(f"Lỗi khi lấy danh sách interfaces: {str(e)}")
             return []
@@ -319,84 +805,30 @@ class MikroTikAPI:
     def get_clients(self):
         """Lấy danh sách clients kết nối"""
         try:
-            clients = []
-            
-            # Lấy danh sách DHCP leases
-            dhcp_response = self.execute_command('/ip/dhcp-server/lease/print')
-            
-            for lease in dhcp_response.get('re', []):
-                client = {
-                    'hostname': lease.get('host-name', 'Unknown'),
-                    'ip_address': lease.get('address', 'Unknown'),
-                    'mac_address': lease.get('mac-address', 'Unknown'),
-                    'client_id': lease.get('client-id', ''),
-                    'status': 'active' if lease.get('status', '') == 'bound' else 'inactive',
-                    'expires': lease.get('expires-after', 'Unknown'),
-                    'type': 'dhcp',
-                    'comment': lease.get('comment', '')
-                }
-                clients.append(client)
+            table = _ClientTable()
             
-            # Lấy danh sách wireless clients
-            wireless_response = self.execute_command('/interface/wireless/registration-table/print')
+            # Gửi trước các lệnh lấy wireless clients và bảng ARP, sau đó đọc
+            # DHCP leases theo từng dòng trong khi các phản hồi kia đang về
+            wireless_future, arp_future = self.submit_commands([
+                '/interface/wireless/registration-table/print',
+                '/ip/arp/print'
+            ])
             
-            for client in wireless_response.get('re', []):
-                # Tìm thông tin DHCP tương ứng
-                mac = client.get('mac-address', '')
-                existing_client = next((c for c in clients if c['mac_address'] == mac), None)
-                
-                if existing_client:
-                    # Cập nhật thông tin wireless
-                    existing_client['connection_type'] = 'wireless'
-                    existing_client['interface'] = client.get('interface', 'Unknown')
-                    existing_client['signal_strength'] = client.get('signal-strength', '0')
-                    existing_client['tx_rate'] = client.get('tx-rate', '0')
-                    existing_client['rx_rate'] = client.get('rx-rate', '0')
-                else:
-                    # Thêm client mới
-                    new_client = {
-                        'hostname': 'Unknown',
-                        'ip_address': 'Unknown',
-                        'mac_address': mac,
-                        'status': 'active',
-                        'connection_type': 'wireless',
-                        'interface': client.get('interface', 'Unknown'),
-                        'signal_strength': client.get('signal-strength', '0'),
-                        'tx_rate': client.get('tx-rate', '0'),
-                        'rx_rate': client.get('rx-rate', '0'),
-                        'type': 'wireless'
-                    }
-                    clients.append(new_client)
+            # Danh sách DHCP leases
+            for lease in self.iter_command('/ip/dhcp-server/lease/print'):
+                table.add_lease(lease)
+            
+            self.collect_responses([wireless_future, arp_future])
+            
+            # Danh sách wireless clients
+            for client in wireless_future.result().get('re', []):
+                table.add_registration(client)
             
             # Cập nhật thông tin từ bảng ARP
-            arp_response = self.execute_command('/ip/arp/print')
+            for arp in arp_future.result().get('re', []):
+                table.add_arp(arp)
             
-            for arp in arp_response.get('re', []):
-                mac = arp.get('mac-address', '')
-                ip = arp.get('address', '')
-                existing_client = next((c for c in clients if c['mac_address'] == mac), None)
-                
-                if existing_client and existing_client['ip_address'] == 'Unknown':
-                    existing_client['ip_address'] = ip
-                    existing_client['interface'] = arp.get('interface', 'Unknown')
-                elif not existing_client and mac and ip:
-                    # Thêm client mới từ bảng ARP
-                    new_client = {
-                        'hostname': 'Unknown',
-                        'ip_address': ip,
-                        'mac_address': mac,
-                        'status': 'active' if arp.get('complete', 'false') == 'true' else 'inactive',
-                        'connection_type': 'wired',
-                        'interface': arp.get('interface', 'Unknown'),
-                        'type': 'arp'
-                    }
-                    clients.append(new_client)
-            
-            # Thêm ID duy nhất cho mỗi client
-            for i, client in enumerate(clients):
-                client['id'] = f"client{i+1}"
-            
-            return clients
+            return table.to_list()
         except Exception as e:
             self.logger.error(f"Lỗi khi lấy danh sách clients: {str(e)}")
             return []
@@ -405,47 +837,10 @@ class MikroTikAPI:
         """Lấy danh sách firewall rules"""
         try:
             # Lấy danh sách filter rules
-            filter_response = self.execute_command('/ip/firewall/filter/print')
-            rules = []
-            
-            for rule in filter_response.get('re', []):
-                # Chuẩn bị rule data
-                rule_data = {
-                    'id': rule.get('.id', 'Unknown'),
-                    'chain': rule.get('chain', 'Unknown'),
-                    'action': rule.get('action', 'Unknown'),
-                    'protocol': rule.get('protocol', 'any'),
-                    'src_address': rule.get('src-address', ''),
-                    'dst_address': rule.get('dst-address', ''),
-                    'src_port': rule.get('src-port', ''),
-                    'dst_port': rule.get('dst-port', ''),
-                    'comment': rule.get('comment', ''),
-                    'disabled': rule.get('disabled', 'false') == 'true',
-                    'type': 'filter'
-                }
-                
-                rules.append(rule_data)
+            rules = [_format_filter_rule(rule) for rule in self.iter_command('/ip/firewall/filter/print')]
             
             # Lấy danh sách NAT rules
-            nat_response = self.execute_command('/ip/firewall/nat/print')
-            
-            for rule in nat_response.get('re', []):
-                # Chuẩn bị rule data
-                rule_data = {
-                    'id': rule.get('.id', 'Unknown'),
-                    'chain': rule.get('chain', 'Unknown'),
-                    'action': rule.get('action', 'Unknown'),
-                    'protocol': rule.get('protocol', 'any'),
-                    'src_address': rule.get('src-address', ''),
-                    'dst_address': rule.get('dst-address', ''),
-                    'to_addresses': rule.get('to-addresses', ''),
-                    'to_ports': rule.get('to-ports', ''),
-                    'comment': rule.get('comment', ''),
-                    'disabled': rule.get('disabled', 'false') == 'true',
-                    'type': 'nat'
-                }
-                
-                rules.append(rule_data)
+            rules.extend(_format_nat_rule(rule) for rule in self.iter_command('/ip/firewall/nat/print'))
             
             return rules
         except Exception as e:
@@ -457,23 +852,7 @@ class MikroTikAPI:
         try:
             # Lấy danh sách địa chỉ IP
             ip_response = self.execute_command('/ip/address/print')
-            addresses = []
-            
-            for addr in ip_response.get('re', []):
-                # Chuẩn bị dữ liệu địa chỉ IP
-                address_data = {
-                    'id': addr.get('.id', 'Unknown'),
-                    'address': addr.get('address', 'Unknown'),
-                    'network': addr.get('network', ''),
-                    'interface': addr.get('interface', 'Unknown'),
-                    'type': 'static' if 'dynamic' not in addr else 'dynamic',
-                    'status': 'active' if addr.get('disabled', 'false') == 'false' else 'inactive',
-                    'comment': addr.get('comment', '')
-                }
-                
-                addresses.append(address_data)
-            
-            return addresses
+            return [_format_ip_address(addr) for addr in ip_response.get('re', [])]
         except Exception as e:
             self.logger.error(f"Lỗi khi lấy danh sách địa chỉ IP: {str(e)}")
             return []
@@ -514,6 +893,23 @@ class MikroTikAPI:
             self.logger.error(f"Lỗi khi block client: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    def add_to_address_list(self, addresses, list_name='blocked', comment=None):
+        """Thêm nhiều địa chỉ vào address list trong một lần ghi"""
+        try:
+            if not comment:
+                comment = f"Added by MikroTik MSC on {time.strftime('%Y-%m-%d %H:%M:%S')}"
+            
+            commands = [
+                ('/ip/firewall/address-list/add', {'list': list_name, 'address': address, 'comment': comment})
+                for address in addresses
+            ]
+            self.execute_batch(commands)
+            
+            return {'success': True, 'count': len(commands)}
+        except Exception as e:
+            self.logger.error(f"Lỗi khi thêm địa chỉ vào address list {list_name}: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
     def unblock_client(self, ip_address=None, mac_address=None):
         """Unblock một client"""
         try:
@@ -615,24 +1011,8 @@ class MikroTikAPI:
     def get_logs(self, topics=None, limit=50):
         """Lấy logs từ thiết bị"""
         try:
-            params = {}
-            if topics:
-                params['topics'] = ','.join(topics)
-            if limit:
-                params['limit'] = str(limit)
-            
-            logs_response = self.execute_command('/log/print', params)
-            logs = []
-            
-            for log in logs_response.get('re', []):
-                log_entry = {
-                    'time': log.get('time', 'Unknown'),
-                    'topics': log.get('topics', '').split(','),
-                    'message': log.get('message', 'Unknown')
-                }
-                logs.append(log_entry)
-            
-            return logs
+            logs_response = self.execute_command('/log/print', _log_params(topics, limit))
+            return [_format_log(log) for log in logs_response.get('re', [])]
         except Exception as e:
             self.logger.error(f"Lỗi khi lấy logs: {str(e)}")
             return []
\ No newline at end of file
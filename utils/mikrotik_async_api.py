@@ -0,0 +1,430 @@
+"""
+Module kết nối bất đồng bộ (asyncio) với MikroTik API
+"""
+
+import ssl
+import asyncio
+import hashlib
+import binascii
+import itertools
+import logging
+import config
+from utils.mikrotik_api import (
+    encode_sentence,
+    build_command_words,
+    _parse_attributes,
+    _add_reply,
+    _new_response,
+    _format_device_info,
+    _format_interface,
+    _apply_interface_traffic,
+    _format_filter_rule,
+    _format_nat_rule,
+    _format_ip_address,
+    _format_log,
+    _log_params,
+    _ClientTable
+)
+
+
+def _discard_result(future):
+    """Callback lấy kết quả của future không ai chờ (tránh cảnh báo asyncio)"""
+    if not future.cancelled():
+        future.exception()
+
+
+class AsyncMikroTikAPI:
+    """Lớp kết nối MikroTik API dùng asyncio StreamReader/StreamWriter
+    
+    Mọi lệnh đều được gắn .tag nên nhiều coroutine có thể dùng chung một
+    phiên; một task nền đọc phản hồi và chuyển về đúng lệnh theo tag.
+    Bề mặt phương thức tương thích với MikroTikAPI (get_interfaces,
+    get_clients, ...) nhưng phải được await.
+
+    Chưa được dùng trong các ứng dụng FastAPI của mikrotik-msc: đó là cây mã
+    đóng gói riêng (import phẳng, không có module config của ứng dụng chính)
+    và phiên routeros_api ở đó được dùng chung với thread giám sát và các
+    module quản lý (mikrotik_site_manager.SiteSession), nên chuyển handler
+    sang client này đồng nghĩa với mở thêm một lần đăng nhập cho mỗi router.
+    """
+    
+    def __init__(self, host, username, password, port=None, use_ssl=False, timeout=10):
+        """Khởi tạo kết nối MikroTik API"""
+        self.host = host
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.port = port or (config.MIKROTIK_API_SSL_PORT if use_ssl else config.MIKROTIK_API_PORT)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self._tags = itertools.count(1)
+        self._pending = {}
+        self._read_task = None
+        self.logger = logging.getLogger('mikrotik_async_api')
+    
+    async def __aenter__(self):
+        if not await self.connect():
+            raise ValueError("Không thể kết nối đến MikroTik API")
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+    
+    async def connect(self):
+        """Kết nối và đăng nhập vào MikroTik API"""
+        if self.writer:
+            await self._close()
+        
+        try:
+            ssl_context = None
+            if self.use_ssl:
+                ssl_context = ssl.create_default_context()
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+                timeout=self.timeout
+            )
+            self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+            
+            # Đăng nhập
+            await self._login()
+            self.connected = True
+            self.logger.info(f"Đã kết nối thành công đến MikroTik tại {self.host}:{self.port}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Lỗi kết nối đến MikroTik: {str(e)}")
+            await self._close()
+            return False
+    
+    async def disconnect(self):
+        """Ngắt kết nối khỏi MikroTik API"""
+        if self.writer:
+            await self._close()
+            self.logger.info(f"Đã ngắt kết nối khỏi MikroTik tại {self.host}")
+    
+    async def _close(self):
+        """Đóng socket, dừng task đọc và hủy các lệnh đang chờ"""
+        self.connected = False
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+            self.reader = None
+        self._abort_pending(ConnectionError("Đã ngắt kết nối khỏi MikroTik API"))
+    
+    async def _login(self):
+        """Đăng nhập (RouterOS >= 6.43), tự chuyển sang challenge MD5 với bản cũ"""
+        response = await self.execute_command('/login', {
+            'name': self.username,
+            'password': self.password
+        })
+        if not response['ret']:
+            return
+        
+        # Thiết bị cũ trả về challenge thay vì đăng nhập ngay
+        challenge = binascii.unhexlify(response['ret'][0])
+        md5 = hashlib.md5()
+        md5.update(b'\x00')
+        md5.update(self.password.encode('utf-8'))
+        md5.update(challenge)
+        await self.execute_command('/login', {
+            'name': self.username,
+            'response': '00' + md5.hexdigest()
+        })
+    
+    async def _read_word(self):
+        """Đọc một từ từ luồng dữ liệu"""
+        first_byte = (await self.reader.readexactly(1))[0]
+        if first_byte < 0x80:
+            length = first_byte
+        elif first_byte < 0xC0:
+            length = ((first_byte & 0x3F) << 8) | (await self.reader.readexactly(1))[0]
+        elif first_byte < 0xE0:
+            length = ((first_byte & 0x1F) << 16) | int.from_bytes(await self.reader.readexactly(2), 'big')
+        elif first_byte < 0xF0:
+            length = ((first_byte & 0x0F) << 24) | int.from_bytes(await self.reader.readexactly(3), 'big')
+        else:
+            length = int.from_bytes(await self.reader.readexactly(4), 'big')
+        
+        if length == 0:
+            return ''
+        return (await self.reader.readexactly(length)).decode('utf-8')
+    
+    async def _read_sentence(self):
+        """Đọc các từ cho đến từ rỗng kết thúc câu"""
+        sentence = []
+        while True:
+            word = await self._read_word()
+            if not word:
+                return sentence
+            sentence.append(word)
+    
+    async def _read_loop(self):
+        """Task nền đọc phản hồi và phân phối theo .tag"""
+        try:
+            while True:
+                sentence = await self._read_sentence()
+                if not sentence:
+                    continue
+                
+                reply = sentence[0]
+                attrs = _parse_attributes(sentence)
+                if reply == '!fatal':
+                    raise ConnectionError(f"MikroTik API fatal: {' '.join(sentence[1:])}")
+                
+                self._dispatch(reply, attrs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                self.logger.error(f"Lỗi khi đọc phản hồi từ MikroTik: {str(e)}")
+            self.connected = False
+            self._abort_pending(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+    
+    def _dispatch(self, reply, attrs):
+        """Chuyển một câu trả lời về lệnh đang chờ có cùng tag"""
+        tag = attrs.pop('.tag', None)
+        entry = self._pending.get(tag)
+        if entry is None:
+            self.logger.warning(f"Bỏ qua phản hồi với tag không xác định: {tag}")
+            return
+        
+        command, future, response, queue = entry
+        if queue is not None:
+            # Lệnh dạng stream: chuyển từng dòng cho iter_command
+            if reply == '!re':
+                queue.put_nowait(('re', attrs))
+            elif reply == '!trap':
+                queue.put_nowait(('trap', attrs.get('message', 'Unknown error')))
+            elif reply == '!done':
+                del self._pending[tag]
+                queue.put_nowait(('done', None))
+            return
+        
+        _add_reply(response, reply, attrs)
+        if not response['done']:
+            return
+        
+        del self._pending[tag]
+        if future.done():
+            return
+        if response['trap']:
+            error_message = response['trap'][0].get('message', 'Unknown error')
+            self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {error_message}")
+            future.set_exception(ValueError(f"MikroTik API error: {error_message}"))
+        else:
+            future.set_result(response)
+    
+    def _abort_pending(self, error):
+        """Báo lỗi cho mọi lệnh đang chờ"""
+        for command, future, response, queue in self._pending.values():
+            if queue is not None:
+                queue.put_nowait(('error', error))
+            elif not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+    
+    async def _submit(self, command, params=None, proplist=None, queue=None):
+        """Gửi một lệnh có tag và đăng ký nơi nhận phản hồi"""
+        if not self.writer:
+            raise ValueError("Chưa kết nối đến MikroTik API")
+        
+        tag = str(next(self._tags))
+        words = build_command_words(command, params)
+        if proplist:
+            words.append(f"=.proplist={','.join(proplist)}")
+        words.append(f'.tag={tag}')
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = (command, future, _new_response(), queue)
+        self.writer.write(encode_sentence(words))
+        await self.writer.drain()
+        return tag, future
+    
+    async def _cancel(self, tag):
+        """Hủy một lệnh đang chạy; phần phản hồi còn lại sẽ bị bỏ qua
+        
+        Lệnh đã nhận !done (task đọc đã xóa tag khỏi _pending) thì không gửi
+        /cancel, tránh lỗi "unknown tag" từ thiết bị.
+        """
+        if not self.writer or tag not in self._pending:
+            return
+        try:
+            _, future = await self._submit('/cancel', {'tag': tag})
+        except Exception as e:
+            self.logger.error(f"Lỗi khi hủy lệnh có tag {tag}: {str(e)}")
+            return
+        # Không chờ phản hồi của /cancel, chỉ lấy kết quả để không bị báo lỗi chưa đọc
+        future.add_done_callback(_discard_result)
+    
+    async def _ensure_connected(self):
+        if not self.connected:
+            if not await self.connect():
+                raise ValueError("Không thể kết nối đến MikroTik API")
+    
+    async def execute_command(self, command, params=None, proplist=None):
+        """Thực thi một lệnh MikroTik API
+        
+        Args:
+            command (str): Đường dẫn lệnh, ví dụ '/interface/print'
+            params (dict): Tham số của lệnh
+            proplist (list): Chỉ lấy các thuộc tính này (=.proplist=)
+        """
+        if command != '/login':
+            await self._ensure_connected()
+        
+        try:
+            tag, future = await self._submit(command, params, proplist)
+            try:
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                await self._cancel(tag)
+                raise
+        except asyncio.TimeoutError:
+            # Chỉ lệnh này hết thời gian chờ: giữ phiên cho các lệnh khác đang chạy
+            # (từ Python 3.11 TimeoutError là lớp con của OSError)
+            self.logger.error(f"Hết thời gian chờ lệnh '{command}' ({self.timeout}s)")
+            raise
+        except Exception as e:
+            self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {str(e)}")
+            if isinstance(e, (ConnectionError, OSError)):
+                await self._close()
+            raise
+    
+    async def execute_pipelined(self, commands):
+        """Thực thi đồng thời nhiều lệnh trên cùng một phiên
+        
+        Args:
+            commands (list): Danh sách (command, params) hoặc chỉ tên lệnh
+        """
+        commands = [(cmd, None) if isinstance(cmd, str) else cmd for cmd in commands]
+        return await asyncio.gather(*(self.execute_command(command, params) for command, params in commands))
+    
+    async def iter_command(self, command, params=None, proplist=None):
+        """Thực thi một lệnh và trả về từng dòng !re ngay khi nhận được
+        
+        Nếu dừng vòng lặp sớm (break), hãy dùng contextlib.aclosing() để lệnh
+        được /cancel ngay; nếu không, việc hủy chỉ diễn ra khi generator được
+        dọn dẹp. Lệnh đã nhận !done thì không bị hủy nữa.
+        """
+        await self._ensure_connected()
+        
+        queue = asyncio.Queue()
+        tag, _ = await self._submit(command, params, proplist, queue=queue)
+        finished = False
+        error_message = None
+        
+        try:
+            while True:
+                kind, payload = await asyncio.wait_for(queue.get(), timeout=self.timeout)
+                if kind == 're':
+                    yield payload
+                elif kind == 'trap':
+                    error_message = payload
+                elif kind == 'error':
+                    finished = True
+                    raise payload
+                else:
+                    finished = True
+                    break
+            
+            if error_message is not None:
+                self.logger.error(f"Lỗi khi thực thi lệnh '{command}': {error_message}")
+                raise ValueError(f"MikroTik API error: {error_message}")
+        finally:
+            if not finished:
+                await self._cancel(tag)
+    
+    async def get_device_info(self):
+        """Lấy thông tin cơ bản về thiết bị"""
+        try:
+            system_response, identity_response, version_response = await self.execute_pipelined([
+                '/system/resource/print',
+                '/system/identity/print',
+                '/system/package/update/print'
+            ])
+            system_info = system_response['re'][0] if system_response['re'] else {}
+            identity_info = identity_response['re'][0] if identity_response['re'] else {}
+            version_info = version_response['re'][0] if version_response['re'] else {}
+            
+            return _format_device_info(system_info, identity_info, version_info)
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy thông tin thiết bị: {str(e)}")
+            return {'error': str(e)}
+    
+    async def get_interfaces(self):
+        """Lấy danh sách interfaces"""
+        try:
+            interfaces_response, traffic_response = await self.execute_pipelined([
+                '/interface/print',
+                ('/interface/monitor-traffic', {'interface': 'all', 'once': 'yes'})
+            ])
+            interfaces = [_format_interface(row) for row in interfaces_response.get('re', [])]
+            return _apply_interface_traffic(interfaces, traffic_response.get('re', []))
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy danh sách interfaces: {str(e)}")
+            return []
+    
+    async def get_clients(self):
+        """Lấy danh sách clients kết nối"""
+        try:
+            dhcp_response, wireless_response, arp_response = await self.execute_pipelined([
+                '/ip/dhcp-server/lease/print',
+                '/interface/wireless/registration-table/print',
+                '/ip/arp/print'
+            ])
+            
+            table = _ClientTable()
+            for lease in dhcp_response.get('re', []):
+                table.add_lease(lease)
+            for client in wireless_response.get('re', []):
+                table.add_registration(client)
+            for arp in arp_response.get('re', []):
+                table.add_arp(arp)
+            
+            return table.to_list()
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy danh sách clients: {str(e)}")
+            return []
+    
+    async def get_firewall_rules(self):
+        """Lấy danh sách firewall rules"""
+        try:
+            filter_response, nat_response = await self.execute_pipelined([
+                '/ip/firewall/filter/print',
+                '/ip/firewall/nat/print'
+            ])
+            rules = [_format_filter_rule(rule) for rule in filter_response.get('re', [])]
+            rules.extend(_format_nat_rule(rule) for rule in nat_response.get('re', []))
+            return rules
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy danh sách firewall rules: {str(e)}")
+            return []
+    
+    async def get_ip_addresses(self):
+        """Lấy danh sách địa chỉ IP"""
+        try:
+            ip_response = await self.execute_command('/ip/address/print')
+            return [_format_ip_address(addr) for addr in ip_response.get('re', [])]
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy danh sách địa chỉ IP: {str(e)}")
+            return []
+    
+    async def get_logs(self, topics=None, limit=50):
+        """Lấy logs từ thiết bị"""
+        try:
+            logs_response = await self.execute_command('/log/print', _log_params(topics, limit))
+            return [_format_log(log) for log in logs_response.get('re', [])]
+        except Exception as e:
+            self.logger.error(f"Lỗi khi lấy logs: {str(e)}")
+            return []
@@ -0,0 +1,237 @@
+"""
+Module pool kết nối RouterOS dùng chung trong toàn tiến trình
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+
+def _is_trap_error(error: Exception) -> bool:
+    """Lỗi !trap từ thiết bị không làm hỏng phiên, có thể tái sử dụng kết nối"""
+    try:
+        from librouteros.exceptions import TrapError, MultiTrapError
+        return isinstance(error, (TrapError, MultiTrapError))
+    except ImportError:
+        return False
+
+
+def _default_health_check(api) -> None:
+    """Lệnh kiểm tra kết nối còn sống"""
+    api.path('/system/identity').get()
+
+
+class PooledConnection:
+    """Một kết nối trong pool cùng các mốc thời gian của nó"""
+    
+    def __init__(self, api):
+        self.api = api
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class RouterOSConnectionPool:
+    """Pool kết nối RouterOS có giới hạn, an toàn đa luồng
+    
+    - Tối đa `max_size` kết nối (đang dùng + đang mở) cho mỗi thiết bị
+    - Kết nối nhàn rỗi quá `idle_timeout` giây bị đóng
+    - Kết nối sống quá `max_lifetime` giây được thay mới khi trả về pool
+    - Kết nối nhàn rỗi quá `health_check_interval` giây được kiểm tra
+      bằng một lệnh nhẹ trước khi giao cho người dùng
+    """
+    
+    def __init__(self, factory: Callable[[], Any], name: str = 'mikrotik',
+                 max_size: int = 4, idle_timeout: float = 300,
+                 max_lifetime: float = 3600, health_check_interval: float = 30,
+                 checkout_timeout: float = 10,
+                 health_check: Optional[Callable[[Any], None]] = None):
+        self.factory = factory
+        self.name = name
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check or _default_health_check
+        
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._in_use = 0
+        self._opening = 0
+        self._metrics = {
+            'checkouts': 0,
+            'checkout_timeouts': 0,
+            'checkout_wait_total': 0.0,
+            'checkout_wait_max': 0.0,
+            'created': 0,
+            'connect_failures': 0,
+            'closed_idle': 0,
+            'closed_expired': 0,
+            'closed_broken': 0,
+            'health_check_failures': 0
+        }
+    
+    def _expired(self, conn: PooledConnection, now: float) -> bool:
+        return now - conn.created_at >= self.max_lifetime
+    
+    def _evict_locked(self, now: float) -> list:
+        """Tách các kết nối nhàn rỗi quá hạn ra khỏi pool (gọi khi đang giữ lock)"""
+        keep, evicted = [], []
+        for conn in self._idle:
+            if now - conn.last_used >= self.idle_timeout:
+                self._metrics['closed_idle'] += 1
+                evicted.append(conn)
+            elif self._expired(conn, now):
+                self._metrics['closed_expired'] += 1
+                evicted.append(conn)
+            else:
+                keep.append(conn)
+        self._idle = keep
+        return evicted
+    
+    @staticmethod
+    def _close(conns) -> None:
+        for conn in conns:
+            try:
+                conn.api.close()
+            except Exception as e:
+                logger.debug(f"Lỗi khi đóng kết nối: {str(e)}")
+    
+    def acquire(self) -> Optional[PooledConnection]:
+        """Mượn một kết nối; trả về None nếu không thể kết nối hoặc hết thời gian chờ"""
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        
+        while True:
+            conn = None
+            timed_out = False
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    evicted = self._evict_locked(now)
+                    if self._idle:
+                        # LIFO: dùng lại kết nối vừa trả để các kết nối cũ được nhàn rỗi và bị đóng
+                        conn = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._in_use + self._opening < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._metrics['checkout_timeouts'] += 1
+                        timed_out = True
+                        break
+                    self._cond.wait(remaining)
+            self._close(evicted)
+            
+            if timed_out:
+                logger.warning(f"Hết thời gian chờ kết nối từ pool {self.name}")
+                return None
+            if conn is None:
+                conn = self._open()
+                if conn is None:
+                    return None
+            elif now - conn.last_used >= self.health_check_interval and not self._healthy(conn):
+                continue
+            
+            waited = time.monotonic() - start
+            with self._cond:
+                self._metrics['checkouts'] += 1
+                self._metrics['checkout_wait_total'] += waited
+                self._metrics['checkout_wait_max'] = max(self._metrics['checkout_wait_max'], waited)
+            return conn
+    
+    def _open(self) -> Optional[PooledConnection]:
+        """Mở kết nối mới ngoài lock (đã giữ chỗ bằng self._opening)"""
+        api = None
+        try:
+            api = self.factory()
+        finally:
+            with self._cond:
+                self._opening -= 1
+                if api is None:
+                    self._metrics['connect_failures'] += 1
+                    self._cond.notify()
+                else:
+                    self._metrics['created'] += 1
+                    self._in_use += 1
+        return PooledConnection(api) if api is not None else None
+    
+    def _healthy(self, conn: PooledConnection) -> bool:
+        """Kiểm tra kết nối nhàn rỗi lâu; kết nối hỏng bị đóng và trả chỗ cho pool"""
+        try:
+            self.health_check(conn.api)
+            return True
+        except Exception as e:
+            logger.info(f"Kết nối trong pool {self.name} không còn hoạt động: {str(e)}")
+            with self._cond:
+                self._metrics['health_check_failures'] += 1
+            self.release(conn, broken=True)
+            return False
+    
+    def release(self, conn: PooledConnection, broken: bool = False) -> None:
+        """Trả kết nối về pool, đóng nếu đã hỏng hoặc quá tuổi thọ"""
+        now = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._metrics['closed_broken'] += 1
+                discard = True
+            elif self._expired(conn, now):
+                self._metrics['closed_expired'] += 1
+                discard = True
+            else:
+                conn.last_used = now
+                self._idle.append(conn)
+                discard = False
+            self._cond.notify()
+        if discard:
+            self._close([conn])
+    
+    @contextmanager
+    def connection(self):
+        """Context manager mượn kết nối; nhận None nếu không thể kết nối
+        
+        Kết nối được coi là hỏng và bị đóng nếu khối lệnh ném ra lỗi khác
+        lỗi !trap của thiết bị.
+        """
+        conn = self.acquire()
+        if conn is None:
+            yield None
+            return
+        
+        broken = False
+        try:
+            yield conn.api
+        except Exception as e:
+            broken = not _is_trap_error(e)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+    
+    def close_all(self) -> None:
+        """Đóng mọi kết nối nhàn rỗi"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        self._close(idle)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê pool và số liệu mượn kết nối"""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update({
+                'name': self.name,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'opening': self._opening
+            })
+        checkouts = stats['checkouts']
+        stats['checkout_wait_avg'] = stats['checkout_wait_total'] / checkouts if checkouts else 0.0
+        return stats
@@ -6,33 +6,49 @@ import os
 import time
 import logging
 import datetime
-import sqlite3
-from typing import Optional, Dict, List, Any, Tuple
+import threading
+from typing import Callable, Iterable, Optional, Dict, List, Any, Set, Tuple
+
+from utils import ip_monitoring
+from utils.downsample import MINMAX_PRESELECT_RATIO, downsample_points
+from utils.liveness import ArpTableBackend, IcmpDatagramBackend, LivenessProber, host_address
+from utils.mikrotik_pool import RouterOSConnectionPool
 
 # Khởi tạo logger
 logger = logging.getLogger(__name__)
 
-def get_mikrotik_connection(max_retries=3, retry_delay=2):
-    """Lấy kết nối đến thiết bị MikroTik với cơ chế retry
+def _connection_settings() -> Dict[str, Any]:
+    """Đọc thông tin kết nối MikroTik từ biến môi trường"""
+    return {
+        'host': os.getenv('MIKROTIK_HOST', '192.168.88.1'),
+        'username': os.getenv('MIKROTIK_USERNAME', 'admin'),
+        'password': os.getenv('MIKROTIK_PASSWORD', ''),
+        'port': int(os.getenv('MIKROTIK_API_PORT', 8728)),
+        'timeout': int(os.getenv('MIKROTIK_TIMEOUT', 10))
+    }
+
+def get_mikrotik_connection(max_retries=3, retry_delay=2, settings=None):
+    """Mở một kết nối mới đến thiết bị MikroTik với cơ chế retry
+    
+    Hàm này luôn mở phiên mới; mã xử lý yêu cầu nên mượn kết nối qua
+    mikrotik_connection() để dùng lại phiên từ pool.
     
     Args:
         max_retries (int): Số lần thử lại tối đa
         retry_delay (int): Thời gian chờ giữa các lần thử (giây)
+        settings (dict): Thông tin kết nối, mặc định lấy từ biến môi trường
         
     Returns:
         RouterOS API object hoặc None nếu không thể kết nối
     """
     try:
         from librouteros import connect
-        from librouteros.query import Key
         from librouteros.exceptions import ConnectionError, LoginError
         
-        # Lấy thông tin kết nối từ biến môi trường
-        host = os.getenv('MIKROTIK_HOST', '192.168.88.1')
-        username = os.getenv('MIKROTIK_USERNAME', 'admin')
-        password = os.getenv('MIKROTIK_PASSWORD', '')
-        port = int(os.getenv('MIKROTIK_API_PORT', 8728))
-        timeout = int(os.getenv('MIKROTIK_TIMEOUT', 10))
+        # Lấy thông tin kết nối
+        settings = settings or _connection_settings()
+        host = settings['host']
+        port = settings['port']
         
         # Thử kết nối với số lần thử lại
         retry_count = 0
@@ -42,11 +58,11 @@ def get_mikrotik_connection(max_retries=3, retry_delay=2):
             try:
                 # Kết nối đến thiết bị với timeout
                 api = connect(
-                    username=username,
-                    password=password,
+                    username=settings['username'],
+                    password=settings['password'],
                     host=host,
                     port=port,
-                    timeout=timeout
+                    timeout=settings['timeout']
                 )
                 
                 # Thực hiện một câu lệnh đơn giản để kiểm tra kết nối
@@ -73,12 +89,53 @@ def get_mikrotik_connection(max_retries=3, retry_delay=2):
         logger.error(f"Lỗi khi kết nối đến MikroTik: {str(e)}")
         return None
 
-def get_mac_address(interface: str) -> Optional[str]:
+# Pool kết nối theo (host, port, username), dùng chung trong toàn tiến trình
+_pools: Dict[Tuple[str, int, str], RouterOSConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(settings: Optional[Dict[str, Any]] = None) -> RouterOSConnectionPool:
+    """Lấy (hoặc tạo) pool kết nối cho thiết bị MikroTik"""
+    settings = settings or _connection_settings()
+    key = (settings['host'], settings['port'], settings['username'])
+    
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = RouterOSConnectionPool(
+                factory=lambda: get_mikrotik_connection(settings=settings),
+                name=f"{settings['username']}@{settings['host']}:{settings['port']}",
+                max_size=int(os.getenv('MIKROTIK_POOL_SIZE', 4)),
+                idle_timeout=float(os.getenv('MIKROTIK_POOL_IDLE_TIMEOUT', 300)),
+                max_lifetime=float(os.getenv('MIKROTIK_POOL_MAX_LIFETIME', 3600)),
+                checkout_timeout=settings['timeout']
+            )
+            _pools[key] = pool
+        return pool
+
+def mikrotik_connection(settings: Optional[Dict[str, Any]] = None):
+    """Mượn kết nối MikroTik từ pool dùng chung
+    
+    Sử dụng:
+        with mikrotik_connection() as api:
+            if not api:
+                ...  # Không thể kết nối
+    """
+    return get_connection_pool(settings).connection()
+
+def get_connection_pool_stats() -> List[Dict[str, Any]]:
+    """Lấy số liệu của mọi pool kết nối"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+def get_mac_address(interface: str, api=None) -> Optional[str]:
     """Lấy địa chỉ MAC của interface"""
+    if api is None:
+        with mikrotik_connection() as api:
+            return get_mac_address(interface, api) if api else None
+    
     try:
-        api = get_mikrotik_connection()
-        if not api:
-            return None
+        from librouteros.query import Key
         
         # Lấy thông tin interface
         interface_data = api.path('interface').select('mac-address').where(Key('name') == interface).get()
@@ -90,22 +147,50 @@ def get_mac_address(interface: str) -> Optional[str]:
         logger.error(f"Lỗi khi lấy MAC address của interface {interface}: {str(e)}")
         return None
 
+# Các trường /ip/arp cần cho việc đánh giá độ mới của dòng ARP
+ARP_LIVENESS_FIELDS = ('address', 'mac-address', 'last-seen', 'status', 'complete', 'invalid', 'disabled')
+
+def _fetch_arp_table() -> List[Dict[str, Any]]:
+    """Đọc bảng ARP của router cho backend liveness dự phòng"""
+    with mikrotik_connection() as api:
+        if not api:
+            return []
+        return list(api.path('ip', 'arp').select(*ARP_LIVENESS_FIELDS).get())
+
+_liveness_prober: Optional[LivenessProber] = None
+_liveness_lock = threading.Lock()
+
+def get_liveness_prober() -> LivenessProber:
+    """Lấy bộ kiểm tra liveness dùng chung: ICMP datagram, dự phòng bằng bảng ARP"""
+    global _liveness_prober
+    with _liveness_lock:
+        if _liveness_prober is None:
+            _liveness_prober = LivenessProber(
+                backend=IcmpDatagramBackend(),
+                fallback=ArpTableBackend(_fetch_arp_table),
+                max_in_flight=int(os.getenv('LIVENESS_MAX_IN_FLIGHT', 256)),
+                timeout=float(os.getenv('LIVENESS_TIMEOUT', 1.0))
+            )
+        return _liveness_prober
+
 def is_ip_active(ip_address: str) -> bool:
     """Kiểm tra xem IP có đang hoạt động không"""
     try:
-        # Ping để kiểm tra
-        response = os.system(f"ping -c 1 -W 1 {ip_address} > /dev/null 2>&1")
-        return response == 0
+        return get_liveness_prober().is_alive(ip_address)
     except Exception as e:
         logger.error(f"Lỗi khi kiểm tra trạng thái IP {ip_address}: {str(e)}")
         return False
 
-def get_interface_traffic(interface: str, direction: str = 'both') -> Dict[str, int]:
+def get_interface_traffic(interface: str, direction: str = 'both', api=None) -> Dict[str, int]:
     """Lấy thông tin traffic của interface"""
+    if api is None:
+        with mikrotik_connection() as api:
+            if not api:
+                return {'in': 0, 'out': 0} if direction == 'both' else 0
+            return get_interface_traffic(interface, direction, api)
+    
     try:
-        api = get_mikrotik_connection()
-        if not api:
-            return {'in': 0, 'out': 0} if direction == 'both' else 0
+        from librouteros.query import Key
         
         # Lấy thống kê interface
         interface_data = api.path('interface').select('rx-byte', 'tx-byte').where(Key('name') == interface).get()
@@ -126,14 +211,16 @@ def get_interface_traffic(interface: str, direction: str = 'both') -> Dict[str,
         logger.error(f"Lỗi khi lấy traffic của interface {interface}: {str(e)}")
         return {'in': 0, 'out': 0} if direction == 'both' else 0
 
-def get_last_seen(ip_address: str) -> Optional[str]:
+def get_last_seen(ip_address: str, api=None) -> Optional[str]:
     """Lấy thời điểm cuối cùng IP được nhìn thấy"""
+    if api is None:
+        with mikrotik_connection() as api:
+            return get_last_seen(ip_address, api) if api else None
+    
     try:
-        # Lấy từ bảng ARP
-        api = get_mikrotik_connection()
-        if not api:
-            return None
+        from librouteros.query import Key
         
+        # Lấy từ bảng ARP
         arp_data = api.path('ip', 'arp').select('last-seen').where(Key('address') == ip_address).get()
         if arp_data:
             return arp_data[0].get('last-seen')
@@ -143,84 +230,99 @@ def get_last_seen(ip_address: str) -> Optional[str]:
         logger.error(f"Lỗi khi lấy last seen của IP {ip_address}: {str(e)}")
         return None
 
-def is_ip_monitored(ip_address: str) -> bool:
-    """Kiểm tra xem IP có đang được giám sát không"""
+def check_ips_active(ip_addresses: Iterable[str],
+                     arp_rows: Optional[List[Dict[str, Any]]] = None) -> Dict[str, bool]:
+    """Kiểm tra trạng thái nhiều IP song song, trả về dict IP -> đang hoạt động
+    
+    Nếu đã có sẵn bảng ARP (arp_rows) thì dùng luôn làm dự phòng thay vì
+    đọc lại từ router.
+    """
     try:
-        conn = sqlite3.connect('data/ip_monitoring.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT monitoring
-            FROM ip_monitoring
-            WHERE ip_address = ?
-        ''', (ip_address,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        return bool(row and row[0])
+        fallback = ArpTableBackend(lambda: arp_rows) if arp_rows is not None else None
+        return get_liveness_prober().check(ip_addresses, fallback)
     except Exception as e:
-        logger.error(f"Lỗi khi kiểm tra monitoring của IP {ip_address}: {str(e)}")
-        return False
+        logger.error(f"Lỗi khi kiểm tra trạng thái các IP: {str(e)}")
+        return {}
+
+def build_ip_snapshot(api, addresses: Optional[List[Dict[str, Any]]] = None,
+                      status_func: Optional[Callable[[Iterable[str]], Dict[str, bool]]] = None,
+                      monitored: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """Tạo danh sách IP kèm thông tin interface, ARP và trạng thái giám sát
+    
+    Thay vì truy vấn thiết bị nhiều lần cho mỗi IP, hàm đọc /ip/address,
+    /interface và /ip/arp mỗi bảng một lần, lấy tập IP đang giám sát bằng
+    một truy vấn SQLite rồi ghép dữ liệu trong bộ nhớ qua các dict index.
+    Bảng ARP vừa đọc cũng được dùng làm dự phòng cho kiểm tra liveness.
+    
+    Args:
+        api: Kết nối RouterOS
+        addresses (list): Các dòng /ip/address đã lọc sẵn; mặc định đọc toàn bộ
+        status_func: Hàm nhận danh sách IP và trả về dict IP -> đang hoạt động
+        monitored (set): Tập IP đang giám sát; mặc định đọc từ cơ sở dữ liệu
+        
+    Returns:
+        list: Dữ liệu từng IP theo định dạng của /api/ip/list
+    """
+    if addresses is None:
+        addresses = api.path('ip', 'address').get()
+    if monitored is None:
+        monitored = ip_monitoring.get_monitored_ips()
+    
+    # Index interface theo tên và ARP theo địa chỉ IP
+    interfaces = {
+        row.get('name'): row
+        for row in api.path('interface').select('name', 'mac-address', 'rx-byte', 'tx-byte').get()
+    }
+    arp_rows = list(api.path('ip', 'arp').select(*ARP_LIVENESS_FIELDS).get())
+    arp_by_address = {}
+    for row in arp_rows:
+        arp_by_address.setdefault(row.get('address'), row)
+    
+    hosts = [host_address(ip.get('address')) for ip in addresses]
+    if status_func is None:
+        statuses = check_ips_active(hosts, arp_rows=arp_rows)
+    else:
+        statuses = status_func(hosts)
+    
+    ips = []
+    for ip in addresses:
+        address = ip.get('address')
+        host = host_address(address)
+        interface = interfaces.get(ip.get('interface'), {})
+        arp = arp_by_address.get(host, {})
+        
+        ips.append({
+            'address': address,
+            'interface': ip.get('interface'),
+            'mac_address': interface.get('mac-address'),
+            'status': 'active' if statuses.get(host) else 'inactive',
+            'traffic_in': interface.get('rx-byte', 0),
+            'traffic_out': interface.get('tx-byte', 0),
+            'last_seen': arp.get('last-seen'),
+            'monitoring': address in monitored
+        })
+    
+    return ips
+
+def is_ip_monitored(ip_address: str) -> bool:
+    """Kiểm tra xem IP có đang được giám sát không"""
+    return ip_monitoring.is_ip_monitored(ip_address)
 
 def enable_ip_monitoring(ip_address: str) -> bool:
     """Bật giám sát cho một IP"""
-    try:
-        conn = sqlite3.connect('data/ip_monitoring.db')
-        cursor = conn.cursor()
-        
-        # Cập nhật hoặc thêm mới
-        cursor.execute('''
-            INSERT OR REPLACE INTO ip_monitoring (ip_address, monitoring)
-            VALUES (?, 1)
-        ''', (ip_address,))
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Đã bật monitoring cho IP {ip_address}")
-        return True
-    except Exception as e:
-        logger.error(f"Lỗi khi bật monitoring cho IP {ip_address}: {str(e)}")
-        return False
+    return ip_monitoring.enable_ip_monitoring(ip_address)
 
 def disable_ip_monitoring(ip_address: str) -> bool:
     """Tắt giám sát cho một IP"""
-    try:
-        conn = sqlite3.connect('data/ip_monitoring.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE ip_monitoring
-            SET monitoring = 0
-            WHERE ip_address = ?
-        ''', (ip_address,))
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Đã tắt monitoring cho IP {ip_address}")
-        return True
-    except Exception as e:
-        logger.error(f"Lỗi khi tắt monitoring cho IP {ip_address}: {str(e)}")
-        return False
+    return ip_monitoring.disable_ip_monitoring(ip_address)
 
-def get_traffic_chart_data() -> Dict[str, List[Dict[str, Any]]]:
-    """Lấy dữ liệu cho biểu đồ traffic"""
+def get_traffic_chart_data(hours: int = 24, max_points: int = 300) -> Dict[str, List[Dict[str, Any]]]:
+    """Lấy dữ liệu cho biểu đồ traffic (tổng các IP, tối đa max_points điểm)"""
     try:
-        conn = sqlite3.connect('data/ip_monitoring.db')
-        cursor = conn.cursor()
-        
-        # Lấy dữ liệu traffic trong 24 giờ qua
-        cursor.execute('''
-            SELECT ip_address, bytes_in, bytes_out, timestamp
-            FROM ip_traffic
-            WHERE timestamp >= datetime('now', '-24 hours')
-            ORDER BY timestamp ASC
-        ''')
-        
-        data = cursor.fetchall()
-        conn.close()
+        # Lấy dữ liệu traffic trong `hours` giờ qua từ mức gộp phù hợp rồi giảm điểm bằng LTTB
+        data = ip_monitoring.get_traffic_rollup().series(
+            hours * 3600, max_points=max_points * MINMAX_PRESELECT_RATIO)
+        data = downsample_points(data, max_points)
         
         # Xử lý dữ liệu cho biểu đồ
         result = {
@@ -230,20 +332,20 @@ def get_traffic_chart_data() -> Dict[str, List[Dict[str, Any]]]:
         
         if data:
             # Tạo nhãn thời gian
-            result['labels'] = [row[3] for row in data]
+            result['labels'] = [row['timestamp'] for row in data]
             
             # Tạo datasets cho bytes in/out
             result['datasets'] = [
                 {
                     'label': 'Traffic In',
-                    'data': [row[1] for row in data],
+                    'data': [row['bytes_in'] for row in data],
                     'borderColor': '#2196f3',
                     'backgroundColor': 'rgba(33, 150, 243, 0.1)',
                     'fill': True
                 },
                 {
                     'label': 'Traffic Out',
-                    'data': [row[2] for row in data],
+                    'data': [row['bytes_out'] for row in data],
                     'borderColor': '#4caf50',
                     'backgroundColor': 'rgba(76, 175, 80, 0.1)',
                     'fill': True
@@ -258,20 +360,14 @@ def get_traffic_chart_data() -> Dict[str, List[Dict[str, Any]]]:
 def get_ip_distribution_data() -> Dict[str, List[Any]]:
     """Lấy dữ liệu phân bố IP"""
     try:
-        conn = sqlite3.connect('data/ip_monitoring.db')
-        cursor = conn.cursor()
-        
         # Lấy thống kê trạng thái
-        cursor.execute('''
+        data = ip_monitoring.get_storage().query('''
             SELECT status, COUNT(*) as count
             FROM ip_monitoring
             WHERE monitoring = 1
             GROUP BY status
         ''')
         
-        data = cursor.fetchall()
-        conn.close()
-        
         # Xử lý dữ liệu cho biểu đồ
         labels = []
         values = []
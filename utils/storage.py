@@ -0,0 +1,370 @@
+"""
+Module truy cập SQLite dùng chung
+
+- Mỗi luồng giữ một kết nối riêng, mở một lần và dùng lại
+- Chế độ WAL cho phép luồng giám sát ghi trong khi các request Flask đọc
+- Câu lệnh được SQLite cache sẵn (prepared) nhờ cached_statements
+- Lược đồ được nâng cấp qua migrate() theo PRAGMA user_version
+- BatchWriter gom các lệnh ghi nhỏ thành transaction lớn ở luồng nền
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Union
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# Mỗi migration là một câu SQL hoặc hàm nhận kết nối; thứ tự = phiên bản lược đồ
+Migration = Union[str, Sequence[str], Callable[[sqlite3.Connection], None]]
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,   # ~16 MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000
+}
+
+
+class SQLiteStorage:
+    """Kết nối SQLite theo từng luồng với pragma đã tinh chỉnh
+    
+    Args:
+        db_path (str): Đường dẫn file cơ sở dữ liệu
+        migrations (list): Danh sách migration theo thứ tự phiên bản
+        pragmas (dict): Pragma áp dụng cho mỗi kết nối mới
+        cached_statements (int): Số câu lệnh prepared được cache mỗi kết nối
+    """
+    
+    def __init__(self, db_path: str, migrations: Optional[List[Migration]] = None,
+                 pragmas: Optional[dict] = None, cached_statements: int = 256):
+        self.db_path = db_path
+        self.migrations = list(migrations or [])
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.cached_statements = cached_statements
+        
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+    
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas['busy_timeout'] / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+    
+    def connection(self) -> sqlite3.Connection:
+        """Lấy kết nối của luồng hiện tại (mở mới nếu chưa có)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        """Thực thi trong một transaction; rollback nếu có lỗi"""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+        """Thực thi một câu lệnh ghi và commit"""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+    
+    def executemany(self, sql: str, rows: Iterable[Sequence[Any]]) -> sqlite3.Cursor:
+        """Ghi nhiều dòng trong một transaction"""
+        with self.transaction() as conn:
+            return conn.executemany(sql, rows)
+    
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        """Thực thi câu lệnh đọc, trả về mọi dòng"""
+        return self.connection().execute(sql, params).fetchall()
+    
+    def query_one(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        """Thực thi câu lệnh đọc, trả về dòng đầu tiên"""
+        return self.connection().execute(sql, params).fetchone()
+    
+    def schema_version(self) -> int:
+        return self.query_one('PRAGMA user_version')[0]
+    
+    def migrate(self) -> int:
+        """Áp dụng các migration chưa chạy, trả về phiên bản lược đồ hiện tại"""
+        conn = self.connection()
+        version = self.schema_version()
+        for target, migration in enumerate(self.migrations[version:], start=version + 1):
+            with self.transaction():
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in ([migration] if isinstance(migration, str) else migration):
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {target}')
+            logger.info(f"Đã nâng cấp lược đồ {self.db_path} lên phiên bản {target}")
+        return max(version, len(self.migrations))
+    
+    def close(self) -> None:
+        """Đóng kết nối của luồng hiện tại"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+    
+    def close_all(self) -> None:
+        """Đóng mọi kết nối đã mở (khi tắt ứng dụng)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug(f"Lỗi khi đóng kết nối SQLite: {str(e)}")
+        self._local = threading.local()
+
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class BatchWriter:
+    """Hàng đợi ghi nền: gom các câu INSERT/UPDATE thành transaction executemany
+    
+    Một luồng ghi riêng lấy tối đa `batch_size` dòng, hoặc những gì có sau
+    `flush_interval` giây kể từ dòng cũ nhất, rồi ghi trong một transaction
+    (mỗi câu SQL một lần executemany, giữ thứ tự xuất hiện).
+    
+    Khi hàng đợi đạt `max_backlog` dòng, chính sách `overflow` quyết định:
+    - 'drop_oldest': bỏ dòng cũ nhất để nhận dòng mới (mặc định, hợp với số liệu)
+    - 'drop_newest': từ chối dòng mới, submit() trả về False
+    - 'block': chờ tối đa `block_timeout` giây, hết hạn thì từ chối dòng mới
+    """
+    
+    def __init__(self, storage: SQLiteStorage, name: str = 'writer',
+                 batch_size: int = 500, flush_interval: float = 1.0,
+                 max_backlog: int = 50000, overflow: str = 'drop_oldest',
+                 block_timeout: float = 1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Chính sách tràn hàng đợi không hợp lệ: {overflow}")
+        
+        self.storage = storage
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._flush_requests = 0
+        self._closing = False
+        self._thread = None
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+            'max_queue_depth': 0,
+            'flush_latency_last': 0.0,
+            'flush_latency_max': 0.0,
+            'flush_latency_total': 0.0,
+            'queue_delay_max': 0.0
+        }
+    
+    def start(self) -> 'BatchWriter':
+        """Khởi động luồng ghi (gọi lại nhiều lần không sao)"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True)
+                self._thread.start()
+        return self
+    
+    def submit(self, sql: str, params: Sequence[Any] = ()) -> bool:
+        """Đưa một dòng vào hàng đợi ghi; trả về False nếu dòng bị từ chối"""
+        with self._cond:
+            if self._closing or self._thread is None:
+                closed = True
+            else:
+                closed = False
+                if len(self._queue) >= self.max_backlog and not self._make_room_locked():
+                    self._metrics['dropped'] += 1
+                    return False
+                self._queue.append((sql, params, time.monotonic()))
+                self._metrics['enqueued'] += 1
+                depth = len(self._queue)
+                if depth > self._metrics['max_queue_depth']:
+                    self._metrics['max_queue_depth'] = depth
+                if depth == 1 or depth >= min(self.batch_size, self.max_backlog):
+                    self._cond.notify_all()
+        
+        if closed:
+            # Luồng ghi đã dừng (đang tắt ứng dụng): ghi trực tiếp
+            try:
+                self.storage.execute(sql, params)
+                return True
+            except Exception as e:
+                logger.error(f"Lỗi khi ghi trực tiếp ({self.name}): {str(e)}")
+                return False
+        return True
+    
+    def _make_room_locked(self) -> bool:
+        """Xử lý hàng đợi đầy theo chính sách tràn (gọi khi đang giữ lock)"""
+        if self.overflow == 'drop_oldest':
+            self._warn_overflow()
+            self._queue.popleft()
+            self._metrics['dropped'] += 1
+            return True
+        if self.overflow == 'block':
+            # Đánh thức luồng ghi để ghi ngay thay vì chờ hết cửa sổ thời gian
+            self._cond.notify_all()
+            deadline = time.monotonic() + self.block_timeout
+            while len(self._queue) >= self.max_backlog and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if len(self._queue) < self.max_backlog:
+                return True
+        self._warn_overflow()
+        return False
+    
+    def _warn_overflow(self) -> None:
+        # Chỉ cảnh báo ở lần tràn đầu tiên và mỗi 1000 dòng bị bỏ sau đó
+        if self._metrics['dropped'] % 1000 == 0:
+            logger.warning(f"Hàng đợi ghi {self.name} đầy ({self.max_backlog} dòng), "
+                           f"bỏ dòng theo chính sách {self.overflow} (đã bỏ {self._metrics['dropped']})")
+    
+    def _next_batch(self) -> Optional[list]:
+        """Chờ đến khi đủ batch, hết cửa sổ thời gian, có yêu cầu flush hoặc đang tắt"""
+        with self._cond:
+            while not self._queue:
+                if self._closing:
+                    return None
+                self._cond.wait()
+            
+            deadline = self._queue[0][2] + self.flush_interval
+            while (len(self._queue) < min(self.batch_size, self.max_backlog)
+                   and not self._closing and not self._flush_requests):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            
+            count = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._in_flight = count
+            # Có chỗ trống cho submit() đang chờ theo chính sách 'block'
+            self._cond.notify_all()
+            return batch
+    
+    def _write(self, batch: list) -> bool:
+        # Gom theo câu SQL, giữ thứ tự xuất hiện đầu tiên
+        groups = {}
+        for sql, params, _ in batch:
+            groups.setdefault(sql, []).append(params)
+        try:
+            with self.storage.transaction() as conn:
+                for sql, rows in groups.items():
+                    conn.executemany(sql, rows)
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi khi ghi {len(batch)} dòng ({self.name}): {str(e)}")
+            return False
+    
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            
+            start = time.monotonic()
+            ok = self._write(batch)
+            latency = time.monotonic() - start
+            
+            with self._cond:
+                metrics = self._metrics
+                metrics['written' if ok else 'failed'] += len(batch)
+                metrics['flushes'] += 1
+                metrics['flush_latency_last'] = latency
+                metrics['flush_latency_total'] += latency
+                metrics['flush_latency_max'] = max(metrics['flush_latency_max'], latency)
+                metrics['queue_delay_max'] = max(metrics['queue_delay_max'], start - batch[0][2])
+                self._in_flight = 0
+                self._cond.notify_all()
+        
+        self.storage.close()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ghi ngay mọi dòng đang chờ; trả về False nếu hết thời gian chờ"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                return not self._queue
+            self._flush_requests += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flush_requests -= 1
+    
+    def close(self, timeout: Optional[float] = 10) -> None:
+        """Ghi nốt hàng đợi rồi dừng luồng ghi (gọi khi tắt ứng dụng)"""
+        with self._cond:
+            thread = self._thread
+            self._closing = True
+            self._cond.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"Luồng ghi {self.name} chưa dừng sau {timeout} giây, "
+                               f"còn {len(self._queue)} dòng chưa ghi")
+    
+    def stats(self) -> dict:
+        """Độ sâu hàng đợi và độ trễ ghi để theo dõi khi đĩa không theo kịp"""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update({
+                'name': self.name,
+                'queue_depth': len(self._queue),
+                'in_flight': self._in_flight,
+                'max_backlog': self.max_backlog,
+                'overflow': self.overflow,
+                'oldest_age': time.monotonic() - self._queue[0][2] if self._queue else 0.0,
+                'running': self._thread is not None and self._thread.is_alive()
+            })
+        flushes = stats['flushes']
+        stats['flush_latency_avg'] = stats['flush_latency_total'] / flushes if flushes else 0.0
+        return stats
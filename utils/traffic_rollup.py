@@ -0,0 +1,245 @@
+"""
+Module lưu giữ và gộp (rollup) dữ liệu ip_traffic theo nhiều mức thời gian
+
+- Mẫu thô trong ip_traffic chỉ giữ `raw_retention` giây
+- Các mức gộp 1 phút, 15 phút và 1 ngày lưu tổng, min, max và số mẫu
+  (trung bình = tổng / số mẫu) trong bảng ip_traffic_rollup
+- Việc gộp chạy tăng dần theo id của ip_traffic (watermark), nên mỗi mẫu
+  chỉ được cộng vào mỗi mức đúng một lần, kể cả khi ghi trễ
+- Truy vấn biểu đồ/lịch sử tự chọn mức thô nhất cần thiết để vừa khoảng
+  thời gian và số điểm yêu cầu
+"""
+
+import os
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+# Các mức gộp từ mịn đến thô: độ phân giải (giây) và thời gian lưu giữ (giây)
+TIERS = [
+    {'name': '1m', 'resolution': 60, 'retention': 7 * DAY},
+    {'name': '15m', 'resolution': 900, 'retention': 90 * DAY},
+    {'name': '1d', 'resolution': DAY, 'retention': 5 * 365 * DAY}
+]
+
+DEFAULT_RAW_RETENTION = float(os.getenv('IP_TRAFFIC_RAW_RETENTION_HOURS', 48)) * 3600
+
+# Migration tạo bảng rollup (dùng trong ip_monitoring.MIGRATIONS)
+MIGRATION = [
+    '''
+    CREATE TABLE IF NOT EXISTS ip_traffic_rollup (
+        resolution INTEGER NOT NULL,
+        ip_address TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        sum_in INTEGER NOT NULL,
+        min_in INTEGER NOT NULL,
+        max_in INTEGER NOT NULL,
+        sum_out INTEGER NOT NULL,
+        min_out INTEGER NOT NULL,
+        max_out INTEGER NOT NULL,
+        PRIMARY KEY (resolution, ip_address, bucket)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_ip_traffic_rollup_bucket ON ip_traffic_rollup (resolution, bucket)',
+    'CREATE INDEX IF NOT EXISTS idx_ip_traffic_timestamp ON ip_traffic (timestamp)',
+    '''
+    CREATE TABLE IF NOT EXISTS ip_traffic_rollup_state (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    )
+    '''
+]
+
+_UPSERT_SQL = '''
+    INSERT INTO ip_traffic_rollup
+        (resolution, ip_address, bucket, samples, sum_in, min_in, max_in, sum_out, min_out, max_out)
+    SELECT ?1, ip_address, CAST(strftime('%s', timestamp) AS INTEGER) / ?1 * ?1,
+           COUNT(*), SUM(bytes_in), MIN(bytes_in), MAX(bytes_in),
+           SUM(bytes_out), MIN(bytes_out), MAX(bytes_out)
+    FROM ip_traffic
+    WHERE id > ?2 AND id <= ?3 AND timestamp IS NOT NULL
+    GROUP BY ip_address, 3
+    ON CONFLICT (resolution, ip_address, bucket) DO UPDATE SET
+        samples = samples + excluded.samples,
+        sum_in = sum_in + excluded.sum_in,
+        min_in = MIN(min_in, excluded.min_in),
+        max_in = MAX(max_in, excluded.max_in),
+        sum_out = sum_out + excluded.sum_out,
+        min_out = MIN(min_out, excluded.min_out),
+        max_out = MAX(max_out, excluded.max_out)
+'''
+
+
+class TrafficRollup:
+    """Duy trì các mức gộp của ip_traffic và chọn mức phù hợp khi truy vấn
+
+    Args:
+        storage: SQLiteStorage của cơ sở dữ liệu giám sát IP
+        raw_retention (float): Thời gian giữ mẫu thô (giây)
+        tiers (list): Các mức gộp, mặc định TIERS
+        batch_rows (int): Số mẫu thô tối đa gộp trong một transaction
+    """
+
+    def __init__(self, storage, raw_retention: float = DEFAULT_RAW_RETENTION,
+                 tiers: Optional[List[Dict[str, Any]]] = None, batch_rows: int = 50000):
+        self.storage = storage
+        self.raw_retention = raw_retention
+        self.tiers = sorted(tiers or TIERS, key=lambda tier: tier['resolution'])
+        self.batch_rows = batch_rows
+
+    def _watermark(self, conn) -> int:
+        row = conn.execute("SELECT last_id FROM ip_traffic_rollup_state WHERE name = 'ip_traffic'").fetchone()
+        return row[0] if row else 0
+
+    def rollup(self) -> int:
+        """Cộng các mẫu thô mới vào mọi mức gộp, trả về số mẫu đã xử lý"""
+        processed = 0
+        conn = self.storage.connection()
+        while True:
+            # BEGIN IMMEDIATE để hai tiến trình không cộng trùng cùng một đoạn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                last_id = self._watermark(conn)
+                row = conn.execute('''
+                    SELECT COUNT(*), MAX(id) FROM (
+                        SELECT id FROM ip_traffic WHERE id > ? ORDER BY id LIMIT ?
+                    )
+                ''', (last_id, self.batch_rows)).fetchone()
+                count, max_id = row
+                if not count:
+                    conn.rollback()
+                    break
+
+                for tier in self.tiers:
+                    conn.execute(_UPSERT_SQL, (tier['resolution'], last_id, max_id))
+                conn.execute('''
+                    INSERT INTO ip_traffic_rollup_state (name, last_id) VALUES ('ip_traffic', ?)
+                    ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id
+                ''', (max_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            processed += count
+            if count < self.batch_rows:
+                break
+        return processed
+
+    def prune(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Xóa mẫu thô đã gộp và các bucket quá thời gian lưu giữ"""
+        now = time.time() if now is None else now
+        deleted = {}
+        with self.storage.transaction() as conn:
+            last_id = self._watermark(conn)
+            cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - self.raw_retention))
+            # Chỉ xóa mẫu thô đã được cộng vào các mức gộp
+            deleted['raw'] = conn.execute(
+                'DELETE FROM ip_traffic WHERE id <= ? AND timestamp < ?', (last_id, cutoff)
+            ).rowcount
+            for tier in self.tiers:
+                deleted[tier['name']] = conn.execute(
+                    'DELETE FROM ip_traffic_rollup WHERE resolution = ? AND bucket < ?',
+                    (tier['resolution'], int(now - tier['retention']))
+                ).rowcount
+        return deleted
+
+    def run(self) -> Dict[str, int]:
+        """Một lượt bảo trì: gộp mẫu mới rồi dọn dữ liệu cũ"""
+        processed = self.rollup()
+        deleted = self.prune()
+        return {'rolled_up': processed, **{f'deleted_{name}': count for name, count in deleted.items()}}
+
+    def _raw_points(self, start: str, ip_address: Optional[str]) -> int:
+        if ip_address:
+            row = self.storage.query_one(
+                'SELECT COUNT(*) FROM ip_traffic WHERE ip_address = ? AND timestamp >= ?',
+                (ip_address, start))
+        else:
+            row = self.storage.query_one(
+                'SELECT COUNT(DISTINCT timestamp) FROM ip_traffic WHERE timestamp >= ?', (start,))
+        return row[0]
+
+    def select_resolution(self, window: float, max_points: int,
+                          ip_address: Optional[str] = None) -> int:
+        """Chọn mức dữ liệu cho khoảng `window` giây với tối đa `max_points` điểm
+
+        Trả về 0 cho mẫu thô, ngược lại là độ phân giải (giây) của mức gộp:
+        mức mịn nhất còn lưu đủ khoảng thời gian mà không vượt số điểm.
+        """
+        if window <= self.raw_retention:
+            start = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - window))
+            if self._raw_points(start, ip_address) <= max_points:
+                return 0
+        for tier in self.tiers:
+            if window <= tier['retention'] and window / tier['resolution'] <= max_points:
+                return tier['resolution']
+        return self.tiers[-1]['resolution']
+
+    def series(self, window: float, ip_address: Optional[str] = None,
+               max_points: int = 500) -> List[Dict[str, Any]]:
+        """Chuỗi traffic trong `window` giây gần nhất
+
+        Mỗi điểm có bytes_in/bytes_out (trung bình trong bucket), min/max và
+        số mẫu. Khi không chỉ định IP, giá trị là tổng của các IP.
+        """
+        resolution = self.select_resolution(window, max_points, ip_address)
+        since = time.time() - window
+
+        if resolution == 0:
+            start = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(since))
+            if ip_address:
+                rows = self.storage.query('''
+                    SELECT timestamp, bytes_in, bytes_out, bytes_in, bytes_in, bytes_out, bytes_out, 1
+                    FROM ip_traffic
+                    WHERE ip_address = ? AND timestamp >= ?
+                    ORDER BY timestamp ASC
+                ''', (ip_address, start))
+            else:
+                rows = self.storage.query('''
+                    SELECT timestamp, SUM(bytes_in), SUM(bytes_out), SUM(bytes_in), SUM(bytes_in),
+                           SUM(bytes_out), SUM(bytes_out), COUNT(*)
+                    FROM ip_traffic
+                    WHERE timestamp >= ?
+                    GROUP BY timestamp
+                    ORDER BY timestamp ASC
+                ''', (start,))
+        else:
+            bucket_start = int(since) // resolution * resolution
+            if ip_address:
+                rows = self.storage.query('''
+                    SELECT datetime(bucket, 'unixepoch'),
+                           sum_in * 1.0 / samples, sum_out * 1.0 / samples,
+                           min_in, max_in, min_out, max_out, samples
+                    FROM ip_traffic_rollup
+                    WHERE resolution = ? AND ip_address = ? AND bucket >= ?
+                    ORDER BY bucket ASC
+                ''', (resolution, ip_address, bucket_start))
+            else:
+                rows = self.storage.query('''
+                    SELECT datetime(bucket, 'unixepoch'),
+                           SUM(sum_in * 1.0 / samples), SUM(sum_out * 1.0 / samples),
+                           SUM(min_in), SUM(max_in), SUM(min_out), SUM(max_out), SUM(samples)
+                    FROM ip_traffic_rollup
+                    WHERE resolution = ? AND bucket >= ?
+                    GROUP BY bucket
+                    ORDER BY bucket ASC
+                ''', (resolution, bucket_start))
+
+        return [{
+            'timestamp': row[0],
+            'bytes_in': row[1],
+            'bytes_out': row[2],
+            'min_in': row[3],
+            'max_in': row[4],
+            'min_out': row[5],
+            'max_out': row[6],
+            'samples': row[7],
+            'resolution': resolution
+        } for row in rows]